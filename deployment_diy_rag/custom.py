@@ -13,10 +13,16 @@
 # limitations under the License.
 
 # mypy: ignore-errors
+import contextvars
 import json
+import math
 import os
 import sys
+import time
 import traceback
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Optional
 
 import pandas as pd
 import yaml
@@ -24,54 +30,130 @@ from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains.history_aware_retriever import (
     create_history_aware_retriever,
 )
-from langchain.chains.retrieval import create_retrieval_chain
 from langchain_community.callbacks import get_openai_callback
-from langchain_community.embeddings.sentence_transformer import (
-    SentenceTransformerEmbeddings,
-)
-from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import (
     ChatPromptTemplate,
     MessagesPlaceholder,
 )
 from langchain_core.runnables import Runnable
-from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_openai import AzureChatOpenAI
 from pandas import DataFrame
 
 sys.path.append("../")
 from docsassist.credentials import AzureOpenAICredentials
-from docsassist.schema import PROMPT_COLUMN_NAME, TARGET_COLUMN_NAME, RAGModelSettings
+from docsassist.extractive import extractive_answer
+from docsassist.index_registry import (
+    DEFAULT_INDEX_NAME,
+    IndexRegistry,
+    RegistryRetriever,
+    RetrievalInfo,
+    current_index_name,
+    current_retrieval_info,
+)
+from docsassist.index_versions import IndexWatcher
+from docsassist.memory_report import log_memory_report
+from docsassist.metadata_filter import RetrievalFilter, current_retrieval_filter
+from docsassist.prefork import PreforkSettings, preload, preloaded
+from docsassist.profiling import RequestProfiler
+from docsassist.resilience import CircuitBreaker, DeadlinePool, LLMGuard
+from docsassist.schema import (
+    DEGRADED_COLUMN_NAME,
+    INDEX_NAME_COLUMN_NAME,
+    INDEX_VERSION_COLUMN_NAME,
+    LLM_ATTEMPTS_COLUMN_NAME,
+    LLM_CIRCUIT_STATE_COLUMN_NAME,
+    LLM_RETRIES_COLUMN_NAME,
+    PROMPT_COLUMN_NAME,
+    RETRIEVAL_FILTER_COLUMN_NAME,
+    TARGET_COLUMN_NAME,
+    RAGModelSettings,
+)
+from docsassist.vectordb import load_embeddings
 
 
-def get_chain(
-    input_dir, credentials: AzureOpenAICredentials, model_settings: RAGModelSettings
-):
-    """Instantiate the RAG chain."""
-    embedding_function = SentenceTransformerEmbeddings(
-        model_name=model_settings.embedding_model_name,
-        cache_folder=input_dir + "/sentencetransformers",
-    )
-    db = FAISS.load_local(
-        folder_path=input_dir + "/faiss_db",
-        embeddings=embedding_function,
-        allow_dangerous_deserialization=True,
-    )
+@dataclass
+class RAGChain:
+    """Retrieval and answer generation, kept apart so generation can be bounded."""
+
+    retriever: Runnable
+    answer_chain: Runnable
+    indexes: IndexRegistry
+    embeddings: Embeddings
+    generation_pool: Optional[DeadlinePool] = None
+    index_watcher: Optional[IndexWatcher] = None
 
-    llm = AzureChatOpenAI(
-        deployment_name=credentials.azure_deployment,
-        azure_endpoint=credentials.azure_endpoint,
-        openai_api_version=credentials.api_version,
-        openai_api_key=credentials.api_key,
-        model_name=credentials.azure_deployment,
-        temperature=model_settings.temperature,
-        verbose=True,
+
+def get_llm_guard(model_settings: RAGModelSettings) -> LLMGuard:
+    """Retry policy and circuit breaker shared by all LLM calls of the model."""
+    return LLMGuard(
         max_retries=model_settings.max_retries,
-        request_timeout=model_settings.request_timeout,
+        backoff_base=model_settings.retry_backoff_base,
+        backoff_max=model_settings.retry_backoff_max,
+        breaker=CircuitBreaker(
+            failure_threshold=model_settings.circuit_failure_threshold,
+            reset_timeout=model_settings.circuit_reset_timeout,
+        ),
     )
-    retriever = VectorStoreRetriever(
-        vectorstore=db,
+
+
+def generation_workers(model_settings: RAGModelSettings) -> int:
+    """Threads for answers under a generation deadline.
+
+    Rows of a worker are scored one at a time, so at most one answer starts per
+    `generation_deadline`, and a late one runs until the request deadline.
+    """
+    if model_settings.generation_workers is not None:
+        return model_settings.generation_workers
+    request_deadline = model_settings.request_deadline or model_settings.request_timeout
+    return math.ceil(request_deadline / model_settings.generation_deadline) + 1
+
+
+def get_chain(
+    input_dir,
+    credentials: Optional[AzureOpenAICredentials],
+    model_settings: RAGModelSettings,
+    llm_guard: LLMGuard,
+    llm: Optional[BaseChatModel] = None,
+    embedding_function: Optional[Embeddings] = None,
+):
+    """Instantiate the RAG chain.
+
+    `llm` and `embedding_function` replace the Azure OpenAI client and the
+    sentence transformer, e.g. to run the model offline in tests and benchmarks.
+    """
+    assets = preloaded(input_dir)
+    if assets is not None:
+        db, embedding_function = assets
+    elif embedding_function is None:
+        embedding_function = load_embeddings(
+            input_dir, model_settings.embedding_model_name
+        )
+    indexes = IndexRegistry.from_env(input_dir, embedding_function)
+    if assets is not None:
+        indexes.pin(DEFAULT_INDEX_NAME, db)
+    elif DEFAULT_INDEX_NAME in indexes.names():
+        # the default index loads eagerly, named ones on first use
+        indexes.get(DEFAULT_INDEX_NAME)
+
+    if llm is None:
+        llm = AzureChatOpenAI(
+            deployment_name=credentials.azure_deployment,
+            azure_endpoint=credentials.azure_endpoint,
+            openai_api_version=credentials.api_version,
+            openai_api_key=credentials.api_key,
+            model_name=credentials.azure_deployment,
+            temperature=model_settings.temperature,
+            verbose=True,
+            # retries are handled by llm_guard so they can be classified and bounded
+            max_retries=0,
+            request_timeout=model_settings.request_timeout,
+        )
+    llm = llm_guard.wrap(llm)
+    retriever = RegistryRetriever(
+        registry=indexes, neighbor_window=model_settings.neighbor_window
     )
     system_template = model_settings.stuff_prompt
     contextualize_q_system_prompt = (
@@ -105,65 +187,184 @@ def get_chain(
     # into the LLM. Note that we can also use StuffDocumentsChain and other
     # instances of BaseCombineDocumentsChain.
     question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-    rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-    return rag_chain
+    return RAGChain(
+        retriever=history_aware_retriever,
+        answer_chain=question_answer_chain,
+        indexes=indexes,
+        embeddings=embedding_function,
+        generation_pool=(
+            DeadlinePool(generation_workers(model_settings), "rag-generation")
+            if model_settings.generation_deadline is not None
+            else None
+        ),
+    )
+
+
+def generate_answer(
+    chain: RAGChain,
+    model_settings: RAGModelSettings,
+    chain_input: dict,
+    started_at: float,
+) -> tuple[str, bool]:
+    """Run the answer chain, falling back to an extractive answer if it is late.
 
+    Returns the answer and whether it is degraded. Without a generation deadline
+    the chain runs inline and errors propagate as before.
+    """
+    if chain.generation_pool is None:
+        return chain.answer_chain.invoke(chain_input), False
 
-def load_model(input_dir):
-    """Load vector database and prepare chain."""
+    # copy the context so retry bookkeeping of the request follows the call
+    future = chain.generation_pool.submit(
+        contextvars.copy_context().run, chain.answer_chain.invoke, chain_input
+    )
+    # None when every thread is still busy with late answers
+    if future is not None:
+        remaining = model_settings.generation_deadline - (
+            time.monotonic() - started_at
+        )
+        try:
+            return future.result(timeout=max(remaining, 0)), False
+        except FutureTimeoutError:
+            # a running call can't be interrupted; it finishes in the background
+            # and is bounded by the request deadline
+            chain.generation_pool.abandon(future)
+        except Exception:
+            traceback.print_exc()
+    answer = extractive_answer(
+        chain_input["input"],
+        chain_input["context"],
+        chain.embeddings,
+        max_sentences=model_settings.degraded_answer_sentences,
+    )
+    return answer, True
+
+
+def read_model_settings(input_dir) -> RAGModelSettings:
     with open(os.path.join(input_dir, RAGModelSettings.filename())) as f:
-        model_settings = RAGModelSettings.model_validate(yaml.safe_load(f))
-    credentials = AzureOpenAICredentials()
-    chain = get_chain(input_dir, credentials=credentials, model_settings=model_settings)
-    return chain, model_settings
+        return RAGModelSettings.model_validate(yaml.safe_load(f))
 
 
-def score(data: pd.DataFrame, model: tuple[Runnable, RAGModelSettings], **kwargs):
-    """ "Orchestrate a RAG completion with our vector database."""
+def load_model(
+    input_dir,
+    llm: Optional[BaseChatModel] = None,
+    embedding_function: Optional[Embeddings] = None,
+):
+    """Load vector database and prepare chain.
+
+    Uses the assets preloaded at import time, if any, instead of loading them.
+    """
+    model_settings = read_model_settings(input_dir)
+    credentials = AzureOpenAICredentials() if llm is None else None
+    llm_guard = get_llm_guard(model_settings)
+    chain = get_chain(
+        input_dir,
+        credentials=credentials,
+        model_settings=model_settings,
+        llm_guard=llm_guard,
+        llm=llm,
+        embedding_function=embedding_function,
+    )
+    for name in chain.indexes.loaded():
+        log_memory_report(chain.indexes.get(name), chain.embeddings, chain)
+    # started per worker, never in a preloading parent whose threads forks lose
+    chain.index_watcher = IndexWatcher.from_env(chain.indexes, chain.embeddings)
+    # None unless enabled, so profiling adds no work to score() by default
+    profiler = RequestProfiler.from_env()
+    return chain, model_settings, llm_guard, profiler
 
-    chain, model_settings = model
 
-    full_result_dict: dict[str, list] = {TARGET_COLUMN_NAME: []}
+def score_row(
+    row: pd.Series,
+    chain: RAGChain,
+    model_settings: RAGModelSettings,
+    llm_guard: LLMGuard,
+) -> dict:
+    """Answer the question of a single input row."""
+    request_deadline = model_settings.request_deadline or model_settings.request_timeout
+    question = row[PROMPT_COLUMN_NAME]
+    chat_history = []
+    if "messages" in row:
+        messages = row["messages"]
+        messages = json.loads(messages)
+        for _, a in enumerate(messages):
+            message_dict = a
+            if message_dict["role"] == "user":
+                message = HumanMessage.validate(message_dict)
+            else:
+                message = AIMessage.validate(message_dict)
+            chat_history.append(message)
 
-    for i, row in data.iterrows():
-        question = row[PROMPT_COLUMN_NAME]
-        chat_history = []
-        if "messages" in row:
-            messages = row["messages"]
-            messages = json.loads(messages)
-            for _, a in enumerate(messages):
-                message_dict = a
-                if message_dict["role"] == "user":
-                    message = HumanMessage.validate(message_dict)
-                else:
-                    message = AIMessage.validate(message_dict)
-                chat_history.append(message)
+    index_name = row.get(INDEX_NAME_COLUMN_NAME)
+    # rows without an index name are NaN when others in the batch have one
+    index_token = current_index_name.set(None if pd.isna(index_name) else index_name)
+    filter_token = current_retrieval_filter.set(None)
+    retrieval_info = RetrievalInfo()
+    info_token = current_retrieval_info.set(retrieval_info)
 
+    result: dict = {}
+    started_at = time.monotonic()
+    with llm_guard.track(timeout=request_deadline) as llm_stats:
         try:
+            current_retrieval_filter.set(
+                RetrievalFilter.parse(row.get(RETRIEVAL_FILTER_COLUMN_NAME))
+            )
             with get_openai_callback():
-                chain_output = chain.invoke(
-                    {
-                        "input": question,
-                        "chat_history": chat_history,
-                    }
-                )
-            full_result_dict[TARGET_COLUMN_NAME].append(chain_output["answer"])
-            for i, doc in enumerate(chain_output["context"]):
-                if f"CITATION_CONTENT_{i}" not in full_result_dict:
-                    full_result_dict[f"CITATION_CONTENT_{i}"] = []
-                if f"CITATION_SOURCE_{i}" not in full_result_dict:
-                    full_result_dict[f"CITATION_SOURCE_{i}"] = []
-                if f"CITATION_PAGE_{i}" not in full_result_dict:
-                    full_result_dict[f"CITATION_PAGE_{i}"] = []
-                full_result_dict[f"CITATION_CONTENT_{i}"].append(doc.page_content)
-                full_result_dict[f"CITATION_SOURCE_{i}"].append(
-                    doc.metadata.get("source", "")
-                )
-                full_result_dict[f"CITATION_PAGE_{i}"].append(
-                    doc.metadata.get("page", "")
+                chain_input = {
+                    "input": question,
+                    "chat_history": chat_history,
+                }
+                chain_input["context"] = chain.retriever.invoke(chain_input)
+                answer, degraded = generate_answer(
+                    chain, model_settings, chain_input, started_at
                 )
+            result[TARGET_COLUMN_NAME] = answer
+            result[DEGRADED_COLUMN_NAME] = degraded
+            for i, doc in enumerate(chain_input["context"]):
+                result[f"CITATION_CONTENT_{i}"] = doc.page_content
+                result[f"CITATION_SOURCE_{i}"] = doc.metadata.get("source", "")
+                result[f"CITATION_PAGE_{i}"] = doc.metadata.get("page", "")
 
         except Exception:
-            full_result_dict[TARGET_COLUMN_NAME].append(traceback.format_exc())
+            result[TARGET_COLUMN_NAME] = traceback.format_exc()
+            result[DEGRADED_COLUMN_NAME] = False
+        finally:
+            current_index_name.reset(index_token)
+            current_retrieval_filter.reset(filter_token)
+            current_retrieval_info.reset(info_token)
+    result[INDEX_VERSION_COLUMN_NAME] = retrieval_info.index_version
+    result[LLM_ATTEMPTS_COLUMN_NAME] = llm_stats.attempts
+    result[LLM_RETRIES_COLUMN_NAME] = llm_stats.retries
+    result[LLM_CIRCUIT_STATE_COLUMN_NAME] = llm_guard.breaker.state.value
+    return result
+
+
+def score(
+    data: pd.DataFrame,
+    model: tuple[RAGChain, RAGModelSettings, LLMGuard, Optional[RequestProfiler]],
+    **kwargs,
+):
+    """ "Orchestrate a RAG completion with our vector database."""
+
+    chain, model_settings, llm_guard, profiler = model
+
+    results: list[dict] = []
+
+    for i, row in data.iterrows():
+        if profiler is None:
+            result = score_row(row, chain, model_settings, llm_guard)
+        else:
+            with profiler.profile(row.get("association_id", i)):
+                result = score_row(row, chain, model_settings, llm_guard)
+        results.append(result)
+
+    if not results:
+        return DataFrame({TARGET_COLUMN_NAME: []})
+    # rows can differ in their number of citations, missing values become NaN
+    return DataFrame.from_records(results)
+
 
-    return DataFrame(full_result_dict)
+if PreforkSettings().preload:
+    # servers that import the model before forking workers share these with them
+    _code_dir = os.path.dirname(os.path.abspath(__file__))
+    preload(_code_dir, read_model_settings(_code_dir).embedding_model_name)
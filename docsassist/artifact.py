@@ -0,0 +1,162 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A compact, content-addressed copy of the DIY RAG model files to upload.
+
+Only the files inference needs are kept: build-only files such as the file
+manifest are left out. From the sentence transformer cache, the weights in
+formats other than the one the model loads are dropped, along with the blobs
+that the Hugging Face cache duplicates as snapshot files. The weights can be
+stored in float16, which halves them; they are cast back to float32 when the
+model loads.
+
+The artifact is written to `<cache>/<hash>/`, where the hash covers the path
+and content of every input file. An unchanged model yields the same hash, so
+the same files are uploaded from the same paths, and Pulumi sees no change to
+the custom model and creates no new version.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_MANIFEST = "artifact.json"
+# files of the model directory that only the build uses
+BUILD_ONLY_FILES = {
+    "README.md",
+    "model-metadata.yaml.jinja",
+    "files.json",
+    "chunks.parquet",
+}
+# Hugging Face cache entries that inference doesn't read
+_UNUSED_MODEL_DIRS = {"blobs", ".locks", "onnx", "openvino", "__pycache__"}
+_UNUSED_MODEL_FILES = {
+    ".gitattributes",
+    "tf_model.h5",
+    "flax_model.msgpack",
+    "rust_model.ot",
+    "README.md",
+}
+
+# (source path, path in the artifact)
+ArtifactFiles = List[Tuple[str, str]]
+
+
+def _is_unused_weight(path: Path) -> bool:
+    if path.name in _UNUSED_MODEL_FILES:
+        return True
+    # transformers loads safetensors when both formats are present
+    return path.name == "pytorch_model.bin" and (
+        path.with_name("model.safetensors").exists()
+    )
+
+
+def inference_files(model_dir: Path) -> ArtifactFiles:
+    """The files of a built DIY RAG model directory that inference reads."""
+    files = []
+    for path in sorted(model_dir.glob("**/*")):
+        relative = path.relative_to(model_dir)
+        if not path.is_file() or path.name in BUILD_ONLY_FILES:
+            continue
+        if "__pycache__" in relative.parts:
+            continue
+        if relative.parts[0] == "sentencetransformers" and (
+            _UNUSED_MODEL_DIRS & set(relative.parts) or _is_unused_weight(path)
+        ):
+            continue
+        files.append((str(path), relative.as_posix()))
+    return files
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_hash(files: Sequence[Tuple[str, str]], fp16: bool = False) -> str:
+    """Hash of the artifact paths and the content of their sources."""
+    digest = hashlib.sha256(json.dumps({"fp16": fp16}).encode())
+    for source, name in sorted(files, key=lambda f: f[1]):
+        digest.update(f"{name}\0{file_sha256(source)}\n".encode())
+    return digest.hexdigest()
+
+
+def _to_fp16(source: str, target: Path) -> None:
+    from safetensors.numpy import load_file, save_file
+
+    tensors = load_file(source)
+    save_file(
+        {
+            name: tensor.astype("float16") if tensor.dtype == "float32" else tensor
+            for name, tensor in tensors.items()
+        },
+        str(target),
+    )
+
+
+def build_artifact(
+    files: Sequence[Tuple[str, str]], cache_dir: Path, fp16: bool = False
+) -> Tuple[ArtifactFiles, str]:
+    """Copy `files` into `<cache_dir>/<hash>/` unless it is already there.
+
+    Returns the files to upload and the hash. With `fp16`, float32 safetensors
+    weights of the sentence transformer are stored as float16. Artifacts of
+    other hashes are removed.
+    """
+    digest = content_hash(files, fp16)
+    target = cache_dir / digest[:16]
+    manifest = target / ARTIFACT_MANIFEST
+    if manifest.exists():
+        logger.info(f"DIY RAG artifact {digest[:16]} is unchanged")
+    else:
+        partial = cache_dir / f".{digest[:16]}.tmp"
+        shutil.rmtree(partial, ignore_errors=True)
+        sizes: Dict[str, int] = {}
+        for source, name in files:
+            path = partial / PurePosixPath(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if (
+                fp16
+                and name.startswith("sentencetransformers/")
+                and name.endswith(".safetensors")
+            ):
+                _to_fp16(source, path)
+            else:
+                shutil.copyfile(source, path)
+            sizes[name] = path.stat().st_size
+        (partial / ARTIFACT_MANIFEST).write_text(
+            json.dumps({"hash": digest, "fp16": fp16, "files": sizes}, indent=2)
+        )
+        os.replace(partial, target)
+        logger.info(
+            f"Built DIY RAG artifact {digest[:16]}: {len(files)} files, "
+            f"{sum(sizes.values()) / 2**20:.1f} MiB"
+        )
+    for other in cache_dir.iterdir():
+        if other != target and other.is_dir():
+            shutil.rmtree(other)
+
+    names = json.loads(manifest.read_text())["files"]
+    uploaded = [(str(target / PurePosixPath(name)), name) for name in names]
+    return uploaded + [(str(manifest), ARTIFACT_MANIFEST)], digest
@@ -0,0 +1,150 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Chunks of the DIY build in a Parquet file, one row per chunk.
+
+Each row holds the chunk id, text, source, page and metadata, plus the name and
+SHA-256 of the file it was split from. The settings the chunks depend on are
+kept in the schema metadata. The file is written in row groups as documents
+are split and read back in record batches, so neither side holds the whole
+corpus as `Document` objects.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Collection, Dict, Iterator, List, Optional, Type
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from langchain_core.documents import Document
+
+from docsassist.vectordb import unique_chunks
+
+CHUNKS = "chunks.parquet"
+ROW_GROUP_SIZE = 4096
+BATCH_SIZE = 1024
+
+SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("text", pa.large_string()),
+        ("source", pa.string()),
+        ("page", pa.int64()),
+        ("metadata", pa.string()),
+        ("file", pa.string()),
+        ("file_sha256", pa.string()),
+    ]
+)
+
+
+class ChunkWriter:
+    """Write the chunks of each file to a new chunk store."""
+
+    def __init__(self, path: Path, chunking: str):
+        self._writer = pq.ParquetWriter(
+            path, SCHEMA.with_metadata({"chunking": chunking})
+        )
+        self._columns: Dict[str, List[Any]] = {name: [] for name in SCHEMA.names}
+
+    def write(self, file: str, sha256: str, documents: List[Document]) -> None:
+        for docstore_id, doc in unique_chunks(documents).items():
+            page = doc.metadata.get("page")
+            for name, value in (
+                ("id", docstore_id),
+                ("text", doc.page_content),
+                ("source", doc.metadata.get("source")),
+                ("page", page if isinstance(page, int) else None),
+                ("metadata", json.dumps(doc.metadata, default=str)),
+                ("file", file),
+                ("file_sha256", sha256),
+            ):
+                self._columns[name].append(value)
+        if len(self._columns["id"]) >= ROW_GROUP_SIZE:
+            self._flush()
+
+    def copy(self, path: Path, files: Collection[str]) -> None:
+        """Copy the chunks of `files` from the chunk store at `path`."""
+        self._flush()
+        for batch in _batches(path, SCHEMA.names, files):
+            self._writer.write_batch(batch)
+
+    def _flush(self) -> None:
+        if self._columns["id"]:
+            self._writer.write_table(pa.table(self._columns, schema=SCHEMA))
+            self._columns = {name: [] for name in SCHEMA.names}
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self) -> ChunkWriter:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
+def _batches(
+    path: Path, columns: List[str], files: Optional[Collection[str]] = None
+) -> Iterator[pa.RecordBatch]:
+    wanted = pa.array(sorted(files), pa.string()) if files is not None else None
+    for batch in pq.ParquetFile(path).iter_batches(BATCH_SIZE, columns=columns):
+        if wanted is not None:
+            batch = batch.filter(pc.is_in(batch.column("file"), value_set=wanted))
+        if batch.num_rows:
+            yield batch
+
+
+def stored_files(path: Path, chunking: str) -> Dict[str, str]:
+    """SHA-256 of the files in the chunk store at `path`, by name.
+
+    Empty if there is no chunk store or its chunks were split differently.
+    """
+    if not path.exists():
+        return {}
+    metadata = pq.read_schema(path).metadata or {}
+    if metadata.get(b"chunking") != chunking.encode():
+        return {}
+    table = pq.read_table(path, columns=["file", "file_sha256"])
+    return dict(zip(table.column("file").to_pylist(), table["file_sha256"].to_pylist()))
+
+
+def chunk_ids(path: Path) -> Dict[str, List[str]]:
+    """Ids of the chunks of each file in the chunk store."""
+    ids: Dict[str, List[str]] = {}
+    for batch in _batches(path, ["id", "file"]):
+        for docstore_id, file in zip(
+            batch.column("id").to_pylist(), batch.column("file").to_pylist()
+        ):
+            ids.setdefault(file, []).append(docstore_id)
+    return ids
+
+
+def iter_documents(
+    path: Path, files: Optional[Collection[str]] = None
+) -> Iterator[Document]:
+    """The chunks in the chunk store, or only those of `files`."""
+    for batch in _batches(path, ["text", "metadata", "file"], files):
+        for text, metadata in zip(
+            batch.column("text").to_pylist(), batch.column("metadata").to_pylist()
+        ):
+            yield Document(page_content=text, metadata=json.loads(metadata))
@@ -25,6 +25,11 @@ from pydantic_settings import (
 )
 
 
+def runtime_parameter_alias(name: str) -> AliasChoices:
+    """Read a setting from env var `name` or from the DataRobot runtime parameter."""
+    return AliasChoices(name, AliasPath(f"MLOPS_RUNTIME_PARAM_{name}", "payload"))
+
+
 class DRCredentials(BaseSettings): ...
 
 
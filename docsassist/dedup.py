@@ -0,0 +1,173 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Collapse near-duplicate chunks before they are embedded.
+
+Documentation repeats navigation text, disclaimers and shared snippets, which
+would otherwise take several of the top-k slots of a search. Each chunk gets a
+MinHash signature of its word shingles as the chunks stream by. Chunks whose
+signatures collide in any LSH band are compared, and those whose estimated
+Jaccard similarity reaches the threshold are merged into the first of them.
+The merged chunk lists the sources of all of them in its `sources` metadata.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import numpy.typing as npt
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class DedupReport:
+    chunks: int
+    unique: int
+
+    @property
+    def removed(self) -> int:
+        return self.chunks - self.unique
+
+    def format(self) -> str:
+        return (
+            f"Collapsed {self.removed} near-duplicate chunks: {self.chunks} -> "
+            f"{self.unique} ({self.removed / max(self.chunks, 1):.1%} smaller)"
+        )
+
+
+def _permutations(num_perm: int) -> Tuple[npt.NDArray[np.uint64], ...]:
+    rng = np.random.default_rng(0)
+    a = rng.integers(1, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+    return a, b
+
+
+def minhash(text: str, num_perm: int = NUM_PERM) -> npt.NDArray[np.uint64]:
+    """MinHash signature of the word shingles of `text`."""
+    words = _WORD.findall(text.lower())
+    shingles = {
+        " ".join(words[i : i + SHINGLE_SIZE])
+        for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    a, b = _permutations(num_perm)
+    # (a * x + b) mod p for every permutation and shingle, with a, b, x < p < 2**31
+    # so the product doesn't overflow
+    hashes %= _MERSENNE_PRIME
+    return np.asarray(((a * hashes + b) % _MERSENNE_PRIME).min(axis=1))
+
+
+def _bands(num_perm: int, threshold: float) -> int:
+    """The number of LSH bands whose S-curve is steepest just below `threshold`.
+
+    Pairs above the S-curve threshold almost always share a band, and they are
+    all checked against `threshold` anyway, so a lower curve only costs checks.
+    """
+    divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [b for b in divisors if (1 / b) ** (b / num_perm) <= threshold]
+    return min(below) if below else max(divisors)
+
+
+class NearDuplicates:
+    """Clusters of near-duplicate signatures, built one signature at a time.
+
+    Each LSH bucket keeps only the first signature that fell into it, and a new
+    signature is compared with the first one of each of its buckets.
+    """
+
+    def __init__(self, threshold: float, num_perm: int = NUM_PERM):
+        self.threshold = threshold
+        self.bands = _bands(num_perm, threshold)
+        self.rows = num_perm // self.bands
+        self._buckets: List[Dict[bytes, int]] = [{} for _ in range(self.bands)]
+        self._signatures: List[npt.NDArray[np.uint64]] = []
+        self._parent: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._parent)
+
+    def find(self, i: int) -> int:
+        """The index of the first signature of the cluster of signature `i`."""
+        parent = self._parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def add(self, signature: npt.NDArray[np.uint64]) -> int:
+        i = len(self._parent)
+        self._parent.append(i)
+        self._signatures.append(signature)
+        for band, buckets in enumerate(self._buckets):
+            key = signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            first = buckets.setdefault(key, i)
+            if first == i or self.find(first) == self.find(i):
+                continue
+            if np.mean(signature == self._signatures[first]) >= self.threshold:
+                # the earliest chunk of a cluster is its canonical one
+                root, other = sorted((self.find(first), self.find(i)))
+                self._parent[other] = root
+        return self.find(i)
+
+
+def deduplicate(
+    documents: Callable[[], Iterable[Document]], threshold: float
+) -> Tuple[Iterator[Document], DedupReport]:
+    """Near-duplicate chunks merged into the first chunk of each cluster.
+
+    `documents` is iterated twice: once to cluster the chunks by their MinHash
+    signatures, which is done as they stream by, and once to yield the chunks
+    that are first in their cluster. Only signatures and sources are kept in
+    memory in between.
+    """
+    clusters = NearDuplicates(threshold)
+    chunk_sources: List[Optional[str]] = []
+    for doc in documents():
+        clusters.add(minhash(doc.page_content))
+        chunk_sources.append(doc.metadata.get("source"))
+    sources: Dict[int, List[str]] = {}
+    for i, source in enumerate(chunk_sources):
+        merged_sources = sources.setdefault(clusters.find(i), [])
+        if source is not None and source not in merged_sources:
+            merged_sources.append(source)
+    report = DedupReport(chunks=len(clusters), unique=len(sources))
+    logger.info(report.format())
+
+    def merged() -> Iterator[Document]:
+        for i, doc in enumerate(documents()):
+            if clusters.find(i) != i:
+                continue
+            if len(sources[i]) > 1:
+                doc = Document(
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, "sources": sources[i]},
+                )
+            yield doc
+
+    return merged(), report
@@ -0,0 +1,140 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Embed chunks in several worker processes.
+
+A single sentence transformer process uses only some of the cores of a large
+build machine: torch parallelizes each batch over threads, which scales poorly
+past a few cores for a small model. The pool instead runs `workers` processes,
+each with its own copy of the model, loaded once, and `threads` torch threads,
+and deals every call's texts to them in batches.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import TracebackType
+from typing import Any, Callable, List, Optional, Type
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# texts per sentence transformer batch, which suits small models on CPU
+EMBEDDING_BATCH_SIZE = 64
+_THREAD_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+)
+
+_embedding: Optional[Embeddings] = None
+
+
+def _init_worker(load: Callable[[], Embeddings], threads: int) -> None:
+    global _embedding
+    # set before torch is imported, which sizes its thread pools on import
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    # the workers are the parallelism, tokenizers needn't add threads of their own
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _embedding = load()
+
+
+def _embed(texts: List[str]) -> np.ndarray[Any, Any]:
+    assert _embedding is not None
+    return np.asarray(_embedding.embed_documents(texts), dtype=np.float32)
+
+
+class EmbeddingPool(Embeddings):
+    """Embeddings computed by worker processes that each load the model once.
+
+    `load` creates the embedding model in a worker; it is pickled, so it should
+    be a module-level function or a `functools.partial` of one. Use the pool as
+    a context manager, or `close` it, to stop the workers.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], Embeddings],
+        workers: int,
+        threads: Optional[int] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+    ) -> None:
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.batch_size = batch_size
+        self.embedded = 0
+        self.seconds = 0.0
+        # spawned rather than forked: a forked torch thread pool can deadlock
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(load, self.threads),
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        started_at = time.perf_counter()
+        # small calls are still spread over every worker
+        size = min(self.batch_size, math.ceil(len(texts) / self.workers))
+        futures = [
+            self._executor.submit(_embed, texts[i : i + size])
+            for i in range(0, len(texts), size)
+        ]
+        vectors = np.concatenate([future.result() for future in futures])
+        self.seconds += time.perf_counter() - started_at
+        self.embedded += len(texts)
+        return vectors.tolist()  # type: ignore[no-any-return]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.embedded / max(self.seconds, 1e-9)
+
+    def format(self) -> str:
+        return (
+            f"Embedded {self.embedded} chunks with {self.workers} processes of "
+            f"{self.threads} threads, batch size {self.batch_size}: "
+            f"{self.chunks_per_second:.1f} chunks/s"
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def __enter__(self) -> EmbeddingPool:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
@@ -0,0 +1,173 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Embeddings of chunk texts, kept across builds of the vector database.
+
+Vectors are keyed by the embedding model and the SHA-256 of the text, so a
+chunk embedded by any earlier build is reused, whatever the corpus or chunk
+settings it came from. Each model has its own directory of two append-only
+files, read through a memory map:
+
+    <store>/<model>/meta.json     model name and dimension
+    <store>/<model>/keys.bin      32-byte digest of the text of each row
+    <store>/<model>/vectors.f32   float32 vector of each row
+
+Vectors are written before their keys, and only rows with both are read, so an
+interrupted build leaves the store usable. A store is not meant to be written
+by two builds at once.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import numpy.typing as npt
+from langchain_core.embeddings import Embeddings
+
+KEYS = "keys.bin"
+VECTORS = "vectors.f32"
+META = "meta.json"
+DIGEST_SIZE = 32
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """Append-only store of the embeddings of one model, keyed by text digest."""
+
+    def __init__(self, folder: Path, model_name: str):
+        self.folder = Path(folder) / re.sub(r"[^\w.-]", "_", model_name)
+        self.model_name = model_name
+        self.dim: Optional[int] = None
+        self.rows: Dict[bytes, int] = {}
+        self.n_rows = 0
+        self._vectors: Optional[npt.NDArray[np.float32]] = None
+        meta = self.folder / META
+        if not meta.exists():
+            return
+        stored = json.loads(meta.read_text())
+        if stored["model_name"] != model_name:
+            raise ValueError(
+                f"{self.folder} holds embeddings of {stored['model_name']}, "
+                f"not {model_name}"
+            )
+        self.dim = int(stored["dim"])
+        keys = (self.folder / KEYS).read_bytes()
+        n_vectors = os.path.getsize(self.folder / VECTORS) // (4 * self.dim)
+        self.n_rows = min(len(keys) // DIGEST_SIZE, n_vectors)
+        for row in range(self.n_rows):
+            self.rows.setdefault(keys[row * DIGEST_SIZE : (row + 1) * DIGEST_SIZE], row)
+        self._truncate()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _truncate(self) -> None:
+        # drop the tail of a build that was interrupted between the two writes
+        assert self.dim is not None
+        with open(self.folder / KEYS, "r+b") as f:
+            f.truncate(self.n_rows * DIGEST_SIZE)
+        with open(self.folder / VECTORS, "r+b") as f:
+            f.truncate(self.n_rows * 4 * self.dim)
+
+    def _memmap(self) -> npt.NDArray[np.float32]:
+        assert self.dim is not None
+        if self._vectors is None or len(self._vectors) < self.n_rows:
+            self._vectors = np.memmap(
+                self.folder / VECTORS,
+                dtype=np.float32,
+                mode="r",
+                shape=(self.n_rows, self.dim),
+            )
+        return self._vectors
+
+    def get(self, digests: Sequence[bytes]) -> List[Optional[npt.NDArray[np.float32]]]:
+        """The stored vector of each digest, or None."""
+        if not self.rows:
+            return [None] * len(digests)
+        vectors = self._memmap()
+        return [
+            np.array(vectors[self.rows[digest]]) if digest in self.rows else None
+            for digest in digests
+        ]
+
+    def add(self, digests: Sequence[bytes], vectors: npt.NDArray[np.float32]) -> None:
+        """Append the vectors of texts that aren't stored yet."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            self.folder.mkdir(parents=True, exist_ok=True)
+            (self.folder / KEYS).touch()
+            (self.folder / VECTORS).touch()
+            (self.folder / META).write_text(
+                json.dumps({"model_name": self.model_name, "dim": self.dim})
+            )
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected vectors of dimension {self.dim}")
+        new = [i for i, digest in enumerate(digests) if digest not in self.rows]
+        new = list({digests[i]: i for i in new}.values())
+        if not new:
+            return
+        with open(self.folder / VECTORS, "ab") as f:
+            f.write(vectors[new].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.folder / KEYS, "ab") as f:
+            f.write(b"".join(digests[i] for i in new))
+        for i in new:
+            self.rows[digests[i]] = self.n_rows
+            self.n_rows += 1
+
+
+class StoredEmbeddings(Embeddings):
+    """Embeddings that only calls the model for texts not in an `EmbeddingStore`."""
+
+    def __init__(self, embedding: Embeddings, store: EmbeddingStore):
+        self.embedding = embedding
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        digests = [text_digest(text) for text in texts]
+        vectors = self.store.get(digests)
+        missing = {
+            digest: text
+            for digest, text, vector in zip(digests, texts, vectors)
+            if vector is None
+        }
+        if missing:
+            embedded = np.asarray(
+                self.embedding.embed_documents(list(missing.values())),
+                dtype=np.float32,
+            )
+            self.store.add(list(missing), embedded)
+            computed = dict(zip(missing, embedded))
+            vectors = [
+                computed[digest] if vector is None else vector
+                for digest, vector in zip(digests, vectors)
+            ]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return [vector.tolist() for vector in vectors]  # type: ignore[union-attr]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding.embed_query(text)
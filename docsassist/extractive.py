@@ -0,0 +1,57 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import re
+from typing import List, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_MIN_SENTENCE_LENGTH = 20
+
+
+def split_sentences(documents: Sequence[Document]) -> List[str]:
+    """Split retrieved documents into unique sentences, in retrieval order."""
+    sentences: dict[str, None] = {}
+    for doc in documents:
+        for sentence in _SENTENCE_BOUNDARY.split(doc.page_content):
+            sentence = " ".join(sentence.split())
+            if len(sentence) >= _MIN_SENTENCE_LENGTH:
+                sentences.setdefault(sentence)
+    return list(sentences)
+
+
+def extractive_answer(
+    question: str,
+    documents: Sequence[Document],
+    embeddings: Embeddings,
+    max_sentences: int,
+) -> str:
+    """Answer with the context sentences closest to the question.
+
+    Sentences are ranked by cosine similarity to the question and returned in
+    their original order, so the result is deterministic for a given context.
+    """
+    sentences = split_sentences(documents)
+    if not sentences:
+        return ""
+    query = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+    vectors = np.asarray(embeddings.embed_documents(sentences), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    scores = vectors @ query / np.where(norms == 0, 1, norms)
+    top = np.argsort(-scores, kind="stable")[:max_sentences]
+    return " ".join(sentences[i] for i in sorted(top))
@@ -0,0 +1,269 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Bring a persisted vector database in line with a new set of chunks.
+
+Chunks are identified by a hash of their text and metadata, so a rebuild only
+embeds the chunks that are new. Chunks that were deleted or changed are
+tombstoned, and a shard is compacted once its share of tombstones passes a
+threshold.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Set
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docsassist.vectordb import (
+    IncrementalFAISS,
+    IndexSettings,
+    VectorDB,
+    chunk_id,
+    load_faiss,
+    shards_of,
+    unique_chunks,
+    vectorstore_from_embeddings,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_SETTINGS = "index_settings.json"
+DEFAULT_COMPACT_THRESHOLD = 0.2
+EMBED_BATCH_SIZE = 1024
+
+
+@dataclass
+class SyncReport:
+    added: int
+    deleted: int
+    unchanged: int
+    compacted_shards: int = 0
+    rebuilt: bool = False
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.rebuilt or self.added or self.deleted or self.compacted_shards)
+
+    def format(self) -> str:
+        action = "Rebuilt" if self.rebuilt else "Updated"
+        return (
+            f"{action} vector database: {self.added} chunks added, "
+            f"{self.deleted} deleted, {self.unchanged} unchanged, "
+            f"{self.compacted_shards} shards compacted"
+        )
+
+
+def _incremental_shards(vectorstore: VectorDB) -> List[IncrementalFAISS]:
+    shards = shards_of(vectorstore)
+    for shard in shards:
+        if not isinstance(shard, IncrementalFAISS):
+            raise TypeError(
+                "Incremental updates need a vector store built by docsassist.vectordb"
+            )
+    return shards  # type: ignore[return-value]
+
+
+def _batches(
+    documents: Iterable[Document], batch_size: int
+) -> Iterator[Dict[str, Document]]:
+    """Unique chunks by stable id, `batch_size` at a time."""
+    seen: Set[str] = set()
+    batch: Dict[str, Document] = {}
+    for doc in documents:
+        docstore_id = chunk_id(doc)
+        if docstore_id not in seen:
+            seen.add(docstore_id)
+            batch[docstore_id] = doc
+            if len(batch) == batch_size:
+                yield batch
+                batch = {}
+    if batch:
+        yield batch
+
+
+def patch_vectorstore(
+    vectorstore: VectorDB,
+    documents: Iterable[Document],
+    delete_ids: Iterable[str],
+    embedding: Embeddings,
+    compact_threshold: float = DEFAULT_COMPACT_THRESHOLD,
+    batch_size: int = EMBED_BATCH_SIZE,
+) -> SyncReport:
+    """Tombstone the chunks `delete_ids` and add `documents`, embedding new ones.
+
+    `documents` are embedded `batch_size` at a time, as they are iterated.
+    """
+    shards = _incremental_shards(vectorstore)
+    live = [shard.live_ids() for shard in shards]
+    existing = set().union(*live)
+    delete = set(delete_ids) & existing
+    # new chunks go to the shards with the fewest live chunks
+    sizes = [len(ids) for ids in live]
+    added = 0
+    for chunks in _batches(documents, batch_size):
+        # a chunk deleted and added again is just unchanged
+        delete -= chunks.keys()
+        new_ids = [docstore_id for docstore_id in chunks if docstore_id not in existing]
+        if not new_ids:
+            continue
+        texts = [chunks[docstore_id].page_content for docstore_id in new_ids]
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        assigned: Dict[int, List[int]] = {}
+        for j in range(len(new_ids)):
+            target = int(np.argmin(sizes))
+            sizes[target] += 1
+            assigned.setdefault(target, []).append(j)
+        for target, positions in assigned.items():
+            shards[target].add_embeddings(
+                [(texts[j], vectors[j].tolist()) for j in positions],
+                metadatas=[dict(chunks[new_ids[j]].metadata) for j in positions],
+                ids=[new_ids[j] for j in positions],
+            )
+        added += len(new_ids)
+    deleted = sum(
+        shard.tombstone([docstore_id for docstore_id in ids if docstore_id in delete])
+        for shard, ids in zip(shards, live)
+    )
+
+    compacted = 0
+    for shard in shards:
+        if shard.tombstones and shard.tombstone_ratio > compact_threshold:
+            shard.compact()
+            compacted += 1
+    return SyncReport(
+        added=added,
+        deleted=deleted,
+        unchanged=len(existing) - deleted,
+        compacted_shards=compacted,
+    )
+
+
+def sync_vectorstore(
+    vectorstore: VectorDB,
+    documents: Iterable[Document],
+    embedding: Embeddings,
+    compact_threshold: float = DEFAULT_COMPACT_THRESHOLD,
+) -> SyncReport:
+    """Make `vectorstore` hold exactly `documents`, embedding only new chunks."""
+    chunks = unique_chunks(documents)
+    live = set().union(
+        *(shard.live_ids() for shard in _incremental_shards(vectorstore))
+    )
+    return patch_vectorstore(
+        vectorstore,
+        chunks.values(),
+        live - chunks.keys(),
+        embedding,
+        compact_threshold,
+    )
+
+
+def has_index(folder: str, settings: IndexSettings) -> bool:
+    """Whether `folder` holds a vector database built with `settings`."""
+    path = os.path.join(folder, INDEX_SETTINGS)
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        return IndexSettings.model_validate_json(f.read()) == settings
+
+
+def _save(folder: str, vectorstore: VectorDB, settings: IndexSettings) -> None:
+    vectorstore.save_local(folder)
+    with open(os.path.join(folder, INDEX_SETTINGS), "w") as f:
+        f.write(settings.model_dump_json())
+
+
+def ingest(
+    folder: str,
+    documents: Iterable[Document],
+    embedding: Embeddings,
+    settings: IndexSettings,
+    compact_threshold: float = DEFAULT_COMPACT_THRESHOLD,
+    rebuild: bool = False,
+) -> SyncReport:
+    """Update the vector database saved in `folder`, or build it from scratch.
+
+    The database is rebuilt if asked to, if it doesn't exist yet or if it was
+    built with other index settings. Building it from no chunks at all raises
+    a ValueError.
+    """
+    if not rebuild and has_index(folder, settings):
+        vectorstore = load_faiss(folder, embedding)
+        report = sync_vectorstore(vectorstore, documents, embedding, compact_threshold)
+    else:
+        texts: List[str] = []
+        metadatas: List[Dict[str, Any]] = []
+        ids: List[str] = []
+        vectors = []
+        for chunks in _batches(documents, EMBED_BATCH_SIZE):
+            batch = [doc.page_content for doc in chunks.values()]
+            vectors.append(
+                np.asarray(embedding.embed_documents(batch), dtype=np.float32)
+            )
+            texts.extend(batch)
+            metadatas.extend(doc.metadata for doc in chunks.values())
+            ids.extend(chunks)
+        if not ids:
+            # FAISS can't build or train an index without vectors
+            raise ValueError(
+                f"No chunks to build the vector database in {folder} from, "
+                "check that the documents exist and have text"
+            )
+        vectorstore = vectorstore_from_embeddings(
+            texts,
+            np.concatenate(vectors),
+            embedding,
+            metadatas=metadatas,
+            settings=settings,
+            ids=ids,
+        )
+        report = SyncReport(added=len(ids), deleted=0, unchanged=0, rebuilt=True)
+        # start from an empty directory, a sharded index must not mix with an older one
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if report.changed:
+        _save(folder, vectorstore, settings)
+    logger.info(report.format())
+    return report
+
+
+def patch(
+    folder: str,
+    documents: Iterable[Document],
+    delete_ids: Iterable[str],
+    embedding: Embeddings,
+    settings: IndexSettings,
+    compact_threshold: float = DEFAULT_COMPACT_THRESHOLD,
+) -> SyncReport:
+    """Delete and add chunks of the vector database saved in `folder`.
+
+    An unchanged database isn't saved again, so its files stay byte for byte
+    the same and the DIY RAG artifact keeps its hash.
+    """
+    if not has_index(folder, settings):
+        raise ValueError(f"No vector database built with {settings} in {folder}")
+    vectorstore = load_faiss(folder, embedding)
+    report = patch_vectorstore(
+        vectorstore, documents, delete_ids, embedding, compact_threshold
+    )
+    if report.changed:
+        _save(folder, vectorstore, settings)
+    logger.info(report.format())
+    return report
@@ -0,0 +1,324 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Several named vector indexes served by one DIY RAG model.
+
+The model directory holds the default index in `faiss_db/` and any number of
+named ones in `indexes/<name>/`, all embedded with the same model. Indexes are
+loaded on first use, and the least recently used ones are evicted when the
+loaded indexes exceed the memory budget.
+"""
+
+from __future__ import annotations
+
+import glob
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from docsassist.credentials import runtime_parameter_alias
+from docsassist.memory_report import faiss_index_bytes
+from docsassist.metadata_filter import FilteredSearch, current_retrieval_filter
+from docsassist.neighbors import Neighbors
+from docsassist.vectordb import VectorDB, load_faiss, shards_of
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_NAME = "default"
+NAMED_INDEXES_DIR = "indexes"
+# version of the indexes shipped in the model directory
+BASE_VERSION = "base"
+
+# index selected by the request being scored
+current_index_name: ContextVar[Optional[str]] = ContextVar(
+    "current_index_name", default=None
+)
+
+
+@dataclass
+class RetrievalInfo:
+    """What the retriever used for the current request, filled in as it runs."""
+
+    index_version: Optional[str] = None
+
+
+# langchain may run the retriever in a copy of the request's context, so the
+# request sets a mutable holder rather than reading back a value set inside
+current_retrieval_info: ContextVar[Optional[RetrievalInfo]] = ContextVar(
+    "current_retrieval_info", default=None
+)
+
+
+class IndexRegistrySettings(BaseSettings):
+    memory_budget_mb: Optional[float] = Field(
+        default=None,
+        description="Evict least recently used indexes above this size; "
+        "unlimited if unset",
+        validation_alias=runtime_parameter_alias("RAG_INDEX_MEMORY_BUDGET_MB"),
+    )
+
+
+class UnknownIndexError(KeyError):
+    pass
+
+
+def _index_dir(input_dir: str, name: str) -> str:
+    if name == DEFAULT_INDEX_NAME:
+        return os.path.join(input_dir, "faiss_db")
+    return os.path.join(input_dir, NAMED_INDEXES_DIR, name)
+
+
+def estimated_bytes(vectorstore: VectorDB, folder: str) -> int:
+    """Memory of a loaded index, approximated by its codes plus its pickled docstore."""
+    # index.pkl of an unsharded index, or of every shard
+    docstore_bytes = sum(
+        os.path.getsize(path)
+        for path in glob.glob(os.path.join(folder, "**", "index.pkl"), recursive=True)
+    )
+    codes_bytes = sum(
+        faiss_index_bytes(shard.index) for shard in shards_of(vectorstore)
+    )
+    return codes_bytes + docstore_bytes
+
+
+@dataclass
+class _LoadedIndex:
+    vectorstore: VectorDB
+    version: str
+    size_bytes: int
+    filtered: FilteredSearch
+    neighbors: Neighbors
+
+
+class IndexRegistry:
+    """Lazily loaded named indexes with least-recently-used eviction.
+
+    Thread safe; an evicted index stays usable by requests already holding it.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        embeddings: Embeddings,
+        memory_budget_bytes: Optional[int] = None,
+    ) -> None:
+        self.input_dir = input_dir
+        self.embeddings = embeddings
+        self.memory_budget_bytes = memory_budget_bytes
+        self._loaded: OrderedDict[str, _LoadedIndex] = OrderedDict()
+        self._pinned: set[str] = set()
+        # folder and version of indexes replaced by `swap`
+        self._swapped: Dict[str, tuple[str, str]] = {}
+        # held only to look up, insert and evict entries, never while loading
+        self._lock = threading.Lock()
+        # held by the request loading an index, by name
+        self._loading: Dict[str, threading.Lock] = {}
+
+    @classmethod
+    def from_env(cls, input_dir: str, embeddings: Embeddings) -> IndexRegistry:
+        budget_mb = IndexRegistrySettings().memory_budget_mb
+        return cls(
+            input_dir,
+            embeddings,
+            memory_budget_bytes=None if budget_mb is None else int(budget_mb * 2**20),
+        )
+
+    def names(self) -> List[str]:
+        """Names of the indexes in the model directory."""
+        names = []
+        if os.path.isdir(_index_dir(self.input_dir, DEFAULT_INDEX_NAME)):
+            names.append(DEFAULT_INDEX_NAME)
+        named_dir = os.path.join(self.input_dir, NAMED_INDEXES_DIR)
+        if os.path.isdir(named_dir):
+            names.extend(
+                sorted(
+                    name
+                    for name in os.listdir(named_dir)
+                    if os.path.isdir(os.path.join(named_dir, name))
+                )
+            )
+        return names
+
+    def loaded(self) -> List[str]:
+        """Names of the loaded indexes, least recently used first."""
+        with self._lock:
+            return list(self._loaded)
+
+    @property
+    def loaded_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._loaded.values())
+
+    def pin(self, name: str, vectorstore: VectorDB) -> None:
+        """Register an already loaded index that is never evicted."""
+        with self._lock:
+            self._loaded[name] = self._entry(name, vectorstore)
+            self._pinned.add(name)
+
+    def swap(
+        self, name: str, vectorstore: VectorDB, folder: str, version: str
+    ) -> Optional[str]:
+        """Atomically replace an index with a new version loaded from `folder`.
+
+        Requests that already hold the old version finish with it; it is freed
+        once the last of them drops it. Returns the replaced version, if loaded.
+        """
+        entry = self._entry(name, vectorstore, folder=folder, version=version)
+        with self._lock:
+            self._swapped[name] = (folder, version)
+            old = self._loaded.pop(name, None)
+            self._loaded[name] = entry
+            self._evict(keep=name)
+        return None if old is None else old.version
+
+    def version(self, name: Optional[str] = None) -> str:
+        """The version of an index that is, or would be, loaded."""
+        name = name or DEFAULT_INDEX_NAME
+        with self._lock:
+            if name in self._loaded:
+                return self._loaded[name].version
+            return self._swapped.get(name, ("", BASE_VERSION))[1]
+
+    def _entry(
+        self,
+        name: str,
+        vectorstore: VectorDB,
+        folder: Optional[str] = None,
+        version: str = BASE_VERSION,
+    ) -> _LoadedIndex:
+        folder = folder or _index_dir(self.input_dir, name)
+        return _LoadedIndex(
+            vectorstore=vectorstore,
+            version=version,
+            size_bytes=estimated_bytes(vectorstore, folder),
+            filtered=FilteredSearch(vectorstore),
+            neighbors=Neighbors(vectorstore),
+        )
+
+    def _cached(self, name: str) -> Optional[_LoadedIndex]:
+        # called with `_lock` held
+        entry = self._loaded.get(name)
+        if entry is not None:
+            self._loaded.move_to_end(name)
+        return entry
+
+    def _get(self, name: Optional[str]) -> _LoadedIndex:
+        name = name or DEFAULT_INDEX_NAME
+        with self._lock:
+            entry = self._cached(name)
+            if entry is not None:
+                return entry
+            load_lock = self._loading.setdefault(name, threading.Lock())
+        # one request loads an index while the others asking for it wait, and
+        # requests for other indexes are served meanwhile
+        try:
+            with load_lock:
+                while True:
+                    with self._lock:
+                        entry = self._cached(name)
+                        if entry is not None:
+                            return entry
+                        swapped = self._swapped.get(name)
+                    if swapped is not None:
+                        # reload the version that was swapped in, not the original
+                        folder, version = swapped
+                        logger.info(
+                            f"Loading index {name} version {version} from {folder}"
+                        )
+                        vectorstore = load_faiss(folder, self.embeddings)
+                        entry = self._entry(
+                            name, vectorstore, folder=folder, version=version
+                        )
+                    else:
+                        entry = self._entry(name, self._load(name))
+                    with self._lock:
+                        if name in self._loaded or self._swapped.get(name) != swapped:
+                            # a newer version was swapped in while loading
+                            continue
+                        self._loaded[name] = entry
+                        self._evict(keep=name)
+                        return entry
+        finally:
+            with self._lock:
+                if self._loading.get(name) is load_lock:
+                    del self._loading[name]
+
+    def get(self, name: Optional[str] = None) -> VectorDB:
+        return self._get(name).vectorstore
+
+    def filtered(self, name: Optional[str] = None) -> FilteredSearch:
+        """Metadata-filtered search of an index, whose filter bitmaps are cached."""
+        return self._get(name).filtered
+
+    def _load(self, name: str) -> VectorDB:
+        # names come from requests; listing the directory also rules out paths
+        if name not in self.names():
+            raise UnknownIndexError(
+                f"Unknown index {name!r}, available: {', '.join(self.names())}"
+            )
+        folder = _index_dir(self.input_dir, name)
+        logger.info(f"Loading index {name} from {folder}")
+        return load_faiss(folder, self.embeddings)
+
+    def _evict(self, keep: str) -> None:
+        if self.memory_budget_bytes is None:
+            return
+        total = sum(entry.size_bytes for entry in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget_bytes:
+                break
+            if name == keep or name in self._pinned:
+                continue
+            total -= self._loaded.pop(name).size_bytes
+            logger.info(f"Evicted index {name} to stay within the memory budget")
+
+
+class RegistryRetriever(BaseRetriever):
+    """Similarity search in the index and with the filter of the current request."""
+
+    registry: IndexRegistry
+    search_kwargs: Dict[str, Any] = {}
+    # chunks around each hit added to it, see docsassist/neighbors.py
+    neighbor_window: int = 0
+
+    class Config:
+        # langchain 0.2 retrievers are pydantic v1 models
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        index_name = current_index_name.get()
+        retrieval_filter = current_retrieval_filter.get()
+        entry = self.registry._get(index_name)
+        info = current_retrieval_info.get()
+        if info is not None:
+            info.index_version = entry.version
+        if retrieval_filter is None:
+            documents = entry.vectorstore.similarity_search(query, **self.search_kwargs)
+        else:
+            documents = entry.filtered.similarity_search(
+                query, retrieval_filter, k=self.search_kwargs.get("k", 4)
+            )
+        return entry.neighbors.expand(documents, self.neighbor_window)
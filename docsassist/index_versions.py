@@ -0,0 +1,247 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Versioned vector indexes that a running DIY RAG model picks up without a redeploy.
+
+A version is a directory `<watch dir>/<version>/` holding a saved vector store
+and a `manifest.json` with the SHA-256 of every file. Versions are published by
+copying into a hidden temporary directory and renaming it, so a watcher never
+sees a partial version:
+
+    python -m docsassist.index_versions publish deployment_diy_rag/faiss_db /mnt/rag-indexes
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel, Field
+from pydantic_settings import BaseSettings
+
+from docsassist.credentials import runtime_parameter_alias
+from docsassist.index_registry import DEFAULT_INDEX_NAME, IndexRegistry
+from docsassist.prefork import release_preloaded
+from docsassist.vectordb import load_faiss
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+class IndexReloadSettings(BaseSettings):
+    watch_dir: Optional[Path] = Field(
+        default=None,
+        description="Directory of published index versions; hot reload is off "
+        "if unset",
+        validation_alias=runtime_parameter_alias("RAG_INDEX_WATCH_DIR"),
+    )
+    interval: float = Field(
+        default=30.0,
+        description="Seconds between checks for a new index version",
+        validation_alias=runtime_parameter_alias("RAG_INDEX_RELOAD_INTERVAL"),
+    )
+
+
+class IndexManifest(BaseModel):
+    version: str
+    created_at: datetime
+    files: Dict[str, str] = Field(description="SHA-256 by path relative to the version")
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checksums(folder: Path) -> Dict[str, str]:
+    return {
+        path.relative_to(folder).as_posix(): _sha256(path)
+        for path in sorted(folder.rglob("*"))
+        if path.is_file() and path.name != MANIFEST
+    }
+
+
+def publish(source: Path, watch_dir: Path, version: Optional[str] = None) -> Path:
+    """Publish a saved vector store (e.g. `faiss_db/`) as a new index version."""
+    created_at = datetime.now(timezone.utc)
+    version = version or created_at.strftime("%Y%m%dT%H%M%S%fZ")
+    target = watch_dir / version
+    if target.exists():
+        raise FileExistsError(f"Index version {version} already exists")
+    staging = watch_dir / f".{version}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    shutil.copytree(source, staging)
+    manifest = IndexManifest(
+        version=version, created_at=created_at, files=_checksums(staging)
+    )
+    (staging / MANIFEST).write_text(manifest.model_dump_json(indent=2))
+    os.rename(staging, target)
+    return target
+
+
+def latest_version(watch_dir: Path) -> Optional[Path]:
+    """The most recently published version; hidden directories are staging.
+
+    Versions are ordered by the `created_at` of their manifest, then by name,
+    so that names like `v9` and `v10` needn't sort as strings.
+    """
+    if not watch_dir.is_dir():
+        return None
+    versions = []
+    for path in watch_dir.iterdir():
+        if not path.is_dir() or path.name.startswith("."):
+            continue
+        try:
+            manifest = IndexManifest.model_validate_json((path / MANIFEST).read_text())
+        except (OSError, ValueError):
+            # not a published version, or not completely written yet
+            continue
+        versions.append((manifest.created_at, path.name, path))
+    return max(versions)[2] if versions else None
+
+
+def verify(folder: Path) -> IndexManifest:
+    """Read the manifest of a version and check every file against it."""
+    manifest = IndexManifest.model_validate_json((folder / MANIFEST).read_text())
+    actual = _checksums(folder)
+    if actual != manifest.files:
+        mismatched = sorted(
+            name
+            for name in set(actual) | set(manifest.files)
+            if actual.get(name) != manifest.files.get(name)
+        )
+        raise ValueError(
+            f"Index version {manifest.version} does not match its manifest: "
+            + ", ".join(mismatched)
+        )
+    return manifest
+
+
+class IndexWatcher:
+    """Poll a directory of index versions and swap new ones into a registry."""
+
+    def __init__(
+        self,
+        registry: IndexRegistry,
+        watch_dir: Path,
+        embeddings: Embeddings,
+        interval: float = 30.0,
+        name: str = DEFAULT_INDEX_NAME,
+    ) -> None:
+        self.registry = registry
+        self.watch_dir = watch_dir
+        self.embeddings = embeddings
+        self.interval = interval
+        self.name = name
+        self.last_reload_seconds: Optional[float] = None
+        self._failed: set[str] = set()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="rag-index-watcher", daemon=True
+        )
+
+    @classmethod
+    def from_env(
+        cls, registry: IndexRegistry, embeddings: Embeddings
+    ) -> Optional[IndexWatcher]:
+        """A started watcher, or None if no watch directory is configured."""
+        settings = IndexReloadSettings()
+        if settings.watch_dir is None:
+            return None
+        watcher = cls(registry, settings.watch_dir, embeddings, settings.interval)
+        watcher.start()
+        return watcher
+
+    def start(self) -> None:
+        logger.info(f"Watching {self.watch_dir} for new index versions")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Index reload failed")
+            if self._stopped.wait(self.interval):
+                return
+
+    def poll(self) -> bool:
+        """Load and swap in the latest version if it is new; True if swapped."""
+        folder = latest_version(self.watch_dir)
+        if folder is None or folder.name in self._failed:
+            return False
+        if folder.name == self.registry.version(self.name):
+            return False
+
+        started_at = time.perf_counter()
+        try:
+            manifest = verify(folder)
+            vectorstore = load_faiss(str(folder), self.embeddings)
+        except Exception:
+            # don't retry a broken version every interval; a newer one replaces it
+            self._failed.add(folder.name)
+            raise
+        old_version = self.registry.swap(
+            self.name, vectorstore, str(folder), manifest.version
+        )
+        if self.name == DEFAULT_INDEX_NAME:
+            # the registry held the only other reference to a preloaded index
+            release_preloaded(self.registry.input_dir)
+        self.last_reload_seconds = time.perf_counter() - started_at
+        logger.info(
+            f"Index {self.name} version {manifest.version} active after "
+            f"{self.last_reload_seconds:.2f}s, replacing {old_version}"
+        )
+        weakref.finalize(
+            vectorstore,
+            logger.info,
+            f"Index {self.name} version {manifest.version} released",
+        )
+        return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Publish DIY RAG index versions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish_parser = commands.add_parser("publish", help=publish.__doc__)
+    publish_parser.add_argument(
+        "source", type=Path, help="e.g. deployment_diy_rag/faiss_db"
+    )
+    publish_parser.add_argument("watch_dir", type=Path)
+    publish_parser.add_argument("--version", default=None, help="default: timestamp")
+    args = parser.parse_args()
+
+    args.watch_dir.mkdir(parents=True, exist_ok=True)
+    print(publish(args.source, args.watch_dir, args.version))
+
+
+if __name__ == "__main__":
+    main()
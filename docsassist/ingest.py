@@ -0,0 +1,701 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Chunk a document archive and build the vector database of the DIY RAG model.
+
+Members of the archive are loaded and split in a process pool, straight from
+the zip file. The chunks are then embedded
+into `faiss_db/`, which `docsassist.incremental` updates in place, and the
+settings the model needs at retrieval time are written next to it:
+
+    python -m docsassist.ingest assets/datarobot_english_documentation_docsassist.zip deployment_diy_rag
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import re
+import textwrap
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path, PurePosixPath
+from typing import (
+    Callable,
+    Collection,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import yaml
+from langchain.text_splitter import MarkdownTextSplitter
+from langchain_community.document_loaders import UnstructuredFileIOLoader
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pydantic import BaseModel, Field, model_validator
+
+from docsassist.chunk_store import (
+    CHUNKS,
+    ChunkWriter,
+    chunk_ids,
+    iter_documents,
+    stored_files,
+)
+from docsassist.dedup import deduplicate
+from docsassist.embedding_pool import EMBEDDING_BATCH_SIZE, EmbeddingPool
+from docsassist.embedding_store import EmbeddingStore, StoredEmbeddings
+from docsassist.incremental import SyncReport, has_index, ingest, patch
+from docsassist.neighbors import number_chunks
+from docsassist.schema import RAGModelSettings
+from docsassist.token_window import TokenWindow, load_token_window, truncation_report
+from docsassist.vectordb import IndexSettings, load_embeddings
+
+logger = logging.getLogger(__name__)
+
+FILES_MANIFEST = "files.json"
+# progress is logged at most this often, in seconds
+PROGRESS_INTERVAL = 5.0
+
+STUFF_PROMPT = textwrap.dedent("""\
+    Use the following pieces of context to answer the user's question.
+    If you don't know the answer, just say that you don't know, don't try to make up an answer.
+    ----------------
+    {context}""")
+
+
+class ChunkLength(str, Enum):
+    """The unit of `chunk_size` and `chunk_overlap`."""
+
+    CHARACTERS = "characters"
+    # tokens of the embedding model's tokenizer, with chunks capped at the
+    # number of tokens it embeds, see docsassist/token_window.py
+    TOKENS = "tokens"
+
+
+class IngestSettings(BaseModel):
+    """Chunking and vector database settings of the DIY RAG build."""
+
+    sentence_transformer_model_name: str = "all-MiniLM-L6-v2"
+    chunk_size: int = 2000
+    chunk_overlap: int = 1000
+    chunk_length: ChunkLength = ChunkLength.CHARACTERS
+    index: IndexSettings = IndexSettings()
+    stuff_prompt: str = STUFF_PROMPT
+    # estimated Jaccard similarity of word shingles above which chunks are
+    # merged before embedding, see docsassist/dedup.py; None keeps them all
+    near_duplicate_threshold: Optional[float] = None
+    # number each chunk in its document so that the model adds this many chunks
+    # on either side of every hit to its context, see docsassist/neighbors.py
+    neighbor_window: int = 0
+
+    @model_validator(mode="after")
+    def check_neighbor_overlap(self) -> IngestSettings:
+        if self.neighbor_window > 0 and self.chunk_overlap > 0:
+            raise ValueError(
+                "neighbor_window replaces chunk_overlap, set chunk_overlap=0"
+            )
+        return self
+
+
+# (member name, member bytes) -> documents, e.g. for one file type
+MemberLoader = Callable[[str, bytes], List[Document]]
+
+
+def load_unstructured(name: str, data: bytes) -> List[Document]:
+    """Any document type that unstructured can partition, detected from its name."""
+    loader = UnstructuredFileIOLoader(io.BytesIO(data), metadata_filename=name)
+    return loader.load()
+
+
+def load_text(name: str, data: bytes) -> List[Document]:
+    """A plain text file, read as is, without unstructured or NLTK."""
+    text = data.decode("utf-8-sig", errors="replace")
+    return [Document(page_content=text, metadata={"source": name})]
+
+
+_FRONT_MATTER = re.compile(r"\A---\r?\n.*?\r?\n---[ \t]*(?:\r?\n|\Z)", re.DOTALL)
+
+
+def load_markdown(name: str, data: bytes) -> List[Document]:
+    """A markdown file without its YAML front matter, left for the splitter."""
+    (doc,) = load_text(name, data)
+    doc.page_content = _FRONT_MATTER.sub("", doc.page_content, count=1)
+    return [doc]
+
+
+# loaders by lower-case file extension; other members, e.g. PDF and DOCX, go
+# through unstructured
+MEMBER_LOADERS: Dict[str, MemberLoader] = {
+    ".txt": load_text,
+    ".md": load_markdown,
+    ".markdown": load_markdown,
+}
+
+
+def format_source(source: str) -> str:
+    """Turn the path of a source document in the archive into its URL.
+
+    Adapt to the needs of your specific document collection.
+    """
+    source = source.replace("|", "/")
+    source = re.sub(
+        r"datarobot_docs/en/(.+)\.txt",
+        r"https://docs.datarobot.com/en/docs/\1.html",
+        source,
+    )
+    urls = re.findall(r".+(https://.+)$", source)
+    return urls[0] if urls else source
+
+
+def _loader(name: str, loaders: Mapping[str, MemberLoader]) -> MemberLoader:
+    return loaders.get(PurePosixPath(name).suffix.lower(), load_unstructured)
+
+
+def _prepare_unstructured() -> None:
+    import nltk
+
+    # once, before the workers would each download them
+    nltk.download("punkt", quiet=True)
+    nltk.download("punkt_tab", quiet=True)
+    nltk.download("averaged_perceptron_tagger_eng", quiet=True)
+
+
+def zip_members(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """The documents of an archive, skipping directories and hidden files."""
+    return [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and "." in PurePosixPath(info.filename).name
+        and not any(part.startswith(".") for part in PurePosixPath(info.filename).parts)
+    ]
+
+
+@dataclass
+class _WorkerState:
+    archive: zipfile.ZipFile
+    splitter: MarkdownTextSplitter
+    loaders: Mapping[str, MemberLoader]
+    # kept so that the splitter's length function stays valid
+    window: Optional[TokenWindow] = None
+
+
+_worker: Optional[_WorkerState] = None
+
+
+def _init_worker(
+    path_to_docs_zip: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    loaders: Mapping[str, MemberLoader],
+    window: Optional[TokenWindow] = None,
+) -> None:
+    global _worker
+    # each worker reads and decompresses its own members
+    _worker = _WorkerState(
+        archive=zipfile.ZipFile(path_to_docs_zip),
+        splitter=MarkdownTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len if window is None else window.length,
+        ),
+        loaders=loaders,
+        window=window,
+    )
+
+
+def _chunk_member(name: str) -> List[Document]:
+    assert _worker is not None
+    data = _worker.archive.read(name)
+    docs = _worker.splitter.split_documents(_loader(name, _worker.loaders)(name, data))
+    for doc in docs:
+        doc.metadata["source"] = format_source(doc.metadata.get("source", name))
+    return docs
+
+
+def iter_member_chunks(
+    path_to_docs_zip: Path,
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: Optional[int] = None,
+    loaders: Optional[Mapping[str, MemberLoader]] = None,
+    names: Optional[Collection[str]] = None,
+    window: Optional[TokenWindow] = None,
+) -> Iterator[Tuple[str, List[Document]]]:
+    """The chunks of each document in a zip file, read without extracting it.
+
+    Members, or only those in `names`, are loaded and split by `workers`
+    processes. At most a few members per worker are in flight, and they are
+    yielded in the order of the archive. With a token `window`, chunk sizes
+    are counted in its tokens instead of in characters.
+    """
+    loaders = MEMBER_LOADERS if loaders is None else loaders
+    with zipfile.ZipFile(path_to_docs_zip) as archive:
+        members = [
+            info
+            for info in zip_members(archive)
+            if names is None or info.filename in names
+        ]
+    if any(_loader(info.filename, loaders) is load_unstructured for info in members):
+        _prepare_unstructured()
+    workers = workers or os.cpu_count() or 1
+    total_bytes = sum(info.file_size for info in members)
+    started_at = last_report = time.perf_counter()
+    done_bytes = done_files = chunks = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(str(path_to_docs_zip), chunk_size, chunk_overlap, loaders, window),
+    ) as executor:
+        pending: Deque[Tuple[zipfile.ZipInfo, Future[List[Document]]]] = deque()
+        remaining = iter(members)
+        while True:
+            # a bounded window keeps memory flat, whatever the size of the archive
+            for info in itertools.islice(remaining, 4 * workers - len(pending)):
+                pending.append((info, executor.submit(_chunk_member, info.filename)))
+            if not pending:
+                break
+            info, future = pending.popleft()
+            docs = future.result()
+            yield info.filename, docs
+
+            done_files += 1
+            done_bytes += info.file_size
+            chunks += len(docs)
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL or done_files == len(members):
+                last_report = now
+                elapsed = max(now - started_at, 1e-9)
+                logger.info(
+                    f"Chunked {done_files}/{len(members)} files "
+                    f"({done_bytes / 2**20:.1f}/{total_bytes / 2**20:.1f} MiB) "
+                    f"into {chunks} chunks, "
+                    f"{done_files / elapsed:.1f} files/s, "
+                    f"{done_bytes / 2**20 / elapsed:.2f} MiB/s"
+                )
+
+
+def iter_zip_chunks(
+    path_to_docs_zip: Path,
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: Optional[int] = None,
+    loaders: Optional[Mapping[str, MemberLoader]] = None,
+) -> Iterator[Document]:
+    """Chunks of the documents in a zip file, in the order of the archive."""
+    for _, docs in iter_member_chunks(
+        path_to_docs_zip, chunk_size, chunk_overlap, workers, loaders
+    ):
+        yield from docs
+
+
+def process_zip_documents(
+    path_to_docs_zip: Path,
+    chunk_size: int,
+    chunk_overlap: int,
+    workers: Optional[int] = None,
+    loaders: Optional[Mapping[str, MemberLoader]] = None,
+) -> List[Document]:
+    """Chunk the documents of a zip file."""
+    return list(
+        iter_zip_chunks(path_to_docs_zip, chunk_size, chunk_overlap, workers, loaders)
+    )
+
+
+def rag_model_settings(settings: IngestSettings) -> RAGModelSettings:
+    """Settings the DIY RAG model reads at retrieval time."""
+    return RAGModelSettings(
+        embedding_model_name=settings.sentence_transformer_model_name,
+        max_retries=2,
+        request_timeout=30,
+        temperature=0.0,
+        stuff_prompt=settings.stuff_prompt,
+        neighbor_window=settings.neighbor_window,
+    )
+
+
+class FileEntry(BaseModel):
+    sha256: str
+    chunks: List[str] = Field(description="Stable ids of the chunks of the file")
+
+
+class FileManifest(BaseModel):
+    """The source files a vector database was built from, saved next to it."""
+
+    chunking: str = Field(description="Settings and loaders the chunks depend on")
+    near_duplicate_threshold: Optional[float] = None
+    files: Dict[str, FileEntry] = {}
+
+    @classmethod
+    def load(cls, folder: Path) -> Optional[FileManifest]:
+        path = folder / FILES_MANIFEST
+        if not path.exists():
+            return None
+        return cls.model_validate_json(path.read_text())
+
+    def save(self, folder: Path) -> None:
+        (folder / FILES_MANIFEST).write_text(self.model_dump_json())
+
+
+def chunking_key(
+    settings: IngestSettings, loaders: Optional[Mapping[str, MemberLoader]] = None
+) -> str:
+    """What the chunks of a file depend on besides its content."""
+    loaders = MEMBER_LOADERS if loaders is None else loaders
+    return json.dumps(
+        {
+            "embedding_model": settings.sentence_transformer_model_name,
+            "chunk_size": settings.chunk_size,
+            "chunk_overlap": settings.chunk_overlap,
+            "chunk_length": settings.chunk_length.value,
+            "numbered": settings.neighbor_window > 0,
+            "loaders": {
+                ext: f"{loader.__module__}.{loader.__qualname__}"
+                for ext, loader in sorted(loaders.items())
+            },
+        },
+        sort_keys=True,
+    )
+
+
+def member_hashes(path_to_docs_zip: Path) -> Dict[str, str]:
+    """SHA-256 of every document in a zip file, by member name."""
+    hashes = {}
+    with zipfile.ZipFile(path_to_docs_zip) as archive:
+        for info in zip_members(archive):
+            digest = hashlib.sha256()
+            with archive.open(info) as f:
+                for block in iter(lambda: f.read(2**20), b""):
+                    digest.update(block)
+            hashes[info.filename] = digest.hexdigest()
+    return hashes
+
+
+def update_chunk_store(
+    path: Path,
+    path_to_docs_zip: Path,
+    hashes: Mapping[str, str],
+    chunking: str,
+    settings: IngestSettings,
+    workers: Optional[int] = None,
+    loaders: Optional[Mapping[str, MemberLoader]] = None,
+    window: Optional[TokenWindow] = None,
+) -> Set[str]:
+    """Rewrite the chunk store at `path` with the chunks of the files in `hashes`.
+
+    The chunks of files already in the store with the same content and chunking
+    settings are copied over; the other files are loaded and split, and their
+    names are returned. Chunks sized in tokens are counted with the tokenizer
+    of `window` and capped at its length.
+    """
+    chunk_size = settings.chunk_size
+    if settings.chunk_length == ChunkLength.TOKENS:
+        if window is None:
+            raise ValueError("Chunking by tokens needs the embedding model's tokenizer")
+        chunk_size = min(chunk_size, window.max_tokens)
+        if settings.chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"chunk_overlap={settings.chunk_overlap} must be less than the "
+                f"chunk size of {chunk_size} tokens"
+            )
+        logger.info(f"Chunking into at most {chunk_size} tokens")
+    else:
+        window = None
+    stored = stored_files(path, chunking)
+    reused = {name for name, sha256 in hashes.items() if stored.get(name) == sha256}
+    logger.info(f"Reusing the chunks of {len(reused)} files from {path}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f".{path.name}.tmp")
+    with ChunkWriter(partial, chunking) as writer:
+        if reused:
+            writer.copy(path, reused)
+        for name, docs in iter_member_chunks(
+            path_to_docs_zip,
+            chunk_size,
+            settings.chunk_overlap,
+            workers=workers,
+            loaders=loaders,
+            names=hashes.keys() - reused,
+            window=window,
+        ):
+            if settings.neighbor_window > 0:
+                number_chunks(docs)
+            writer.write(name, hashes[name], docs)
+    os.replace(partial, path)
+    return hashes.keys() - reused
+
+
+def build_vector_database(
+    path_to_docs_zip: Path,
+    output_dir: Path,
+    settings: IngestSettings,
+    workers: Optional[int] = None,
+    embedding_function: Optional[Embeddings] = None,
+    loaders: Optional[Mapping[str, MemberLoader]] = None,
+    embedding_store: Optional[Path] = None,
+    chunk_store: Optional[Path] = None,
+    token_window: Optional[TokenWindow] = None,
+    embedding_workers: int = 1,
+    embedding_threads: Optional[int] = None,
+    embedding_batch_size: int = EMBEDDING_BATCH_SIZE,
+) -> SyncReport:
+    """Chunk the documents of a zip file into the DIY RAG model in `output_dir`.
+
+    Writes `faiss_db/`, the sentence transformer cache and the model settings.
+    Only files added or modified since the last build are chunked; the chunks
+    of modified and removed files are deleted from the index. With an
+    `embedding_store`, chunks embedded by any earlier build are not embedded again.
+    Chunks are kept in `chunk_store`, by default `chunks.parquet` in `output_dir`,
+    so that unchanged files are not loaded and split again, and streamed from it
+    into the index in batches. `token_window` defaults to that of the
+    sentence transformer unless an `embedding_function` is given; with it,
+    the chunks of newly split files, if sized in characters, are checked for
+    truncation by the embedding model.
+    With `embedding_workers > 1`, the sentence transformer runs in that many
+    processes of `embedding_threads` threads each, see docsassist/embedding_pool.py.
+    """
+    started_at = time.perf_counter()
+    faiss_dir = output_dir / "faiss_db"
+    chunking = chunking_key(settings, loaders)
+    manifest = FileManifest.load(faiss_dir)
+    if (
+        manifest is None
+        or manifest.chunking != chunking
+        or manifest.near_duplicate_threshold != settings.near_duplicate_threshold
+        or not has_index(str(faiss_dir), settings.index)
+    ):
+        manifest = None
+    previous = manifest.files if manifest is not None else {}
+
+    hashes = member_hashes(path_to_docs_zip)
+    unchanged = {
+        name
+        for name, sha256 in hashes.items()
+        if name in previous and previous[name].sha256 == sha256
+    }
+    logger.info(
+        f"{len(hashes.keys() - previous.keys())} files added, "
+        f"{len(hashes.keys() & previous.keys()) - len(unchanged)} modified, "
+        f"{len(previous.keys() - hashes.keys())} removed, "
+        f"{len(unchanged)} unchanged"
+    )
+
+    if token_window is None and embedding_function is None:
+        token_window = load_token_window(
+            str(output_dir), settings.sentence_transformer_model_name
+        )
+    # outside faiss_db/, which a rebuild starts over
+    store = chunk_store or output_dir / CHUNKS
+    with contextlib.ExitStack() as stack:
+        chunked = update_chunk_store(
+            store,
+            path_to_docs_zip,
+            hashes,
+            chunking,
+            settings,
+            workers,
+            loaders,
+            token_window,
+        )
+        if (
+            token_window is not None
+            and settings.chunk_length == ChunkLength.CHARACTERS
+            and chunked
+        ):
+            # only the new chunks, not the whole corpus on every build
+            truncation = truncation_report(
+                (doc.page_content for doc in iter_documents(store, chunked)),
+                token_window,
+            )
+            logger.info(truncation.format())
+        chunked_at = time.perf_counter()
+        ids = chunk_ids(store)
+        files = {
+            name: FileEntry(sha256=sha256, chunks=ids.get(name, []))
+            for name, sha256 in hashes.items()
+        }
+
+        if embedding_function is None and embedding_workers > 1:
+            embedding_function = stack.enter_context(
+                EmbeddingPool(
+                    functools.partial(
+                        load_embeddings,
+                        str(output_dir),
+                        settings.sentence_transformer_model_name,
+                        embedding_batch_size,
+                    ),
+                    embedding_workers,
+                    embedding_threads,
+                    embedding_batch_size,
+                )
+            )
+        elif embedding_function is None:
+            embedding_function = load_embeddings(
+                str(output_dir),
+                settings.sentence_transformer_model_name,
+                embedding_batch_size,
+            )
+        pool = embedding_function
+        if embedding_store is not None:
+            embedding_function = StoredEmbeddings(
+                embedding_function,
+                EmbeddingStore(
+                    embedding_store, settings.sentence_transformer_model_name
+                ),
+            )
+        if settings.near_duplicate_threshold is not None:
+            # merging depends on the whole corpus, so the index is synced with it
+            documents, _ = deduplicate(
+                lambda: iter_documents(store), settings.near_duplicate_threshold
+            )
+            report = ingest(
+                str(faiss_dir),
+                documents,
+                embedding_function,
+                settings.index,
+                rebuild=manifest is None,
+            )
+        elif manifest is None:
+            report = ingest(
+                str(faiss_dir),
+                iter_documents(store),
+                embedding_function,
+                settings.index,
+                rebuild=True,
+            )
+        else:
+            # chunks of unchanged files stay, even if an edited file had them too
+            kept = {chunk for name in unchanged for chunk in files[name].chunks}
+            stale = {
+                chunk
+                for name, entry in previous.items()
+                if name not in unchanged
+                for chunk in entry.chunks
+            }
+            report = patch(
+                str(faiss_dir),
+                iter_documents(store, hashes.keys() - unchanged),
+                stale - kept,
+                embedding_function,
+                settings.index,
+            )
+    FileManifest(
+        chunking=chunking,
+        near_duplicate_threshold=settings.near_duplicate_threshold,
+        files=files,
+    ).save(faiss_dir)
+    indexed_at = time.perf_counter()
+    logger.info(
+        f"Embedded {report.added} chunks in {indexed_at - chunked_at:.1f}s "
+        f"({report.added / max(indexed_at - chunked_at, 1e-9):.1f} chunks/s), "
+        f"chunking took {chunked_at - started_at:.1f}s"
+    )
+    if isinstance(embedding_function, StoredEmbeddings):
+        logger.info(
+            f"Reused {embedding_function.hits} stored embeddings, "
+            f"computed {embedding_function.misses}"
+        )
+    if isinstance(pool, EmbeddingPool):
+        logger.info(pool.format())
+
+    with open(output_dir / RAGModelSettings.filename(), "w") as f:
+        yaml.safe_dump(
+            rag_model_settings(settings).model_dump(mode="json"), f, allow_unicode=True
+        )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("documents", type=Path, help="zip file of source documents")
+    parser.add_argument(
+        "output_dir", type=Path, help="DIY RAG model directory, e.g. deployment_diy_rag"
+    )
+    parser.add_argument(
+        "--settings",
+        type=Path,
+        default=None,
+        help="JSON file of IngestSettings; default: IngestSettings()",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help=f"default: {os.cpu_count()}"
+    )
+    parser.add_argument(
+        "--embedding-store",
+        type=Path,
+        default=None,
+        help="directory of embeddings reused across builds, e.g. .cache/embeddings",
+    )
+    parser.add_argument(
+        "--chunk-store",
+        type=Path,
+        default=None,
+        help="Parquet file of chunks reused across builds; "
+        f"default: OUTPUT_DIR/{CHUNKS}",
+    )
+    parser.add_argument(
+        "--embedding-workers",
+        type=int,
+        default=1,
+        help="processes running the embedding model, each with its own copy",
+    )
+    parser.add_argument(
+        "--embedding-threads",
+        type=int,
+        default=None,
+        help="torch threads per embedding process; default: cores / processes",
+    )
+    parser.add_argument(
+        "--embedding-batch-size", type=int, default=EMBEDDING_BATCH_SIZE
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    settings = (
+        IngestSettings.model_validate_json(args.settings.read_text())
+        if args.settings
+        else IngestSettings()
+    )
+    report = build_vector_database(
+        args.documents,
+        args.output_dir,
+        settings,
+        workers=args.workers,
+        embedding_store=args.embedding_store,
+        chunk_store=args.chunk_store,
+        embedding_workers=args.embedding_workers,
+        embedding_threads=args.embedding_threads,
+        embedding_batch_size=args.embedding_batch_size,
+    )
+    print(report.format())
+
+
+if __name__ == "__main__":
+    main()
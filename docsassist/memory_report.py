@@ -0,0 +1,282 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Breakdown of the resident memory of a loaded DIY RAG model.
+
+Logged by `load_model` when RAG_MEMORY_REPORT is set, or run against a model
+directory built by docsassist.ingest:
+
+    python -m docsassist.memory_report deployment_diy_rag
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import gc
+import json
+import logging
+import os
+import pickle
+import resource
+import sys
+from dataclasses import dataclass
+from types import BuiltinFunctionType, FunctionType, ModuleType
+from typing import Any, Iterable, List, Optional
+
+import faiss
+import yaml
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from docsassist.credentials import runtime_parameter_alias
+from docsassist.schema import RAGModelSettings
+from docsassist.vectordb import (
+    VectorDB,
+    load_embeddings,
+    load_vectorstore,
+    shards_of,
+)
+
+logger = logging.getLogger(__name__)
+
+# shared by all instances, not owned by the model
+_SHARED_TYPES = (type, ModuleType, FunctionType, BuiltinFunctionType)
+
+
+class MemoryReportSettings(BaseSettings):
+    enabled: bool = Field(
+        default=False,
+        description="Log a memory breakdown of the model when it is loaded",
+        validation_alias=runtime_parameter_alias("RAG_MEMORY_REPORT"),
+    )
+
+
+@dataclass
+class MemoryReport:
+    """Approximate bytes held by each part of a loaded model."""
+
+    rss_bytes: int
+    faiss_index_type: str
+    faiss_vectors: int
+    faiss_index_bytes: int
+    docstore_chunks: int
+    docstore_text_bytes: int
+    docstore_object_bytes: int
+    docstore_pickle_bytes: int
+    embedding_model: str
+    embedding_weights_bytes: int
+    tokenizer_vocab_size: Optional[int]
+    tokenizer_bytes: int
+    langchain_graph_bytes: Optional[int] = None
+
+    @property
+    def docstore_pickle_overhead_bytes(self) -> int:
+        return self.docstore_pickle_bytes - self.docstore_text_bytes
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            **dataclasses.asdict(self),
+            "docstore_pickle_overhead_bytes": self.docstore_pickle_overhead_bytes,
+        }
+
+    def format(self) -> str:
+        def mib(n: Optional[int]) -> str:
+            return "n/a" if n is None else f"{n / 2**20:10.1f} MiB"
+
+        rows = [
+            ("process RSS", mib(self.rss_bytes)),
+            (
+                f"faiss index ({self.faiss_index_type}, {self.faiss_vectors} vectors)",
+                mib(self.faiss_index_bytes),
+            ),
+            (
+                f"docstore objects ({self.docstore_chunks} chunks)",
+                mib(self.docstore_object_bytes),
+            ),
+            ("  of which chunk text (utf-8)", mib(self.docstore_text_bytes)),
+            ("  pickled size", mib(self.docstore_pickle_bytes)),
+            ("  pickle overhead", mib(self.docstore_pickle_overhead_bytes)),
+            (
+                f"embedding weights ({self.embedding_model})",
+                mib(self.embedding_weights_bytes),
+            ),
+            (
+                f"tokenizer (vocab {self.tokenizer_vocab_size or 'n/a'})",
+                mib(self.tokenizer_bytes),
+            ),
+            ("langchain object graph", mib(self.langchain_graph_bytes)),
+        ]
+        width = max(len(name) for name, _ in rows)
+        return "\n".join(f"{name:<{width}} {value}" for name, value in rows)
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def deep_sizeof(roots: Iterable[Any], exclude: Iterable[Any] = ()) -> int:
+    """Python heap bytes reachable from `roots`, not following into `exclude`.
+
+    Classes, modules and functions are shared with the rest of the process and
+    are not counted. Memory owned by C extensions (FAISS, torch, tokenizers) is
+    invisible to `sys.getsizeof` and is measured separately.
+    """
+    seen = {id(obj) for obj in exclude}
+    stack = list(roots)
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+def faiss_index_bytes(index: faiss.Index) -> int:
+    """Bytes of the codes and graph/list structures of a FAISS index.
+
+    Computed from the index layout rather than `faiss.serialize_index`, which
+    would briefly double the memory of a large index.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexFlatCodes):
+        return int(index.codes.size())
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        graph = 4 * (hnsw.neighbors.size() + hnsw.levels.size())
+        graph += 8 * hnsw.offsets.size()
+        return int(graph) + faiss_index_bytes(index.storage)
+    if isinstance(index, faiss.IndexIVF):
+        lists = index.invlists
+        entries = sum(lists.list_size(i) for i in range(lists.nlist))
+        # codes plus one int64 id per vector
+        codes = int(entries * (index.code_size + 8))
+        return codes + faiss_index_bytes(index.quantizer)
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def _embedding_model_bytes(client: Any) -> int:
+    if client is None or not hasattr(client, "parameters"):
+        return 0
+    tensors = list(client.parameters()) + list(client.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _tokenizer_bytes(tokenizer: Any) -> int:
+    # the vocabulary of a fast tokenizer lives in Rust; its JSON is a fair proxy
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        return len(backend.to_str().encode("utf-8"))
+    return deep_sizeof([tokenizer])
+
+
+def memory_report(
+    vectorstore: VectorDB,
+    embeddings: Embeddings,
+    chain: Optional[Any] = None,
+) -> MemoryReport:
+    """Measure a loaded vector store, its embedding model and optionally the chain.
+
+    The chain graph excludes the docstore and the embedding model, which are
+    reported on their own. Sharded stores are reported as the sum of shards.
+    """
+    shards = shards_of(vectorstore)
+    docstores = [part for shard in shards for part in _docstore_parts(shard)]
+    documents = [
+        shard.docstore.search(id_)
+        for shard in shards
+        for id_ in shard.index_to_docstore_id.values()
+    ]
+    client = getattr(embeddings, "client", None)
+    tokenizer = getattr(client, "tokenizer", None)
+    graph_bytes = None
+    if chain is not None:
+        graph_bytes = deep_sizeof([chain], exclude=docstores + [client])
+    index_type = type(faiss.downcast_index(shards[0].index)).__name__
+    return MemoryReport(
+        rss_bytes=current_rss_bytes(),
+        faiss_index_type=(
+            index_type if len(shards) == 1 else f"{index_type} x{len(shards)} shards"
+        ),
+        faiss_vectors=sum(shard.index.ntotal for shard in shards),
+        faiss_index_bytes=sum(faiss_index_bytes(shard.index) for shard in shards),
+        docstore_chunks=len(documents),
+        docstore_text_bytes=sum(
+            len(doc.page_content.encode("utf-8"))
+            for doc in documents
+            if isinstance(doc, Document)
+        ),
+        docstore_object_bytes=deep_sizeof(docstores),
+        # what FAISS.save_local writes to index.pkl and load_local unpickles
+        docstore_pickle_bytes=sum(
+            len(pickle.dumps(tuple(_docstore_parts(shard)))) for shard in shards
+        ),
+        embedding_model=getattr(embeddings, "model_name", type(embeddings).__name__),
+        embedding_weights_bytes=_embedding_model_bytes(client),
+        tokenizer_vocab_size=getattr(tokenizer, "vocab_size", None),
+        tokenizer_bytes=0 if tokenizer is None else _tokenizer_bytes(tokenizer),
+        langchain_graph_bytes=graph_bytes,
+    )
+
+
+def _docstore_parts(shard: FAISS) -> List[Any]:
+    return [shard.docstore, shard.index_to_docstore_id]
+
+
+def log_memory_report(
+    vectorstore: VectorDB, embeddings: Embeddings, chain: Optional[Any] = None
+) -> Optional[MemoryReport]:
+    """Log the memory report if enabled by RAG_MEMORY_REPORT."""
+    if not MemoryReportSettings().enabled:
+        return None
+    report = memory_report(vectorstore, embeddings, chain)
+    logger.info("DIY RAG model memory:\n" + report.format())
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory footprint of a DIY RAG model")
+    parser.add_argument("model_dir", help="e.g. deployment_diy_rag")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.model_dir, RAGModelSettings.filename())) as f:
+        model_settings = RAGModelSettings.model_validate(yaml.safe_load(f))
+    rss_before = current_rss_bytes()
+    embeddings = load_embeddings(args.model_dir, model_settings.embedding_model_name)
+    vectorstore = load_vectorstore(args.model_dir, embeddings)
+    loaded_bytes = current_rss_bytes() - rss_before
+    # the chain needs LLM credentials, so its graph is only reported by load_model
+    report = memory_report(vectorstore, embeddings)
+    if args.json:
+        print(json.dumps({**report.to_dict(), "rss_delta_on_load_bytes": loaded_bytes}))
+    else:
+        print(report.format())
+        print(f"RSS growth while loading: {loaded_bytes / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Vector search restricted to chunks whose metadata match a filter.
+
+The filter is applied by FAISS during the search through an ID selector, so all
+k results match it. Selectors are backed by one bit per chunk, computed once
+per filter value and cached.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+from pydantic import BaseModel, ConfigDict, Field
+
+from docsassist.vectordb import (
+    IncrementalFAISS,
+    ShardedFAISS,
+    VectorDB,
+    search_parameters,
+    shards_of,
+    tombstones_of,
+)
+
+
+class RetrievalFilter(BaseModel):
+    """Chunks to search, e.g. `{"source_prefix": "https://docs.datarobot.com/en/docs/mlops/"}`."""
+
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    source_prefix: Optional[str] = Field(
+        default=None, description="Only chunks whose `source` starts with this"
+    )
+    metadata: Dict[str, Any] = Field(
+        default_factory=dict, description="Only chunks with these metadata values"
+    )
+
+    @classmethod
+    def parse(
+        cls, value: Union[str, Dict[str, Any], None]
+    ) -> Optional[RetrievalFilter]:
+        """Parse the JSON of an input column; empty values mean no filter."""
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        if isinstance(value, str):
+            if not value.strip():
+                return None
+            value = json.loads(value)
+        retrieval_filter = cls.model_validate(value)
+        return None if retrieval_filter.is_empty() else retrieval_filter
+
+    def is_empty(self) -> bool:
+        return self.source_prefix is None and not self.metadata
+
+    def key(self) -> str:
+        return json.dumps(self.model_dump(), sort_keys=True, default=str)
+
+    def matches(self, metadata: Dict[str, Any]) -> bool:
+        if self.source_prefix is not None and not str(
+            metadata.get("source", "")
+        ).startswith(self.source_prefix):
+            return False
+        return all(metadata.get(k) == v for k, v in self.metadata.items())
+
+
+# filter of the request being scored
+current_retrieval_filter: ContextVar[Optional[RetrievalFilter]] = ContextVar(
+    "current_retrieval_filter", default=None
+)
+
+
+class FilteredSearch:
+    """Filtered similarity search over one vector store, with cached bitmaps."""
+
+    def __init__(self, vectorstore: VectorDB, max_cached_filters: int = 128) -> None:
+        self.vectorstore = vectorstore
+        self.max_cached_filters = max_cached_filters
+        self._shards = shards_of(vectorstore)
+        self._shard_numbers = {id(shard): i for i, shard in enumerate(self._shards)}
+        self._bitmaps: OrderedDict[Tuple[str, int], np.ndarray[Any, Any]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def bitmap(
+        self, retrieval_filter: RetrievalFilter, shard: int = 0
+    ) -> np.ndarray[Any, Any]:
+        """One bit per chunk of a shard, in the bit order of IDSelectorBitmap."""
+        key = (retrieval_filter.key(), shard)
+        with self._lock:
+            if key in self._bitmaps:
+                self._bitmaps.move_to_end(key)
+                return self._bitmaps[key]
+        store = self._shards[shard]
+        mask = np.zeros(store.index.ntotal, dtype=bool)
+        tombstones = tombstones_of(store)
+        for i, docstore_id in store.index_to_docstore_id.items():
+            if i in tombstones:
+                continue
+            doc = store.docstore.search(docstore_id)
+            mask[i] = isinstance(doc, Document) and retrieval_filter.matches(
+                doc.metadata
+            )
+        bitmap = np.packbits(mask, bitorder="little")
+        with self._lock:
+            self._bitmaps[key] = bitmap
+            while len(self._bitmaps) > self.max_cached_filters * len(self._shards):
+                self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def _search_shard(
+        self,
+        store: FAISS,
+        embedding: Sequence[float],
+        retrieval_filter: RetrievalFilter,
+        k: int,
+    ) -> List[Tuple[Document, float]]:
+        bitmap = self.bitmap(retrieval_filter, self._shard_numbers[id(store)])
+        if not bitmap.any():
+            return []
+        vector = np.asarray([embedding], dtype=np.float32)
+        if store._normalize_L2:
+            faiss.normalize_L2(vector)
+        if isinstance(store, IncrementalFAISS) and store.is_binary:
+            allowed = np.unpackbits(
+                bitmap, count=store.index.ntotal, bitorder="little"
+            ).astype(bool)
+            scores, indices = store.rerank_search(vector, k, allowed)
+        else:
+            # `bitmap` must outlive the search, the selector only points to it
+            selector = faiss.IDSelectorBitmap(
+                store.index.ntotal, faiss.swig_ptr(bitmap)
+            )
+            found_scores, found = store.index.search(
+                vector, k, params=search_parameters(store.index, selector)
+            )
+            scores, indices = found_scores[0], found[0]
+        results = []
+        for i, score in zip(indices, scores):
+            # fewer than k chunks may match
+            if i == -1:
+                continue
+            doc = store.docstore.search(store.index_to_docstore_id[i])
+            if isinstance(doc, Document):
+                results.append((doc, float(score)))
+        return results
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: Sequence[float],
+        retrieval_filter: RetrievalFilter,
+        k: int = 4,
+    ) -> List[Tuple[Document, float]]:
+        if isinstance(self.vectorstore, ShardedFAISS):
+            return self.vectorstore.scatter_gather(
+                lambda shard: self._search_shard(shard, embedding, retrieval_filter, k),
+                k,
+            )
+        return self._search_shard(self.vectorstore, embedding, retrieval_filter, k)
+
+    def similarity_search(
+        self, query: str, retrieval_filter: RetrievalFilter, k: int = 4
+    ) -> List[Document]:
+        embedding = self.vectorstore._embed_query(query)
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, retrieval_filter, k=k
+            )
+        ]
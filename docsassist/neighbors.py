@@ -0,0 +1,114 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Expand retrieved chunks with their neighbors in the source document.
+
+Instead of overlapping chunks, which roughly double the index for a
+`chunk_overlap` of half the `chunk_size`, the build can split documents into
+non-overlapping chunks that record their position in the `chunk_index`
+metadata. At query time each hit is widened to the chunks around it, so the
+answer still sees the context at the chunk boundaries.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from docsassist.vectordb import VectorDB, shards_of, tombstones_of
+
+CHUNK_INDEX = "chunk_index"
+
+
+def number_chunks(documents: List[Document]) -> None:
+    """Record the position of each chunk of a source document in its metadata."""
+    for i, doc in enumerate(documents):
+        doc.metadata[CHUNK_INDEX] = i
+
+
+class Neighbors:
+    """Chunks of one vector store by source and position, indexed on first use."""
+
+    def __init__(self, vectorstore: VectorDB) -> None:
+        self.vectorstore = vectorstore
+        self._chunks: Optional[Dict[Tuple[Any, int], Document]] = None
+        self._lock = threading.Lock()
+
+    def _positions(self) -> Dict[Tuple[Any, int], Document]:
+        with self._lock:
+            if self._chunks is None:
+                chunks = {}
+                for store in shards_of(self.vectorstore):
+                    tombstones = tombstones_of(store)
+                    for i, docstore_id in store.index_to_docstore_id.items():
+                        if i in tombstones:
+                            continue
+                        doc = store.docstore.search(docstore_id)
+                        if isinstance(doc, Document) and CHUNK_INDEX in doc.metadata:
+                            key = (
+                                doc.metadata.get("source"),
+                                doc.metadata[CHUNK_INDEX],
+                            )
+                            chunks[key] = doc
+                self._chunks = chunks
+            return self._chunks
+
+    def expand(self, documents: List[Document], window: int) -> List[Document]:
+        """Each hit joined with up to `window` chunks on either side.
+
+        Hits from the same source whose windows overlap become one document,
+        at the rank of the best of them. Hits without a position are kept as is.
+        """
+        if window <= 0:
+            return documents
+        chunks = self._positions()
+        runs: List[Tuple[Any, int, int, Document]] = []
+        expanded: List[Optional[Document]] = []
+        for doc in documents:
+            if CHUNK_INDEX not in doc.metadata:
+                expanded.append(doc)
+                continue
+            source, position = doc.metadata.get("source"), doc.metadata[CHUNK_INDEX]
+            start, end = position - window, position + window
+            for j, (run_source, run_start, run_end, _) in enumerate(runs):
+                if (
+                    run_source == source
+                    and start <= run_end + 1
+                    and run_start <= end + 1
+                ):
+                    runs[j] = (
+                        source,
+                        min(start, run_start),
+                        max(end, run_end),
+                        runs[j][3],
+                    )
+                    break
+            else:
+                runs.append((source, start, end, doc))
+                # placeholder at the rank of the run's first hit
+                expanded.append(None)
+        run_documents = iter(
+            Document(
+                page_content="\n\n".join(
+                    chunks[(source, i)].page_content
+                    for i in range(start, end + 1)
+                    if (source, i) in chunks
+                )
+                or hit.page_content,
+                metadata=hit.metadata,
+            )
+            for source, start, end, hit in runs
+        )
+        return [doc if doc is not None else next(run_documents) for doc in expanded]
@@ -0,0 +1,213 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load the read-only assets of the DIY RAG model once, before workers fork.
+
+Forked workers share the parent's memory pages until they write to them. Plain
+Python objects defeat this: reading a `Document` changes its reference count,
+and every garbage collection writes to the header of every tracked object, so
+each worker ends up with a private copy of the whole docstore. Preloading
+therefore keeps chunk text and metadata in a few flat buffers and moves what is
+left into the permanent GC generation with `gc.freeze`.
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from docsassist.credentials import runtime_parameter_alias
+from docsassist.vectordb import (
+    VectorDB,
+    load_embeddings,
+    load_vectorstore,
+    shards_of,
+    tombstones_of,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PreforkSettings(BaseSettings):
+    preload: bool = Field(
+        default=False,
+        description="Load the index and embedding model when custom.py is "
+        "imported, so workers forked afterwards share them",
+        validation_alias=runtime_parameter_alias("RAG_PREFORK_PRELOAD"),
+    )
+
+
+class _FlatStrings:
+    """A sequence of strings stored as one UTF-8 buffer and an offset array."""
+
+    def __init__(self, strings: Sequence[str]) -> None:
+        encoded = [s.encode("utf-8") for s in strings]
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self._offsets[1:])
+        self._buffer = b"".join(encoded)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, stop = self._offsets[i], self._offsets[i + 1]
+        return self._buffer[start:stop].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buffer) + self._offsets.nbytes
+
+
+class FlatDocstore(Docstore):
+    """Read-only docstore of chunks addressed by their position in the index.
+
+    Documents are rebuilt on every lookup, which costs a few microseconds per
+    retrieved chunk, but nothing is stored as a per-chunk Python object.
+    """
+
+    def __init__(self, documents: Sequence[Document]) -> None:
+        self._texts = _FlatStrings([doc.page_content for doc in documents])
+        self._metadatas = _FlatStrings([json.dumps(doc.metadata) for doc in documents])
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    @property
+    def nbytes(self) -> int:
+        return self._texts.nbytes + self._metadatas.nbytes
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            i = int(search)
+        except ValueError:
+            return f"ID {search} not found."
+        if not 0 <= i < len(self):
+            return f"ID {search} not found."
+        return Document(
+            page_content=self._texts[i], metadata=json.loads(self._metadatas[i])
+        )
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise NotImplementedError("FlatDocstore is read-only")
+
+    def delete(self, ids: List[Any]) -> None:
+        raise NotImplementedError("FlatDocstore is read-only")
+
+
+class PositionalIds(Mapping[int, str]):
+    """`index_to_docstore_id` of a FlatDocstore, without a dict of n strings."""
+
+    def __init__(self, n: int) -> None:
+        self._n = n
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < self._n:
+            raise KeyError(i)
+        return str(i)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._n))
+
+    def __len__(self) -> int:
+        return self._n
+
+
+def flatten_docstore(vectorstore: VectorDB) -> VectorDB:
+    """Replace the docstore of every shard with a FlatDocstore, in place."""
+    for shard in shards_of(vectorstore):
+        n = shard.index.ntotal
+        tombstones = tombstones_of(shard)
+        documents = []
+        for i in range(n):
+            if i in tombstones:
+                # searches skip deleted chunks, only their positions must remain
+                documents.append(Document(page_content=""))
+                continue
+            doc = shard.docstore.search(shard.index_to_docstore_id[i])
+            if not isinstance(doc, Document):
+                raise ValueError(f"Chunk {i} of the index is missing from the docstore")
+            documents.append(doc)
+        shard.docstore = FlatDocstore(documents)
+        shard.index_to_docstore_id = PositionalIds(n)  # type: ignore[assignment]
+    return vectorstore
+
+
+_preloaded: Dict[str, tuple[VectorDB, Embeddings]] = {}
+
+
+def preload(
+    input_dir: str,
+    embedding_model_name: str,
+    embedding_function: Optional[Embeddings] = None,
+) -> tuple[VectorDB, Embeddings]:
+    """Load and flatten the vector store and embedding model, then freeze the heap.
+
+    The embedding model is not run here: warming it up would start torch's
+    OpenMP thread pool, which does not survive a fork.
+    """
+    embeddings = embedding_function or load_embeddings(input_dir, embedding_model_name)
+    vectorstore = flatten_docstore(load_vectorstore(input_dir, embeddings))
+    _preloaded[os.path.abspath(input_dir)] = (vectorstore, embeddings)
+    # collect garbage first so it isn't frozen, then keep the GC of every worker
+    # from touching the pages of the objects loaded so far
+    gc.collect()
+    gc.freeze()
+    logger.info(
+        f"Preloaded {sum(s.index.ntotal for s in shards_of(vectorstore))} chunks "
+        f"from {input_dir}, "
+        f"{gc.get_freeze_count()} objects frozen"
+    )
+    return vectorstore, embeddings
+
+
+def preloaded(input_dir: str) -> Optional[tuple[VectorDB, Embeddings]]:
+    """The assets preloaded for `input_dir` by this process or its parent."""
+    return _preloaded.get(os.path.abspath(input_dir))
+
+
+def release_preloaded(input_dir: str) -> None:
+    """Forget the vector store preloaded for `input_dir`, e.g. once it is replaced.
+
+    Otherwise the pre-fork index would stay in memory next to the new version.
+    """
+    if _preloaded.pop(os.path.abspath(input_dir), None) is not None:
+        logger.info(f"Released the index preloaded from {input_dir}")
+
+
+def smaps_rollup() -> Dict[str, int]:
+    """Shared and private memory of this process in bytes (Linux only)."""
+    fields: Dict[str, int] = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return fields
+
+
+def private_bytes(rollup: Dict[str, Any]) -> int:
+    return int(rollup["Private_Clean"] + rollup["Private_Dirty"])
+
+
+def shared_bytes(rollup: Dict[str, Any]) -> int:
+    return int(rollup["Shared_Clean"] + rollup["Shared_Dirty"])
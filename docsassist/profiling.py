@@ -0,0 +1,214 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import cProfile
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from types import FrameType
+from typing import Iterator, Optional, Protocol
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+from docsassist.credentials import runtime_parameter_alias
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerMode(str, Enum):
+    OFF = "off"
+    CPROFILE = "cprofile"
+    SAMPLING = "sampling"
+
+
+class ProfilingSettings(BaseSettings):
+    """Per-request profiling, configured by environment or runtime parameters."""
+
+    mode: ProfilerMode = Field(
+        default=ProfilerMode.OFF,
+        validation_alias=runtime_parameter_alias("RAG_PROFILING_MODE"),
+    )
+    sample_rate: float = Field(
+        default=0.0,
+        ge=0,
+        le=1,
+        description="Fraction of requests to profile unconditionally",
+        validation_alias=runtime_parameter_alias("RAG_PROFILING_SAMPLE_RATE"),
+    )
+    latency_threshold: Optional[float] = Field(
+        default=None,
+        description="Profile every request and keep those slower than this (s)",
+        validation_alias=runtime_parameter_alias("RAG_PROFILING_LATENCY_THRESHOLD"),
+    )
+    output_dir: Path = Field(
+        default=Path("/tmp/rag_profiles"),
+        validation_alias=runtime_parameter_alias("RAG_PROFILING_OUTPUT_DIR"),
+    )
+    max_profiles: int = Field(
+        default=100,
+        description="Number of most recent profiles kept in output_dir",
+        validation_alias=runtime_parameter_alias("RAG_PROFILING_MAX_PROFILES"),
+    )
+    sampling_interval: float = Field(
+        default=0.005,
+        description="Seconds between stack samples of the sampling profiler",
+        validation_alias=runtime_parameter_alias("RAG_PROFILING_SAMPLING_INTERVAL"),
+    )
+
+
+class _Profiler(Protocol):
+    suffix: str
+
+    def start(self) -> None: ...
+
+    def stop(self) -> None: ...
+
+    def dump(self, path: Path) -> None: ...
+
+
+class _CProfiler:
+    """Deterministic profiler of the scoring thread, written in pstats format."""
+
+    suffix = ".prof"
+
+    def __init__(self) -> None:
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self._profile.enable()
+
+    def stop(self) -> None:
+        self._profile.disable()
+
+    def dump(self, path: Path) -> None:
+        self._profile.dump_stats(path)
+
+
+class SamplingProfiler:
+    """Low-overhead stack sampler of all threads, written as folded stacks.
+
+    The output can be rendered with flamegraph.pl or speedscope. Unlike cProfile
+    it also sees LLM calls running on the generation worker thread.
+    """
+
+    suffix = ".folded"
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="rag-sampling-profiler", daemon=True
+        )
+
+    @staticmethod
+    def _folded(thread_name: str, frame: Optional[FrameType]) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join([thread_name] + stack[::-1])
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    name = names.get(thread_id, str(thread_id))
+                    self.samples[self._folded(name, frame)] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, path: Path) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """Profile a sampled fraction of requests and/or the slow ones."""
+
+    def __init__(self, settings: ProfilingSettings) -> None:
+        self.settings = settings
+        settings.output_dir.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional[RequestProfiler]:
+        """The configured profiler, or None when profiling is disabled."""
+        settings = ProfilingSettings()
+        if settings.mode == ProfilerMode.OFF or (
+            settings.sample_rate == 0 and settings.latency_threshold is None
+        ):
+            return None
+        logger.info(f"Request profiling enabled: {settings!r}")
+        return cls(settings)
+
+    def _make_profiler(self) -> _Profiler:
+        if self.settings.mode == ProfilerMode.CPROFILE:
+            return _CProfiler()
+        return SamplingProfiler(self.settings.sampling_interval)
+
+    @contextmanager
+    def profile(self, association_id: str) -> Iterator[None]:
+        sampled = random.random() < self.settings.sample_rate
+        if not sampled and self.settings.latency_threshold is None:
+            yield
+            return
+
+        profiler = self._make_profiler()
+        started_at = time.perf_counter()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - started_at
+            threshold = self.settings.latency_threshold
+            if sampled or (threshold is not None and elapsed >= threshold):
+                self._write(profiler, association_id, elapsed)
+
+    def _write(self, profiler: _Profiler, association_id: str, elapsed: float) -> None:
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(association_id))[:100]
+        timestamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        path = self.settings.output_dir / f"{timestamp}_{safe_id}{profiler.suffix}"
+        try:
+            profiler.dump(path)
+            self._rotate()
+        except OSError:
+            logger.exception("Failed to write request profile")
+            return
+        logger.info(f"Profiled request {association_id} ({elapsed:.3f}s): {path}")
+
+    def _rotate(self) -> None:
+        # file names start with a timestamp, so they sort oldest first
+        profiles = sorted(p for p in self.settings.output_dir.iterdir() if p.is_file())
+        for stale in profiles[: max(0, len(profiles) - self.settings.max_profiles)]:
+            stale.unlink(missing_ok=True)
@@ -0,0 +1,268 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+import openai
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the LLM while the circuit breaker is open."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Whether an LLM client error is transient (throttling, 5xx, timeouts)."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (openai.APIConnectionError, TimeoutError, ConnectionError)):
+        # APITimeoutError is a subclass of APIConnectionError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """Fail fast while the LLM endpoint is unhealthy.
+
+    The breaker opens after `failure_threshold` consecutive transient failures,
+    rejects calls for `reset_timeout` seconds and then lets a single trial call
+    through (half open). A successful trial closes it again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def before_call(self) -> None:
+        with self._lock:
+            state = self._state()
+            if state == CircuitState.OPEN or (
+                state == CircuitState.HALF_OPEN and self._trial_in_flight
+            ):
+                raise CircuitOpenError(
+                    f"LLM circuit breaker is open after {self._failures} "
+                    "consecutive failures"
+                )
+            if state == CircuitState.HALF_OPEN:
+                self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self._trial_in_flight
+                or self._failures >= self.failure_threshold
+                or self._opened_at is not None
+            ):
+                if self._opened_at is None:
+                    logger.warning("Opening LLM circuit breaker")
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+    def record_ignored(self) -> None:
+        """Release a half-open trial that ended in a non-transient error."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+@dataclass
+class CallStats:
+    """Per-request retry bookkeeping, surfaced in the prediction output."""
+
+    deadline: Optional[float] = None
+    attempts: int = 0
+    retries: int = 0
+
+
+_current_stats: ContextVar[Optional[CallStats]] = ContextVar(
+    "llm_call_stats", default=None
+)
+
+
+class LLMGuard:
+    """Classified retries with jittered exponential backoff plus a circuit breaker."""
+
+    def __init__(
+        self,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        breaker: CircuitBreaker,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+        self._clock = clock
+        self._sleep = sleep
+
+    def backoff(self, retry: int) -> float:
+        """Full-jitter delay before the given (0-based) retry."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**retry))
+
+    @contextmanager
+    def track(self, timeout: Optional[float] = None) -> Iterator[CallStats]:
+        """Collect stats for all LLM calls made within one prediction request."""
+        stats = CallStats(deadline=None if timeout is None else self._clock() + timeout)
+        token = _current_stats.set(stats)
+        try:
+            yield stats
+        finally:
+            _current_stats.reset(token)
+
+    def call(self, fn: Callable[[], T]) -> T:
+        stats = _current_stats.get() or CallStats()
+        retry = 0
+        while True:
+            self.breaker.before_call()
+            stats.attempts += 1
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_ignored()
+                    raise
+                self.breaker.record_failure()
+                if retry >= self.max_retries:
+                    raise
+                delay = self.backoff(retry)
+                if stats.deadline is not None and (
+                    self._clock() + delay >= stats.deadline
+                ):
+                    logger.warning("Not retrying LLM call past the request deadline")
+                    raise
+                logger.info(f"Retrying LLM call in {delay:.2f}s after {e!r}")
+                self._sleep(delay)
+                retry += 1
+                stats.retries += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    def wrap(self, runnable: Runnable[Any, Any]) -> Runnable[Any, Any]:
+        """Route every invocation of `runnable` through `call`."""
+
+        def _invoke(input: Any, config: RunnableConfig) -> Any:
+            return self.call(lambda: runnable.invoke(input, config))
+
+        return RunnableLambda(_invoke, name="GuardedLLM")
+
+
+class DeadlinePool:
+    """Threads for calls that are abandoned, not interrupted, when they are late.
+
+    An abandoned call keeps its thread until it returns. At most `workers`
+    calls run at once, abandoned ones included; when all are busy, `submit`
+    returns None rather than queue a call that would spend its deadline waiting.
+    """
+
+    def __init__(self, workers: int, thread_name_prefix: str = "deadline") -> None:
+        self.workers = workers
+        self.abandoned = 0
+        self.rejected = 0
+        self._running_abandoned = 0
+        self._slots = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=thread_name_prefix
+        )
+
+    def submit(self, fn: Callable[..., T], *args: Any) -> Optional[Future[T]]:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            logger.warning(
+                f"All {self.workers} threads are busy, "
+                f"{self._running_abandoned} with abandoned calls"
+            )
+            return None
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def abandon(self, future: Future[Any]) -> None:
+        """Stop waiting for a late call; it finishes in the background."""
+        if future.cancel():
+            return
+        with self._lock:
+            self.abandoned += 1
+            self._running_abandoned += 1
+        logger.warning(
+            f"Abandoned a late call, {self._running_abandoned} of "
+            f"{self.workers} threads are busy with abandoned calls"
+        )
+        future.add_done_callback(self._abandoned_done)
+
+    def _abandoned_done(self, future: Future[Any]) -> None:
+        with self._lock:
+            self._running_abandoned -= 1
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -41,6 +41,16 @@ class ApplicationType(str, Enum):
 
 PROMPT_COLUMN_NAME: str = "promptText"
 TARGET_COLUMN_NAME: str = "resultText"
+LLM_ATTEMPTS_COLUMN_NAME: str = "LLM_ATTEMPTS"
+LLM_RETRIES_COLUMN_NAME: str = "LLM_RETRIES"
+LLM_CIRCUIT_STATE_COLUMN_NAME: str = "LLM_CIRCUIT_STATE"
+DEGRADED_COLUMN_NAME: str = "ANSWER_DEGRADED"
+# optional input column selecting one of the named indexes of the DIY RAG model
+INDEX_NAME_COLUMN_NAME: str = "index_name"
+# optional JSON input column restricting retrieval, see docsassist/metadata_filter.py
+RETRIEVAL_FILTER_COLUMN_NAME: str = "retrieval_filter"
+# version of the index each row was retrieved from, see docsassist/index_versions.py
+INDEX_VERSION_COLUMN_NAME: str = "INDEX_VERSION"
 
 
 class RAGInput(BaseModel):
@@ -70,6 +80,47 @@ class RAGModelSettings(BaseModel):
     request_timeout: int
     stuff_prompt: str
     temperature: float
+    retry_backoff_base: float = Field(
+        default=0.5, description="Initial backoff in seconds between LLM retries"
+    )
+    retry_backoff_max: float = Field(
+        default=8.0, description="Upper bound in seconds for a single backoff"
+    )
+    request_deadline: Optional[float] = Field(
+        default=None,
+        description="Time budget in seconds for one prediction row; "
+        "defaults to `request_timeout`",
+    )
+    circuit_failure_threshold: int = Field(
+        default=5,
+        description="Consecutive transient LLM failures that open the circuit",
+    )
+    circuit_reset_timeout: float = Field(
+        default=30.0,
+        description="Seconds the circuit stays open before a trial call",
+    )
+    generation_deadline: Optional[float] = Field(
+        default=None,
+        description="Seconds after the start of a row by which the LLM answer must "
+        "be ready; when missed, an extractive answer is returned instead. "
+        "Disabled when unset",
+    )
+    generation_workers: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Threads running answers under `generation_deadline`, "
+        "including late ones still finishing; when all are busy, a row gets the "
+        "extractive answer at once. Defaults to enough for one row per deadline "
+        "while late answers run to the request deadline",
+    )
+    degraded_answer_sentences: int = Field(
+        default=3, description="Number of sentences in an extractive answer"
+    )
+    neighbor_window: int = Field(
+        default=0,
+        description="Chunks on either side of each retrieved chunk that are added "
+        "to its context; needs an index built with the same `neighbor_window`",
+    )
 
     @classmethod
     def filename(cls) -> str:
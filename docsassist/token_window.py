@@ -0,0 +1,103 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The number of tokens of a chunk that the embedding model actually embeds.
+
+A sentence transformer truncates its input at `max_seq_length` word pieces,
+256 for all-MiniLM-L6-v2, which is around 1000 characters of English. The rest
+of a longer chunk is tokenized and thrown away: it is shown to the LLM but
+doesn't affect the vector the chunk is retrieved by.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+SENTENCE_TRANSFORMER_CONFIG = "sentence_bert_config.json"
+
+
+@dataclass
+class TokenWindow:
+    """The tokenizer of an embedding model and how many tokens of a text it embeds.
+
+    `tokenizer` only needs a `tokenize(text)` method; it is sent to the
+    chunking worker processes, so it must be picklable.
+    """
+
+    tokenizer: Any
+    max_tokens: int
+
+    def length(self, text: str) -> int:
+        return len(self.tokenizer.tokenize(text))
+
+
+def load_token_window(input_dir: str, model_name: str) -> TokenWindow:
+    """The window of a sentence transformer cached in a DIY RAG model directory."""
+    from huggingface_hub import hf_hub_download
+    from transformers import AutoTokenizer
+
+    repo = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    cache_folder = os.path.join(input_dir, "sentencetransformers")
+    tokenizer = AutoTokenizer.from_pretrained(repo, cache_dir=cache_folder)
+    try:
+        config = hf_hub_download(
+            repo, SENTENCE_TRANSFORMER_CONFIG, cache_dir=cache_folder
+        )
+        with open(config) as f:
+            max_seq_length = int(json.load(f)["max_seq_length"])
+    except (OSError, KeyError):
+        max_seq_length = tokenizer.model_max_length
+    # the [CLS] and [SEP] tokens take two places of the window
+    return TokenWindow(
+        tokenizer, max_seq_length - tokenizer.num_special_tokens_to_add()
+    )
+
+
+@dataclass
+class TruncationReport:
+    chunks: int
+    truncated: int
+    tokens: int
+    dropped_tokens: int
+    max_tokens: int
+
+    def format(self) -> str:
+        return (
+            f"{self.truncated} of {self.chunks} chunks "
+            f"({self.truncated / max(self.chunks, 1):.1%}) are longer than the "
+            f"{self.max_tokens}-token window of the embedding model, "
+            f"{self.dropped_tokens / max(self.tokens, 1):.1%} of all tokens are "
+            "never embedded"
+        )
+
+
+def truncation_report(texts: Iterable[str], window: TokenWindow) -> TruncationReport:
+    """How many of `texts` the embedding model truncates, and by how much."""
+    chunks = truncated = tokens = dropped_tokens = 0
+    for text in texts:
+        length = window.length(text)
+        chunks += 1
+        tokens += length
+        if length > window.max_tokens:
+            truncated += 1
+            dropped_tokens += length - window.max_tokens
+    return TruncationReport(
+        chunks=chunks,
+        truncated=truncated,
+        tokens=tokens,
+        dropped_tokens=dropped_tokens,
+        max_tokens=window.max_tokens,
+    )
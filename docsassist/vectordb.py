@@ -0,0 +1,690 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import annotations
+
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import operator
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.embeddings.sentence_transformer import (
+    SentenceTransformerEmbeddings,
+)
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from pydantic import BaseModel, Field
+
+SHARDS_MANIFEST = "shards.json"
+TOMBSTONES = "tombstones.json"
+# full-precision vectors that re-rank the candidates of a binary index
+RERANK_VECTORS = "vectors.f32"
+RERANK_SETTINGS = "rerank.json"
+
+
+class IndexType(str, Enum):
+    FLAT = "flat"
+    HNSW = "hnsw"
+    IVF_FLAT = "ivf_flat"
+    IVF_PQ = "ivf_pq"
+    # sign bits with Hamming search, re-ranked with vectors read from disk
+    BINARY = "binary"
+
+
+class IndexSettings(BaseModel):
+    """FAISS index layout of the DIY vector database (L2 distance, like langchain)."""
+
+    index_type: IndexType = IndexType.FLAT
+    hnsw_m: int = Field(default=32, description="HNSW graph neighbors per node")
+    hnsw_ef_construction: int = 40
+    hnsw_ef_search: int = 64
+    ivf_nlist: Optional[int] = Field(
+        default=None,
+        description="IVF coarse clusters; defaults to 4 * sqrt(number of chunks)",
+    )
+    ivf_nprobe: int = 8
+    pq_m: int = Field(default=48, description="PQ sub-quantizers, must divide dim")
+    pq_nbits: int = 8
+    shards: int = Field(
+        default=1, ge=1, description="Split the corpus into this many FAISS indexes"
+    )
+    binary_candidates: int = Field(
+        default=200,
+        ge=1,
+        description="Hamming neighbors of a binary index re-ranked by exact distance",
+    )
+
+    def label(self) -> str:
+        if self.shards > 1:
+            return f"{self.model_copy(update={'shards': 1}).label()}x{self.shards}"
+        nlist = self.ivf_nlist or "auto"
+        if self.index_type == IndexType.HNSW:
+            return f"hnsw(M={self.hnsw_m},efSearch={self.hnsw_ef_search})"
+        if self.index_type == IndexType.IVF_FLAT:
+            return f"ivf_flat(nlist={nlist},nprobe={self.ivf_nprobe})"
+        if self.index_type == IndexType.IVF_PQ:
+            return f"ivf_pq(nlist={nlist},nprobe={self.ivf_nprobe},m={self.pq_m})"
+        if self.index_type == IndexType.BINARY:
+            return f"binary(candidates={self.binary_candidates})"
+        return "flat"
+
+
+def _nlist(settings: IndexSettings, n: int) -> int:
+    nlist = settings.ivf_nlist or int(4 * math.sqrt(n))
+    # faiss wants ~39 training points per centroid
+    return max(1, min(nlist, n // 39))
+
+
+def build_faiss_index(
+    vectors: np.ndarray[Any, Any], settings: IndexSettings
+) -> faiss.Index:
+    """Create, train and fill a FAISS index for `vectors` (n x dim, float32)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index: faiss.Index
+    if settings.index_type == IndexType.FLAT:
+        index = faiss.IndexFlatL2(dim)
+    elif settings.index_type == IndexType.HNSW:
+        index = faiss.IndexHNSWFlat(dim, settings.hnsw_m)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+        index.hnsw.efSearch = settings.hnsw_ef_search
+    elif settings.index_type == IndexType.IVF_FLAT:
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, _nlist(settings, n))
+    elif settings.index_type == IndexType.IVF_PQ:
+        # small corpora can't train 2**nbits centroids per sub-quantizer
+        nbits = max(1, min(settings.pq_nbits, int(math.log2(max(n // 39, 2)))))
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatL2(dim), dim, _nlist(settings, n), settings.pq_m, nbits
+        )
+    elif settings.index_type == IndexType.BINARY:
+        # one bit per dimension, set where the component is positive
+        index = faiss.IndexLSH(dim, dim, False, False)
+    else:
+        raise NotImplementedError(f"Unknown index type: {settings.index_type}")
+    if not index.is_trained:
+        index.train(vectors)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = settings.ivf_nprobe
+    index.add(vectors)
+    return index
+
+
+def search_parameters(
+    index: faiss.Index, selector: faiss.IDSelector
+) -> faiss.SearchParameters:
+    """Search parameters restricting `index` to the IDs accepted by `selector`."""
+    # the selector has to go with the index type's own parameters, which
+    # otherwise fall back to their defaults instead of the index settings
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+class IncrementalFAISS(FAISS):
+    """Langchain FAISS store whose chunks can be appended and deleted in place.
+
+    Deleted chunks are tombstoned: their vectors stay in the FAISS index, whose
+    positions must not shift under `index_to_docstore_id`, and searches skip
+    them with an ID selector until `compact` rebuilds the index without them.
+
+    A binary index (`IndexType.BINARY`) keeps only sign bits in memory. Its
+    Hamming search yields candidates that are re-ranked by exact L2 distance
+    to `rerank_vectors`, which are memory-mapped from disk once saved.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        tombstones: Iterable[int] = (),
+        rerank_vectors: Optional[np.ndarray[Any, Any]] = None,
+        rerank_candidates: int = IndexSettings().binary_candidates,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.tombstones: set[int] = set(tombstones)
+        self._selector: Optional[Tuple[faiss.IDSelector, Any]] = None
+        self._rerank_parts: List[np.ndarray[Any, Any]] = (
+            [] if rerank_vectors is None else [rerank_vectors]
+        )
+        self.rerank_candidates = rerank_candidates
+
+    @property
+    def is_binary(self) -> bool:
+        return isinstance(self.index, faiss.IndexLSH)
+
+    @property
+    def rerank_vectors(self) -> np.ndarray[Any, Any]:
+        """Full-precision vectors of a binary index, by position."""
+        if len(self._rerank_parts) > 1:
+            # vectors added since loading are concatenated on first use
+            self._rerank_parts = [np.concatenate(self._rerank_parts)]
+        if not self._rerank_parts:
+            return np.empty((0, self.index.d), dtype=np.float32)
+        return self._rerank_parts[0]
+
+    def rerank_search(
+        self,
+        vector: np.ndarray[Any, Any],
+        k: int,
+        allowed: Optional[np.ndarray[Any, Any]] = None,
+    ) -> Tuple[np.ndarray[Any, Any], np.ndarray[Any, Any]]:
+        """Distances and positions of the `k` nearest chunks of a binary index.
+
+        `allowed` is a boolean mask of the positions to search, tombstones
+        excluded; by default every live position. When it allows no more than
+        `rerank_candidates` positions they are all re-ranked. Otherwise the
+        Hamming search fetches enough candidates to expect that many allowed
+        ones, since a binary index takes no ID selector.
+        """
+        n = int(self.index.ntotal)
+        pool = max(self.rerank_candidates, k)
+        if allowed is None:
+            # at most every tombstone is among the nearest
+            _, found = self.index.search(vector, min(pool + len(self.tombstones), n))
+            positions = found[0][found[0] >= 0]
+            if self.tombstones:
+                positions = positions[~np.isin(positions, list(self.tombstones))]
+            positions = positions[:pool]
+        elif int(allowed.sum()) <= pool:
+            positions = np.flatnonzero(allowed)
+        else:
+            fetch = math.ceil(pool * n / int(allowed.sum()))
+            _, found = self.index.search(vector, min(fetch, n))
+            positions = found[0][found[0] >= 0]
+            positions = positions[allowed[positions]][:pool]
+        # rows are read in file order, which suits memory-mapped vectors
+        positions = np.sort(positions)
+        distances = ((self.rerank_vectors[positions] - vector) ** 2).sum(axis=1)
+        best = np.argsort(distances, kind="stable")[:k]
+        return distances[best].astype(np.float32), positions[best]
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[Tuple[str, List[float]]],
+        metadatas: Optional[List[Dict[Any, Any]]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        text_embeddings = list(text_embeddings)
+        if self.is_binary and text_embeddings:
+            vectors = np.array([v for _, v in text_embeddings], dtype=np.float32)
+            if self._normalize_L2:
+                faiss.normalize_L2(vectors)
+            self._rerank_parts.append(vectors)
+        return super().add_embeddings(text_embeddings, metadatas, ids, **kwargs)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[Dict[Any, Any]]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(
+            zip(texts, self._embed_documents(texts)), metadatas, ids, **kwargs
+        )
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return len(self.tombstones) / max(int(self.index.ntotal), 1)
+
+    def live_ids(self) -> Dict[str, int]:
+        """Docstore id of every chunk that isn't tombstoned, with its position."""
+        return {
+            docstore_id: i
+            for i, docstore_id in self.index_to_docstore_id.items()
+            if i not in self.tombstones
+        }
+
+    def tombstone(self, ids: Iterable[str]) -> int:
+        """Delete chunks by docstore id from search results; returns their number."""
+        live = self.live_ids()
+        ids = [docstore_id for docstore_id in ids if docstore_id in live]
+        if ids:
+            self.docstore.delete(ids)
+            self.tombstones.update(live[docstore_id] for docstore_id in ids)
+            self._selector = None
+        return len(ids)
+
+    def _live_selector(self) -> faiss.IDSelector:
+        if self._selector is None:
+            positions = np.fromiter(sorted(self.tombstones), dtype=np.int64)
+            batch = faiss.IDSelectorBatch(len(positions), faiss.swig_ptr(positions))
+            # the selectors only point to `positions` and `batch`, keep them alive
+            self._selector = (faiss.IDSelectorNot(batch), (positions, batch))
+        return self._selector[0]
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Union[Callable[..., bool], Dict[str, Any]]] = None,
+        fetch_k: int = 20,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        if not self.tombstones and not self.is_binary:
+            return super().similarity_search_with_score_by_vector(
+                embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs
+            )
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+        if self.is_binary:
+            scores, indices = self.rerank_search(
+                vector, k if filter is None else fetch_k
+            )
+        else:
+            found_scores, found = self.index.search(
+                vector,
+                k if filter is None else fetch_k,
+                params=search_parameters(self.index, self._live_selector()),
+            )
+            scores, indices = found_scores[0], found[0]
+        filter_func = None if filter is None else self._create_filter_func(filter)
+        docs = []
+        for i, score in zip(indices, scores):
+            if i == -1:
+                continue
+            doc = self.docstore.search(self.index_to_docstore_id[i])
+            if not isinstance(doc, Document):
+                raise ValueError(f"Chunk {i} of the index is missing from the docstore")
+            if filter_func is None or filter_func(doc.metadata):
+                docs.append((doc, float(score)))
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            cmp = (
+                operator.ge
+                if self.distance_strategy
+                in (DistanceStrategy.MAX_INNER_PRODUCT, DistanceStrategy.JACCARD)
+                else operator.le
+            )
+            docs = [(doc, score) for doc, score in docs if cmp(score, score_threshold)]
+        return docs[:k]
+
+    def compact(self) -> None:
+        """Rebuild the FAISS index without the tombstoned vectors.
+
+        The live vectors are reconstructed and added back to the emptied index,
+        which keeps its trained IVF and PQ quantizers, and are renumbered. PQ
+        codes are re-encoded from their decoded vectors, so may change slightly.
+        """
+        if not self.tombstones:
+            return
+        keep = np.array(
+            [i for i in range(self.index.ntotal) if i not in self.tombstones],
+            dtype=np.int64,
+        )
+        vectors: Optional[np.ndarray[Any, Any]]
+        if self.is_binary:
+            # sign bits can't be decoded, the full-precision vectors are kept
+            vectors = np.ascontiguousarray(self.rerank_vectors[keep])
+            self._rerank_parts = [vectors]
+        else:
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is not None:
+                # IVF indexes reconstruct by position only through a direct map
+                ivf.make_direct_map()
+            vectors = self.index.reconstruct_batch(keep) if len(keep) else None
+            if ivf is not None:
+                ivf.make_direct_map(False)
+        self.index.reset()
+        if vectors is not None and len(vectors):
+            self.index.add(vectors)
+        self.index_to_docstore_id = {
+            new: self.index_to_docstore_id[int(old)] for new, old in enumerate(keep)
+        }
+        self.tombstones.clear()
+        self._selector = None
+
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        super().save_local(folder_path, index_name)
+        path = os.path.join(folder_path, TOMBSTONES)
+        if self.tombstones:
+            with open(path, "w") as f:
+                json.dump({"positions": sorted(self.tombstones)}, f)
+        elif os.path.exists(path):
+            os.remove(path)
+        if self.is_binary:
+            # written aside and renamed, the old file may still be memory-mapped
+            vectors_path = os.path.join(folder_path, RERANK_VECTORS)
+            np.ascontiguousarray(self.rerank_vectors, dtype=np.float32).tofile(
+                vectors_path + ".tmp"
+            )
+            os.replace(vectors_path + ".tmp", vectors_path)
+            with open(os.path.join(folder_path, RERANK_SETTINGS), "w") as f:
+                json.dump({"candidates": self.rerank_candidates}, f)
+
+    @classmethod
+    def load_local(
+        cls,
+        folder_path: str,
+        embeddings: Embeddings,
+        index_name: str = "index",
+        *,
+        allow_dangerous_deserialization: bool = False,
+        **kwargs: Any,
+    ) -> IncrementalFAISS:
+        store = super().load_local(
+            folder_path,
+            embeddings,
+            index_name,
+            allow_dangerous_deserialization=allow_dangerous_deserialization,
+            **kwargs,
+        )
+        assert isinstance(store, IncrementalFAISS)
+        path = os.path.join(folder_path, TOMBSTONES)
+        if os.path.exists(path):
+            with open(path) as f:
+                store.tombstones = set(json.load(f)["positions"])
+        if store.is_binary:
+            with open(os.path.join(folder_path, RERANK_SETTINGS)) as f:
+                store.rerank_candidates = json.load(f)["candidates"]
+            vectors_path = os.path.join(folder_path, RERANK_VECTORS)
+            store._rerank_parts = (
+                [
+                    np.memmap(
+                        vectors_path,
+                        dtype=np.float32,
+                        mode="r",
+                        shape=(store.index.ntotal, store.index.d),
+                    )
+                ]
+                if store.index.ntotal
+                else []
+            )
+        return store
+
+
+def tombstones_of(store: FAISS) -> AbstractSet[int]:
+    """Positions of the deleted chunks that are still in the FAISS index."""
+    return store.tombstones if isinstance(store, IncrementalFAISS) else frozenset()
+
+
+class ShardedFAISS(VectorStore):
+    """Read-only scatter-gather search over several FAISS indexes.
+
+    Every query runs on all shards in parallel threads (FAISS releases the GIL
+    while searching) and the per-shard top-k lists are merged with a heap.
+    """
+
+    def __init__(self, shards: Sequence[FAISS], embedding: Embeddings) -> None:
+        if not shards:
+            raise ValueError("ShardedFAISS needs at least one shard")
+        self.shards = list(shards)
+        self.embedding_function = embedding
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def _embed_query(self, text: str) -> List[float]:
+        return self.shards[0]._embed_query(text)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # created on first search rather than on load, so that workers forked
+        # after preloading don't inherit a pool whose threads are gone
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=len(self.shards), thread_name_prefix="faiss-shard"
+                )
+            return self._executor
+
+    def scatter_gather(
+        self,
+        search: Callable[[FAISS], List[Tuple[Document, float]]],
+        k: int,
+    ) -> List[Tuple[Document, float]]:
+        """Run `search` on every shard and merge the hits sorted by score."""
+        if len(self.shards) == 1:
+            return search(self.shards[0])[:k]
+        results = list(self._pool().map(search, self.shards))
+        # each shard returns its hits best first; distances are comparable
+        # across shards because they share the embedding model and metric
+        reverse = self.shards[0].distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT
+        merged = heapq.merge(*results, key=lambda hit: hit[1], reverse=reverse)
+        return list(itertools.islice(merged, k))
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.scatter_gather(
+            lambda shard: shard.similarity_search_with_score_by_vector(
+                embedding, k=k, **kwargs
+            ),
+            k,
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k=k, **kwargs
+            )
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(
+            self._embed_query(query), k=k, **kwargs
+        )
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def save_local(self, folder_path: str) -> None:
+        names = [f"shard-{i:03d}" for i in range(len(self.shards))]
+        os.makedirs(folder_path, exist_ok=True)
+        for name, shard in zip(names, self.shards):
+            shard.save_local(os.path.join(folder_path, name))
+        with open(os.path.join(folder_path, SHARDS_MANIFEST), "w") as f:
+            json.dump({"shards": names}, f)
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings: Embeddings) -> ShardedFAISS:
+        with open(os.path.join(folder_path, SHARDS_MANIFEST)) as f:
+            names = json.load(f)["shards"]
+        return cls(
+            [
+                _load_faiss(os.path.join(folder_path, name), embeddings)
+                for name in names
+            ],
+            embeddings,
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[Dict[Any, Any]]] = None,
+        ids: Optional[List[str]] = None,
+        settings: Optional[IndexSettings] = None,
+        **kwargs: Any,
+    ) -> ShardedFAISS:
+        """Embed `texts` and deal them into `settings.shards` FAISS stores."""
+        vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+        db = vectorstore_from_embeddings(
+            texts, vectors, embedding, metadatas, settings, ids
+        )
+        return db if isinstance(db, ShardedFAISS) else cls([db], embedding)
+
+
+VectorDB = Union[FAISS, ShardedFAISS]
+
+
+def shards_of(db: VectorDB) -> List[FAISS]:
+    """The FAISS stores making up `db`."""
+    return db.shards if isinstance(db, ShardedFAISS) else [db]
+
+
+def vectorstore_from_embeddings(
+    texts: Sequence[str],
+    vectors: np.ndarray[Any, Any],
+    embedding: Embeddings,
+    metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+    settings: Optional[IndexSettings] = None,
+    ids: Optional[Sequence[str]] = None,
+) -> VectorDB:
+    """Langchain FAISS store over precomputed embeddings, like `FAISS.from_texts`.
+
+    With `settings.shards > 1`, chunks are dealt round-robin into that many
+    FAISS stores, so every shard gets a similar mix of the corpus.
+    """
+    settings = settings or IndexSettings()
+    ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+    metadatas = metadatas or [{} for _ in texts]
+    if settings.shards > 1:
+        n = settings.shards
+        shard_settings = settings.model_copy(update={"shards": 1})
+        return ShardedFAISS(
+            [
+                _faiss_from_embeddings(
+                    texts[i::n],
+                    vectors[i::n],
+                    embedding,
+                    metadatas[i::n],
+                    ids[i::n],
+                    shard_settings,
+                )
+                for i in range(n)
+            ],
+            embedding,
+        )
+    return _faiss_from_embeddings(texts, vectors, embedding, metadatas, ids, settings)
+
+
+def _faiss_from_embeddings(
+    texts: Sequence[str],
+    vectors: np.ndarray[Any, Any],
+    embedding: Embeddings,
+    metadatas: Sequence[Dict[str, Any]],
+    ids: Sequence[str],
+    settings: IndexSettings,
+) -> IncrementalFAISS:
+    index = build_faiss_index(vectors, settings)
+    binary = settings.index_type == IndexType.BINARY
+    docstore = InMemoryDocstore(
+        {
+            id_: Document(page_content=text, metadata=dict(metadata))
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        }
+    )
+    return IncrementalFAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+        rerank_vectors=np.asarray(vectors, dtype=np.float32) if binary else None,
+        rerank_candidates=settings.binary_candidates,
+    )
+
+
+def chunk_id(doc: Document) -> str:
+    """Stable docstore id of a chunk, derived from its text and metadata."""
+    key = json.dumps([doc.page_content, doc.metadata], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def unique_chunks(documents: Iterable[Document]) -> Dict[str, Document]:
+    """Chunks by stable id; exact duplicates, which would share an id, are dropped."""
+    chunks: Dict[str, Document] = {}
+    for doc in documents:
+        chunks.setdefault(chunk_id(doc), doc)
+    return chunks
+
+
+def embed_documents(
+    documents: List[Document],
+    embedding: Embeddings,
+    settings: Optional[IndexSettings] = None,
+) -> VectorDB:
+    """Embed documents and index them with the configured index type."""
+    chunks = unique_chunks(documents)
+    texts = [doc.page_content for doc in chunks.values()]
+    vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+    return vectorstore_from_embeddings(
+        texts,
+        vectors,
+        embedding,
+        metadatas=[doc.metadata for doc in chunks.values()],
+        settings=settings,
+        ids=list(chunks),
+    )
+
+
+def load_embeddings(
+    input_dir: str, model_name: str, batch_size: Optional[int] = None
+) -> Embeddings:
+    """The sentence transformer cached in a DIY RAG model directory."""
+    return SentenceTransformerEmbeddings(
+        model_name=model_name,
+        cache_folder=os.path.join(input_dir, "sentencetransformers"),
+        encode_kwargs={} if batch_size is None else {"batch_size": batch_size},
+    )
+
+
+def _load_faiss(folder: str, embedding: Embeddings) -> IncrementalFAISS:
+    return IncrementalFAISS.load_local(
+        folder_path=folder,
+        embeddings=embedding,
+        allow_dangerous_deserialization=True,
+    )
+
+
+def load_faiss(folder: str, embedding: Embeddings) -> VectorDB:
+    """A vector store saved with `FAISS.save_local` or `ShardedFAISS.save_local`."""
+    if os.path.exists(os.path.join(folder, SHARDS_MANIFEST)):
+        return ShardedFAISS.load_local(folder, embedding)
+    return _load_faiss(folder, embedding)
+
+
+def load_vectorstore(input_dir: str, embedding: Embeddings) -> VectorDB:
+    """The vector database of a DIY RAG model directory."""
+    return load_faiss(os.path.join(input_dir, "faiss_db"), embedding)
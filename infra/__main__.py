@@ -34,7 +34,6 @@ from infra import (
     settings_main,
 )
 from infra.common.feature_flags import check_feature_flags
-from infra.common.papermill import run_notebook
 from infra.common.urls import get_deployment_url
 from infra.components.custom_model_deployment import CustomModelDeployment
 from infra.components.dr_llm_credential import (
@@ -126,18 +125,20 @@ if settings_main.core.rag_type == RAGType.DR:
         custom_model_args=settings_generative.custom_model_args,
     )
 elif settings_main.core.rag_type == RAGType.DIY:
-    if not all(
-        [
-            path.exists()
-            for path in settings_generative.diy_rag_nb_output.model_dump().values()
-        ]
-    ):
-        pulumi.info("Executing doc chunking + vdb building notebook...")
-        run_notebook(settings_generative.diy_rag_nb)
-    else:
-        pulumi.info(
-            f"Using existing outputs from build_rag.ipynb in '{settings_generative.diy_rag_deployment_path}'"
-        )
+    from docsassist.ingest import build_vector_database
+
+    # always run: unchanged documents are skipped by the build's file manifest,
+    # chunk store and embedding store, so an edited corpus is never left stale
+    pulumi.info("Chunking documents and updating the vector database...")
+    report = build_vector_database(
+        pathlib.Path(settings_main.core.rag_documents),
+        settings_generative.diy_rag_deployment_path,
+        settings_generative.diy_rag_ingest_settings,
+        embedding_store=settings_generative.diy_rag_embedding_store,
+        chunk_store=settings_generative.diy_rag_chunk_store,
+        embedding_workers=settings_generative.diy_rag_embedding_workers,
+    )
+    pulumi.info(report.format())
 
     rag_custom_model = datarobot.CustomModel(  # type: ignore[assignment]
         files=settings_generative.get_diy_rag_files(
@@ -1,33 +0,0 @@
-# Copyright 2024 DataRobot, Inc.
-#
-# Licensed under the Apache License, Version 2.0 (the "License");
-# you may not use this file except in compliance with the License.
-# You may obtain a copy of the License at
-#
-#   http://www.apache.org/licenses/LICENSE-2.0
-#
-# Unless required by applicable law or agreed to in writing, software
-# distributed under the License is distributed on an "AS IS" BASIS,
-# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
-# See the License for the specific language governing permissions and
-# limitations under the License.
-
-import pathlib
-import sys
-from typing import Optional
-
-import papermill as pm
-
-
-def run_notebook(
-    nb_path: pathlib.Path, output_path: Optional[pathlib.Path] = None
-) -> None:
-    pm.execute_notebook(
-        nb_path,
-        output_path,
-        cwd=nb_path.parent,
-        log_output=False,
-        progress_bar=False,
-        stderr_file=sys.stderr,
-        stdout_file=sys.stdout,
-    )
@@ -14,17 +14,16 @@
 
 from __future__ import annotations
 
-import pathlib
+import os
 import textwrap
 
 import datarobot as dr
 import pulumi
 import pulumi_datarobot as datarobot
 from jinja2 import BaseLoader, Environment
-from pydantic import BaseModel
 
 from docsassist.i18n import gettext
-from docsassist.schema import TARGET_COLUMN_NAME, RAGModelSettings, RAGType
+from docsassist.schema import TARGET_COLUMN_NAME, RAGType
 from infra.common.globals import GlobalLLM
 
 from .common.schema import (
@@ -122,20 +121,71 @@ if core.rag_type == RAGType.DR:
     )
 
 elif core.rag_type == RAGType.DIY:
-
-    class DIYRAGNotebookOutput(BaseModel):
-        """Schema for DIY RAG notebook output paths."""
-
-        vdb: pathlib.Path
-        embedding_model: pathlib.Path
-        rag_settings: pathlib.Path
+    from docsassist.artifact import build_artifact, inference_files
+    from docsassist.ingest import ChunkLength, IngestSettings
+    from docsassist.vectordb import IndexSettings, IndexType
 
     diy_rag_deployment_path = PROJECT_ROOT / "deployment_diy_rag"
-    diy_rag_nb = PROJECT_ROOT / "notebooks" / "build_rag.ipynb"
-    diy_rag_nb_output = DIYRAGNotebookOutput(
-        vdb=diy_rag_deployment_path / "faiss_db",
-        embedding_model=diy_rag_deployment_path / "sentencetransformers",
-        rag_settings=diy_rag_deployment_path / RAGModelSettings.filename(),
+    # chunking, embedding and index of docsassist/ingest.py
+    diy_rag_ingest_settings = IngestSettings(
+        sentence_transformer_model_name="all-MiniLM-L6-v2",
+        chunk_size=2000,
+        chunk_overlap=1000,
+        # ChunkLength.TOKENS counts chunk_size and chunk_overlap in tokens of
+        # the embedding model, capped at the tokens it embeds
+        chunk_length=ChunkLength.CHARACTERS,
+        # exact search; see docsassist.vectordb.IndexType for approximate indexes,
+        # and raise `shards` to split a large corpus into several FAISS indexes
+        index=IndexSettings(index_type=IndexType.FLAT, shards=1),
+    )
+    # chunks and embeddings reused across builds, see docsassist/chunk_store.py
+    # and docsassist/embedding_store.py
+    diy_rag_chunk_store = PROJECT_ROOT / ".cache" / "chunks.parquet"
+    diy_rag_embedding_store = PROJECT_ROOT / ".cache" / "embeddings"
+    # processes running the embedding model during the build, each with
+    # cores / processes torch threads, see docsassist/embedding_pool.py
+    diy_rag_embedding_workers = max(1, (os.cpu_count() or 1) // 8)
+    # the files uploaded to the custom model are copied into a directory named
+    # after their content hash, see docsassist/artifact.py; an unchanged model
+    # uploads the same files and doesn't create a new custom model version
+    diy_rag_artifact_cache = PROJECT_ROOT / ".cache" / "diy_rag_artifact"
+    # store the sentence transformer weights in float16, half their size
+    diy_rag_fp16_embedding_weights = False
+
+    # optional knobs of the DIY RAG model, see docsassist/profiling.py,
+    # docsassist/memory_report.py, docsassist/prefork.py,
+    # docsassist/index_registry.py and docsassist/index_versions.py
+    diy_rag_runtime_parameter_specs = textwrap.dedent(
+        """\
+        - fieldName: RAG_PROFILING_MODE
+          type: string
+          defaultValue: "off"
+          description: Per-request profiler, one of off, cprofile or sampling
+        - fieldName: RAG_PROFILING_SAMPLE_RATE
+          type: numeric
+          defaultValue: 0
+          description: Fraction of requests to profile
+        - fieldName: RAG_PROFILING_LATENCY_THRESHOLD
+          type: numeric
+          description: Keep profiles of requests slower than this many seconds
+        - fieldName: RAG_MEMORY_REPORT
+          type: boolean
+          defaultValue: false
+          description: Log a memory breakdown of the model at startup
+        - fieldName: RAG_PREFORK_PRELOAD
+          type: boolean
+          defaultValue: false
+          description: Load the index before workers fork so they share it
+        - fieldName: RAG_INDEX_MEMORY_BUDGET_MB
+          type: numeric
+          description: Evict least recently used named indexes above this size
+        - fieldName: RAG_INDEX_WATCH_DIR
+          type: string
+          description: Directory of published index versions to hot reload from
+        - fieldName: RAG_INDEX_RELOAD_INTERVAL
+          type: numeric
+          defaultValue: 30
+          description: Seconds between checks for a new index version"""
     )
 
     def get_diy_rag_files(
@@ -159,19 +209,42 @@ elif core.rag_type == RAGType.DIY:
             runtime_parameters = template.render(
                 custom_model_name=custom_model_args.name,
                 target_type=custom_model_args.target_type,
-                runtime_parameters=llm_runtime_parameter_specs,
+                runtime_parameters="\n".join(
+                    [llm_runtime_parameter_specs, diy_rag_runtime_parameter_specs]
+                ),
             )
             f.write(runtime_parameters)
 
         docsassist_path = PROJECT_ROOT / "docsassist"
 
-        diy_files = [
-            (str(f), str(f.relative_to(diy_rag_deployment_path)))
-            for f in diy_rag_deployment_path.glob("**/*")
-            if f.is_file() and f.name not in ("README.md", "model-metadata.yaml.jinja")
-        ] + [
+        diy_files = inference_files(diy_rag_deployment_path) + [
             (str(docsassist_path / "__init__.py"), "docsassist/__init__.py"),
             (str(docsassist_path / "schema.py"), "docsassist/schema.py"),
             (str(docsassist_path / "credentials.py"), "docsassist/credentials.py"),
+            (str(docsassist_path / "resilience.py"), "docsassist/resilience.py"),
+            (str(docsassist_path / "extractive.py"), "docsassist/extractive.py"),
+            (str(docsassist_path / "profiling.py"), "docsassist/profiling.py"),
+            (str(docsassist_path / "vectordb.py"), "docsassist/vectordb.py"),
+            (str(docsassist_path / "memory_report.py"), "docsassist/memory_report.py"),
+            (str(docsassist_path / "prefork.py"), "docsassist/prefork.py"),
+            (
+                str(docsassist_path / "index_registry.py"),
+                "docsassist/index_registry.py",
+            ),
+            (
+                str(docsassist_path / "metadata_filter.py"),
+                "docsassist/metadata_filter.py",
+            ),
+            (
+                str(docsassist_path / "index_versions.py"),
+                "docsassist/index_versions.py",
+            ),
+            (str(docsassist_path / "neighbors.py"), "docsassist/neighbors.py"),
         ]
-        return diy_files
+        files, content_hash = build_artifact(
+            diy_files,
+            diy_rag_artifact_cache,
+            fp16=diy_rag_fp16_embedding_weights,
+        )
+        pulumi.info(f"DIY RAG artifact {content_hash[:16]}")
+        return files
@@ -0,0 +1,160 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+"""Shared and private memory of forked DIY RAG workers, with and without preload.
+
+Each worker runs `load_model` and scores a batch, like a server worker, then
+reports its /proc/self/smaps_rollup. Linux only.
+
+    python -m tests.benchmarks.bench_prefork --chunks 20000 --workers 4
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from docsassist import prefork
+from docsassist.schema import PROMPT_COLUMN_NAME
+
+from .fake_llm import FakeChatModel
+from .synthetic import (
+    fake_embeddings,
+    import_custom_model,
+    synthetic_documents,
+    synthetic_questions,
+    write_model_dir,
+    write_results,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(custom, model_dir, embedding_function, questions, output):
+    model = custom.load_model(
+        model_dir, llm=FakeChatModel(), embedding_function=embedding_function
+    )
+    custom.score(pd.DataFrame({PROMPT_COLUMN_NAME: questions}), model)
+    gc.collect()
+    rollup = prefork.smaps_rollup()
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "rss_bytes": rollup["Rss"],
+                "pss_bytes": rollup["Pss"],
+                "shared_bytes": prefork.shared_bytes(rollup),
+                "private_bytes": prefork.private_bytes(rollup),
+            },
+            f,
+        )
+
+
+def fork_workers(n_workers, custom, model_dir, embedding_function, tmp):
+    """Fork workers that report their memory while all of them are alive."""
+    questions = synthetic_questions(16)
+    pids = []
+    for i in range(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(
+                    custom,
+                    model_dir,
+                    embedding_function,
+                    questions,
+                    Path(tmp) / f"worker-{i}.json",
+                )
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return [
+        json.loads((Path(tmp) / f"worker-{i}.json").read_text())
+        for i in range(n_workers)
+    ]
+
+
+def measure(model_dir, preload, n_workers, embedding_function):
+    custom = import_custom_model()
+    if preload:
+        model_settings = custom.read_model_settings(model_dir)
+        prefork.preload(
+            model_dir,
+            model_settings.embedding_model_name,
+            embedding_function=embedding_function,
+        )
+    with tempfile.TemporaryDirectory() as tmp:
+        return fork_workers(n_workers, custom, model_dir, embedding_function, tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-dir", type=Path, default=None)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--preload", choices=["yes", "no", "both"], default="both")
+    parser.add_argument(
+        "--output", type=Path, default=Path("tests/output/bench_prefork.json")
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model_dir:
+            model_dir, embedding_function = args.model_dir, None
+        else:
+            embedding_function = fake_embeddings()
+            model_dir = write_model_dir(
+                Path(tmp), synthetic_documents(args.chunks), embedding_function
+            )
+        modes = {"yes": [True], "no": [False], "both": [False, True]}[args.preload]
+        results = {}
+        for preload in modes:
+            # run each mode in its own child so both start from the same heap
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    workers = measure(
+                        str(model_dir), preload, args.workers, embedding_function
+                    )
+                    Path(tmp, f"mode-{preload}.json").write_text(json.dumps(workers))
+                finally:
+                    os._exit(0)
+            os.waitpid(pid, 0)
+            workers = json.loads(Path(tmp, f"mode-{preload}.json").read_text())
+            results["preload" if preload else "no_preload"] = workers
+            for worker in workers:
+                logger.info(
+                    f"preload={preload!s:<5} "
+                    + " ".join(f"{k}={v / 2**20:.1f}MiB" for k, v in worker.items())
+                )
+
+    write_results(
+        args.output,
+        "prefork",
+        {"chunks": None if args.model_dir else args.chunks, "workers": results},
+    )
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
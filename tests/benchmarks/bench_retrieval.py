@@ -0,0 +1,210 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+"""Retrieval micro-benchmark across corpus sizes and FAISS index types.
+
+Indexes are built with `docsassist.vectordb`, the same code `make_vector_db`
+uses, over synthetic chunk embeddings, and persisted/loaded through langchain.
+
+    python -m tests.benchmarks.bench_retrieval --sizes 1000 100000 1000000
+"""
+
+import argparse
+import gc
+import itertools
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from docsassist.memory_report import current_rss_bytes
+from docsassist.vectordb import (
+    IndexSettings,
+    IndexType,
+    load_faiss,
+    shards_of,
+    vectorstore_from_embeddings,
+)
+
+from .synthetic import (
+    EMBEDDING_DIM,
+    fake_embeddings,
+    synthetic_vectors,
+    write_results,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def make_queries(vectors, n, seed=1):
+    """Queries close to, but not identical with, random corpus chunks."""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), n)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape, dtype=np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_neighbors(vectors, queries, k):
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, k)[1]
+
+
+def recall_at_k(found, expected):
+    k = expected.shape[1]
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / (len(expected) * k)
+
+
+def percentiles(seconds):
+    return {
+        "p50_ms": float(np.percentile(seconds, 50) * 1000),
+        "p99_ms": float(np.percentile(seconds, 99) * 1000),
+    }
+
+
+def directory_bytes(path):
+    return sum(f.stat().st_size for f in Path(path).glob("**/*") if f.is_file())
+
+
+def bench_index(settings, vectors, queries, expected, k, batch_size, tmp):
+    embedding = fake_embeddings(vectors.shape[1])
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+
+    start = time.perf_counter()
+    db = vectorstore_from_embeddings(texts, vectors, embedding, settings=settings)
+    build_seconds = time.perf_counter() - start
+    index_bytes = sum(
+        faiss.serialize_index(shard.index).nbytes for shard in shards_of(db)
+    )
+    folder = Path(tmp) / settings.index_type.value
+    db.save_local(str(folder))
+    del db
+    gc.collect()
+
+    rss_before = current_rss_bytes()
+    start = time.perf_counter()
+    db = load_faiss(str(folder), embedding)
+    load_seconds = time.perf_counter() - start
+    rss_loaded = current_rss_bytes() - rss_before
+
+    single = []
+    for query in queries:
+        start = time.perf_counter()
+        db.similarity_search_with_score_by_vector(query, k=k)
+        single.append(time.perf_counter() - start)
+
+    batches, found = [], []
+    for i in range(0, len(queries), batch_size):
+        start = time.perf_counter()
+        if settings.shards == 1:
+            _, ids = db.index.search(queries[i : i + batch_size], k)
+        else:
+            ids = [
+                [int(doc.page_content.split()[1]) for doc, _ in hits]
+                for hits in (
+                    db.similarity_search_with_score_by_vector(query, k=k)
+                    for query in queries[i : i + batch_size]
+                )
+            ]
+        batches.append(time.perf_counter() - start)
+        found.extend(ids)
+
+    return {
+        "index": settings.label(),
+        "build_seconds": build_seconds,
+        "index_bytes": index_bytes,
+        "disk_bytes": directory_bytes(folder),
+        "load_seconds": load_seconds,
+        "rss_delta_on_load_bytes": rss_loaded,
+        "single_query": percentiles(single),
+        "batch_query": {
+            "batch_size": batch_size,
+            **percentiles(batches),
+            "per_query_ms": float(sum(batches) / len(queries) * 1000),
+        },
+        f"recall@{k}": recall_at_k(found, expected),
+    }
+
+
+def run(args):
+    results = []
+    for size in args.sizes:
+        logger.info(f"Generating {size} chunks of dim {args.dim}")
+        vectors = synthetic_vectors(size, args.dim)
+        queries = make_queries(vectors, args.queries)
+        expected = exact_neighbors(vectors, queries, args.k)
+        for index_type, shards in itertools.product(args.index_types, args.shards):
+            with tempfile.TemporaryDirectory() as tmp:
+                result = bench_index(
+                    IndexSettings(index_type=index_type, shards=shards),
+                    vectors,
+                    queries,
+                    expected,
+                    args.k,
+                    args.batch_size,
+                    tmp,
+                )
+            result["chunks"] = size
+            results.append(result)
+            logger.info(
+                f"{size:>8} {result['index']:<40} "
+                f"build={result['build_seconds']:.2f}s "
+                f"p50={result['single_query']['p50_ms']:.2f}ms "
+                f"p99={result['single_query']['p99_ms']:.2f}ms "
+                f"recall@{args.k}={result[f'recall@{args.k}']:.3f}"
+            )
+        del vectors
+        gc.collect()
+    return {"dim": args.dim, "k": args.k, "queries": args.queries, "runs": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument(
+        "--index-types",
+        type=IndexType,
+        nargs="+",
+        default=list(IndexType),
+        help=", ".join(t.value for t in IndexType),
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="shard counts; sharded indexes are searched scatter-gather",
+    )
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument(
+        "--output", type=Path, default=Path("tests/output/bench_retrieval.json")
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    write_results(args.output, "retrieval", run(args))
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
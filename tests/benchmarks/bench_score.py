@@ -0,0 +1,187 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+"""Throughput of the DIY RAG `load_model`/`score` path with an in-process LLM.
+
+Runs offline and without credentials. By default a synthetic model directory
+with fake embeddings is built; pass `--model-dir deployment_diy_rag` to measure
+the model built by `docsassist.ingest` with its real sentence transformer.
+
+    python -m tests.benchmarks.bench_score --batch-sizes 1 8 32
+"""
+
+import argparse
+import json
+import logging
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from langchain_community.vectorstores.faiss import FAISS
+
+from docsassist.schema import PROMPT_COLUMN_NAME
+
+from .fake_llm import FakeChatModel
+from .synthetic import (
+    fake_embeddings,
+    import_custom_model,
+    peak_rss_bytes,
+    synthetic_documents,
+    synthetic_questions,
+    write_model_dir,
+    write_results,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Accumulates wall time of patched callables by stage name."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    def wrap(self, stage, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+
+        return timed
+
+    @contextmanager
+    def instrument(self, embedding_function):
+        embedding_cls = type(embedding_function)
+        with ExitStack() as stack:
+            for owner, attribute, stage in [
+                (FakeChatModel, "_generate", "llm"),
+                (embedding_cls, "embed_query", "embed_query"),
+                (embedding_cls, "embed_documents", "embed_documents"),
+                (FAISS, "similarity_search_with_score_by_vector", "faiss_search"),
+                (pd.DataFrame, "from_records", "build_dataframe"),
+            ]:
+                original = getattr(owner, attribute)
+                stack.enter_context(
+                    mock.patch.object(owner, attribute, self.wrap(stage, original))
+                )
+            yield self
+
+
+def make_batch(batch_size, history_length, questions):
+    messages = []
+    for i in range(history_length):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": questions[i % len(questions)]})
+    return pd.DataFrame(
+        {
+            PROMPT_COLUMN_NAME: [
+                questions[i % len(questions)] for i in range(batch_size)
+            ],
+            "association_id": [f"bench-{i}" for i in range(batch_size)],
+            "messages": [json.dumps(messages)] * batch_size,
+        }
+    )
+
+
+def run(args):
+    custom = import_custom_model()
+    llm = FakeChatModel(latency=args.llm_latency, output_tokens=args.llm_tokens)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model_dir:
+            model_dir, embedding_function = str(args.model_dir), None
+        else:
+            embedding_function = fake_embeddings()
+            model_dir = str(
+                write_model_dir(
+                    Path(tmp), synthetic_documents(args.chunks), embedding_function
+                )
+            )
+
+        start = time.perf_counter()
+        model = custom.load_model(
+            model_dir, llm=llm, embedding_function=embedding_function
+        )
+        load_seconds = time.perf_counter() - start
+        embedding_function = model[0].embeddings
+
+        questions = synthetic_questions(64)
+        runs = []
+        for history_length in args.history_lengths:
+            for batch_size in args.batch_sizes:
+                data = make_batch(batch_size, history_length, questions)
+                custom.score(data, model)  # warm up
+                timer = StageTimer()
+                with timer.instrument(embedding_function):
+                    start = time.perf_counter()
+                    for _ in range(args.repeats):
+                        custom.score(data, model)
+                    total = time.perf_counter() - start
+                stages = {k: v / args.repeats for k, v in timer.seconds.items()}
+                stages["other"] = total / args.repeats - sum(stages.values())
+                runs.append(
+                    {
+                        "batch_size": batch_size,
+                        "history_length": history_length,
+                        "rows_per_second": batch_size * args.repeats / total,
+                        "seconds_per_batch": total / args.repeats,
+                        "stage_seconds_per_batch": stages,
+                        "peak_rss_bytes": peak_rss_bytes(),
+                    }
+                )
+                logger.info(
+                    f"batch={batch_size:>4} history={history_length:>3} "
+                    f"rows/s={runs[-1]['rows_per_second']:9.1f} "
+                    + " ".join(f"{k}={v * 1000:.1f}ms" for k, v in stages.items())
+                )
+
+    return {
+        "model_dir": str(args.model_dir) if args.model_dir else "synthetic",
+        "chunks": None if args.model_dir else args.chunks,
+        "llm_latency": args.llm_latency,
+        "llm_tokens": args.llm_tokens,
+        "load_model_seconds": load_seconds,
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model-dir", type=Path, default=None)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--history-lengths", type=int, nargs="+", default=[0, 4, 16])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--llm-tokens", type=int, default=64)
+    parser.add_argument(
+        "--output", type=Path, default=Path("tests/output/bench_score.json")
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    write_results(args.output, "score", run(args))
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import hashlib
+import time
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_VOCABULARY = (
+    "datarobot model deployment prediction feature dataset project blueprint "
+    "accuracy leaderboard monitoring drift custom environment registry "
+    "application notebook vector database retrieval prompt guard"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline stand-in for the Azure OpenAI chat model.
+
+    The completion is derived from a hash of the prompt, so identical inputs
+    give identical outputs. `latency` simulates the LLM round trip and
+    `output_tokens` controls the length of the completion.
+    """
+
+    latency: float = 0.0
+    output_tokens: int = 32
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = "\n".join(str(m.content) for m in messages)
+        digest = hashlib.sha256(prompt.encode()).digest()
+        words = [
+            _VOCABULARY[digest[i % len(digest)] % len(_VOCABULARY)]
+            for i in range(self.output_tokens)
+        ]
+        token_usage = {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": self.output_tokens,
+            "total_tokens": len(prompt.split()) + self.output_tokens,
+        }
+        message = AIMessage(content=" ".join(words))
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": token_usage},
+        )
@@ -0,0 +1,289 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+"""Sweep FAISS index parameters and report the recall/latency frontier.
+
+Every configuration is built over the same chunk embeddings and measured with
+the same queries: recall@k against the flat index, p50/p99 single-query
+latency and index memory. Search-time parameters (IVF nprobe, HNSW efSearch)
+are swept on one built index. The configuration with the least index memory
+that reaches the target recall, the fastest of them on ties, is recommended as
+`IndexSettings` for `diy_rag_ingest_settings`.
+
+    # synthetic embeddings
+    python -m tests.benchmarks.sweep_index --chunks 100000
+    # the chunk store of a build and logged questions, one per line
+    python -m tests.benchmarks.sweep_index --chunk-store .cache/chunks.parquet \\
+        --embedding-store .cache/embeddings --questions questions.txt --plot sweep.png
+"""
+
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from docsassist.chunk_store import iter_documents
+from docsassist.embedding_store import EmbeddingStore, StoredEmbeddings
+from docsassist.memory_report import faiss_index_bytes
+from docsassist.vectordb import IndexSettings, IndexType, build_faiss_index
+
+from .bench_retrieval import exact_neighbors, make_queries, percentiles, recall_at_k
+from .synthetic import EMBEDDING_DIM, synthetic_vectors, write_results
+
+logger = logging.getLogger(__name__)
+
+
+def configurations(args, dim):
+    """(build settings, search-time variants) of every swept index."""
+    yield IndexSettings(index_type=IndexType.FLAT), [{}]
+    for nlist in args.nlist:
+        for index_type in (IndexType.IVF_FLAT, IndexType.IVF_PQ):
+            pq_ms = [m for m in args.pq_m if dim % m == 0]
+            for pq_m in pq_ms if index_type == IndexType.IVF_PQ else [None]:
+                settings = IndexSettings(
+                    index_type=index_type,
+                    ivf_nlist=nlist,
+                    **({"pq_m": pq_m} if pq_m else {}),
+                )
+                yield settings, [{"ivf_nprobe": p} for p in args.nprobe if p <= nlist]
+    for m in args.hnsw_m:
+        yield (
+            IndexSettings(index_type=IndexType.HNSW, hnsw_m=m),
+            [{"hnsw_ef_search": ef} for ef in args.ef_search],
+        )
+
+
+def apply_search_parameters(index, settings):
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = settings.ivf_nprobe
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.hnsw_ef_search
+
+
+def measure(index, queries, expected, k):
+    single, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        single.append(time.perf_counter() - start)
+        found.append(ids[0])
+    return {f"recall@{k}": recall_at_k(found, expected), **percentiles(single)}
+
+
+def frontier(results, k):
+    """Results no other result beats on recall, p50 latency and memory at once."""
+    key = f"recall@{k}"
+
+    def dominates(a, b):
+        no_worse = (
+            a[key] >= b[key]
+            and a["p50_ms"] <= b["p50_ms"]
+            and a["index_bytes"] <= b["index_bytes"]
+        )
+        return no_worse and (
+            a[key] > b[key]
+            or a["p50_ms"] < b["p50_ms"]
+            or a["index_bytes"] < b["index_bytes"]
+        )
+
+    return [r for r in results if not any(dominates(o, r) for o in results)]
+
+
+def recommend(results, k, target_recall):
+    """The smallest configuration reaching `target_recall`, faster ones first on ties."""
+    good = [r for r in results if r[f"recall@{k}"] >= target_recall]
+    if not good:
+        return None
+    return min(good, key=lambda r: (r["index_bytes"], round(r["p50_ms"], 2)))
+
+
+def settings_code(settings):
+    """`IndexSettings(...)` with the non-default values of dumped settings."""
+    loaded = IndexSettings.model_validate(settings)
+    changed = [
+        f"index_type=IndexType.{loaded.index_type.name}"
+        if key == "index_type"
+        else f"{key}={getattr(loaded, key)!r}"
+        for key in loaded.model_dump(exclude_defaults=True)
+    ]
+    return f"IndexSettings({', '.join(changed)})"
+
+
+def sweep(vectors, queries, args):
+    expected = exact_neighbors(vectors, queries, args.k)
+    results = []
+    for settings, variants in configurations(args, vectors.shape[1]):
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, settings)
+        build_seconds = time.perf_counter() - start
+        index_bytes = faiss_index_bytes(index)
+        for variant in variants:
+            variant_settings = settings.model_copy(update=variant)
+            apply_search_parameters(index, variant_settings)
+            result = {
+                "index": variant_settings.label(),
+                "settings": variant_settings.model_dump(mode="json"),
+                "build_seconds": build_seconds,
+                "index_bytes": index_bytes,
+                **measure(index, queries, expected, args.k),
+            }
+            results.append(result)
+            logger.info(
+                f"{result['index']:<45} recall@{args.k}={result[f'recall@{args.k}']:.3f} "
+                f"p50={result['p50_ms']:.3f}ms p99={result['p99_ms']:.3f}ms "
+                f"{index_bytes / 2**20:.1f}MiB"
+            )
+        del index
+    return results
+
+
+def table(results, k, frontier_labels):
+    lines = [
+        f"| index | recall@{k} | p50 ms | p99 ms | MiB | build s | frontier |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for r in sorted(results, key=lambda r: -r[f"recall@{k}"]):
+        lines.append(
+            f"| {r['index']} | {r[f'recall@{k}']:.3f} | {r['p50_ms']:.3f} "
+            f"| {r['p99_ms']:.3f} | {r['index_bytes'] / 2**20:.1f} "
+            f"| {r['build_seconds']:.2f} | {'*' if r['index'] in frontier_labels else ''} |"
+        )
+    return "\n".join(lines)
+
+
+def plot(results, k, frontier_results, path):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    for index_type in IndexType:
+        points = [r for r in results if r["settings"]["index_type"] == index_type.value]
+        if points:
+            ax.scatter(
+                [r["p50_ms"] for r in points],
+                [r[f"recall@{k}"] for r in points],
+                label=index_type.value,
+            )
+    best = sorted(frontier_results, key=lambda r: r["p50_ms"])
+    ax.plot(
+        [r["p50_ms"] for r in best],
+        [r[f"recall@{k}"] for r in best],
+        "k--",
+        label="frontier",
+    )
+    ax.set_xscale("log")
+    ax.set_xlabel("p50 single-query latency (ms)")
+    ax.set_ylabel(f"recall@{k} vs flat")
+    ax.legend()
+    fig.savefig(path, bbox_inches="tight")
+
+
+def load_vectors(args):
+    """Chunk and query embeddings of a chunk store, or synthetic ones."""
+    if args.chunk_store is None:
+        vectors = synthetic_vectors(args.chunks, args.dim)
+        return vectors, make_queries(vectors, args.queries)
+
+    from docsassist.vectordb import load_embeddings
+
+    embedding = load_embeddings(str(args.model_dir), args.embedding_model)
+    if args.embedding_store is not None:
+        embedding = StoredEmbeddings(
+            embedding, EmbeddingStore(args.embedding_store, args.embedding_model)
+        )
+    texts = [doc.page_content for doc in iter_documents(args.chunk_store)]
+    vectors = np.asarray(embedding.embed_documents(texts), dtype=np.float32)
+    if args.questions is None:
+        return vectors, make_queries(vectors, args.queries)
+    questions = [q for q in args.questions.read_text().splitlines() if q.strip()]
+    queries = np.asarray([embedding.embed_query(q) for q in questions], np.float32)
+    return vectors, queries
+
+
+def run(args):
+    vectors, queries = load_vectors(args)
+    logger.info(f"Sweeping {len(vectors)} chunks with {len(queries)} queries")
+    results = sweep(vectors, queries, args)
+    best = frontier(results, args.k)
+    recommended = recommend(results, args.k, args.target_recall)
+    return {
+        "chunks": len(vectors),
+        "queries": len(queries),
+        "k": args.k,
+        "target_recall": args.target_recall,
+        "runs": results,
+        "frontier": [r["index"] for r in best],
+        "recommended": recommended,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunk-store", type=Path, default=None)
+    parser.add_argument(
+        "--model-dir",
+        type=Path,
+        default=Path("deployment_diy_rag"),
+        help="directory of the sentence transformer cache",
+    )
+    parser.add_argument("--embedding-model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--embedding-store", type=Path, default=None)
+    parser.add_argument(
+        "--questions",
+        type=Path,
+        default=None,
+        help="text file of queries, one per line; default: perturbed chunks",
+    )
+    parser.add_argument("--chunks", type=int, default=50_000, help="synthetic")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_DIM, help="synthetic")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--pq-m", type=int, nargs="+", default=[16, 48])
+    parser.add_argument("--hnsw-m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument(
+        "--output", type=Path, default=Path("tests/output/sweep_index.json")
+    )
+    parser.add_argument("--plot", type=Path, default=None, help="needs matplotlib")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    results = run(args)
+    write_results(args.output, "index_sweep", results)
+    print(table(results["runs"], args.k, set(results["frontier"])))
+    if args.plot is not None:
+        best = [r for r in results["runs"] if r["index"] in results["frontier"]]
+        plot(results["runs"], args.k, best, args.plot)
+    recommended = results["recommended"]
+    if recommended is None:
+        print(f"\nNo configuration reaches recall@{args.k} >= {args.target_recall}")
+    else:
+        print(
+            f"\nRecommended for recall@{args.k} >= {args.target_recall}: "
+            f"{recommended['index']}\n{settings_code(recommended['settings'])}"
+        )
+
+
+if __name__ == "__main__":
+    main()
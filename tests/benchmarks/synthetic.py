@@ -0,0 +1,162 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import datetime as dt
+import importlib.util
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import yaml
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from docsassist.schema import RAGModelSettings
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+DIY_RAG_PATH = PROJECT_ROOT / "deployment_diy_rag"
+
+# output dimension of all-MiniLM-L6-v2, the default embedding model of docsassist.ingest
+EMBEDDING_DIM = 384
+
+SECTIONS = ["get-started", "modeling", "mlops", "data", "api", "workbench"]
+_WORDS = (
+    "datarobot model deployment prediction feature dataset project blueprint "
+    "accuracy leaderboard monitoring drift custom environment registry "
+    "application notebook vector database retrieval prompt guard training "
+    "validation holdout partition target metric insight explanation"
+).split()
+
+
+def synthetic_documents(n: int, words_per_chunk: int = 250, seed: int = 0):
+    """Documentation-like chunks with docs.datarobot.com style sources."""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(n):
+        section = SECTIONS[i % len(SECTIONS)]
+        words = [rng.choice(_WORDS) for _ in range(words_per_chunk)]
+        sentences = [
+            " ".join(words[j : j + 12]).capitalize() + "."
+            for j in range(0, len(words), 12)
+        ]
+        documents.append(
+            Document(
+                page_content=f"## {section} {i}\n\n" + " ".join(sentences),
+                metadata={
+                    "source": f"https://docs.datarobot.com/en/docs/{section}/"
+                    f"page-{i // 10}.html"
+                },
+            )
+        )
+    return documents
+
+
+def synthetic_questions(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [
+        "How do I " + " ".join(rng.choice(_WORDS) for _ in range(6)) + "?"
+        for _ in range(n)
+    ]
+
+
+def synthetic_vectors(
+    n: int, dim: int = EMBEDDING_DIM, seed: int = 0, intrinsic_dim: int = 16
+):
+    """Unit-norm vectors around topic centers, like embeddings of a doc corpus.
+
+    Uniformly random vectors have no neighborhood structure and make every
+    approximate index look bad, so chunks are drawn around `sqrt(n)` centers
+    with noise of a low intrinsic dimension, as sentence embeddings have.
+    """
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, int(np.sqrt(n)))
+    centers = rng.standard_normal((n_topics, dim), dtype=np.float32)
+    projection = rng.standard_normal((intrinsic_dim, dim), dtype=np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        stop = min(n, start + 100_000)
+        topics = rng.integers(0, n_topics, stop - start)
+        noise = rng.standard_normal((stop - start, intrinsic_dim), dtype=np.float32)
+        vectors[start:stop] = centers[topics] + 0.6 * noise @ projection
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def fake_embeddings(dim: int = EMBEDDING_DIM):
+    return DeterministicFakeEmbedding(size=dim)
+
+
+def write_model_dir(path: Path, documents, embedding_function) -> Path:
+    """Lay out a DIY RAG model directory the way docsassist.ingest does."""
+    path.mkdir(parents=True, exist_ok=True)
+    db = FAISS.from_documents(documents, embedding_function)
+    db.save_local(str(path / "faiss_db"))
+    settings = RAGModelSettings(
+        embedding_model_name="synthetic",
+        max_retries=0,
+        request_timeout=30,
+        temperature=0.0,
+        stuff_prompt="Answer from the context.\n----------------\n{context}",
+    )
+    with open(path / RAGModelSettings.filename(), "w") as f:
+        yaml.safe_dump(settings.model_dump(mode="json"), f)
+    return path
+
+
+def import_custom_model():
+    """Import deployment_diy_rag/custom.py the way DRUM does."""
+    spec = importlib.util.spec_from_file_location(
+        "diy_rag_custom", DIY_RAG_PATH / "custom.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_bytes() -> int:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def write_results(output: Path, benchmark: str, results) -> None:
+    """Write results with enough context to compare runs over time."""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, text=True
+        ).strip()
+    except Exception:
+        commit = None
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "benchmark": benchmark,
+                "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(),
+                "commit": commit,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
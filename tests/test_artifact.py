@@ -0,0 +1,109 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import numpy as np
+import pytest
+
+from docsassist.artifact import ARTIFACT_MANIFEST, build_artifact, inference_files
+
+SNAPSHOT = "sentencetransformers/models--all-MiniLM-L6-v2/snapshots/abc"
+
+
+def write_model_dir(root):
+    files = {
+        "custom.py": "def load_model(): ...",
+        "README.md": "docs",
+        "model-metadata.yaml.jinja": "{{ name }}",
+        "rag_settings.yaml": "k: 4",
+        "faiss_db/index.faiss": "index",
+        "faiss_db/files.json": "{}",
+        "chunks.parquet": "chunks",
+        f"{SNAPSHOT}/config.json": "{}",
+        f"{SNAPSHOT}/model.safetensors": "weights",
+        f"{SNAPSHOT}/pytorch_model.bin": "weights",
+        f"{SNAPSHOT}/onnx/model.onnx": "weights",
+        f"{SNAPSHOT}/tf_model.h5": "weights",
+        "sentencetransformers/models--all-MiniLM-L6-v2/blobs/123": "weights",
+    }
+    for name, content in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def test_artifact_keeps_only_inference_files(tmp_path):
+    write_model_dir(tmp_path / "model")
+
+    names = {name for _, name in inference_files(tmp_path / "model")}
+
+    assert names == {
+        "custom.py",
+        "rag_settings.yaml",
+        "faiss_db/index.faiss",
+        f"{SNAPSHOT}/config.json",
+        f"{SNAPSHOT}/model.safetensors",
+    }
+
+
+def test_unchanged_artifact_is_reused(tmp_path):
+    model_dir = tmp_path / "model"
+    write_model_dir(model_dir)
+    cache = tmp_path / "cache"
+
+    files, digest = build_artifact(inference_files(model_dir), cache)
+    built = {name: (cache / digest[:16] / name).stat().st_mtime_ns for _, name in files}
+    again, same_digest = build_artifact(inference_files(model_dir), cache)
+
+    assert (again, same_digest) == (files, digest)
+    assert {
+        name: (cache / digest[:16] / name).stat().st_mtime_ns for _, name in again
+    } == built
+    assert sorted(name for _, name in files) == sorted(
+        [name for _, name in inference_files(model_dir)] + [ARTIFACT_MANIFEST]
+    )
+    for source, name in files:
+        if name != ARTIFACT_MANIFEST:
+            assert open(source).read() == (model_dir / name).read_text()
+
+
+def test_changed_file_builds_a_new_artifact(tmp_path):
+    model_dir = tmp_path / "model"
+    write_model_dir(model_dir)
+    cache = tmp_path / "cache"
+    _, digest = build_artifact(inference_files(model_dir), cache)
+
+    (model_dir / "faiss_db" / "index.faiss").write_text("new index")
+    _, new_digest = build_artifact(inference_files(model_dir), cache)
+
+    assert new_digest != digest
+    assert [p.name for p in cache.iterdir()] == [new_digest[:16]]
+
+
+def test_fp16_weights(tmp_path):
+    safetensors_numpy = pytest.importorskip("safetensors.numpy")
+    model_dir = tmp_path / "model"
+    write_model_dir(model_dir)
+    weights = np.random.default_rng(0).random((8, 4), dtype=np.float32)
+    safetensors_numpy.save_file(
+        {"w": weights}, str(model_dir / SNAPSHOT / "model.safetensors")
+    )
+
+    files, _ = build_artifact(inference_files(model_dir), tmp_path / "cache", fp16=True)
+
+    stored = dict((name, source) for source, name in files)
+    loaded = safetensors_numpy.load_file(stored[f"{SNAPSHOT}/model.safetensors"])
+    assert loaded["w"].dtype == np.float16
+    np.testing.assert_allclose(loaded["w"], weights, atol=1e-3)
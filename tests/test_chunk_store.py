@@ -0,0 +1,84 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import logging
+
+import pyarrow.parquet as pq
+from langchain_core.documents import Document
+
+from docsassist import chunk_store
+from docsassist.chunk_store import ChunkWriter, chunk_ids, iter_documents, stored_files
+from docsassist.ingest import IngestSettings, build_vector_database
+from docsassist.vectordb import chunk_id
+
+from .benchmarks.synthetic import fake_embeddings
+from .test_incremental import CountingEmbeddings
+from .test_ingest import load_text, write_docs_zip
+
+
+def test_chunks_round_trip_in_row_groups(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "ROW_GROUP_SIZE", 4)
+    path = tmp_path / "chunks.parquet"
+    documents = {
+        f"file-{i}.md": [
+            Document(
+                page_content=f"chunk {i}.{j}",
+                metadata={"source": f"file-{i}", "page": j},
+            )
+            for j in range(3)
+        ]
+        for i in range(5)
+    }
+    with ChunkWriter(path, "settings") as writer:
+        for name, docs in documents.items():
+            writer.write(name, f"sha-{name}", docs + docs[:1])
+
+    assert pq.ParquetFile(path).num_row_groups > 1
+    assert stored_files(path, "settings") == {name: f"sha-{name}" for name in documents}
+    assert stored_files(path, "other settings") == {}
+    assert list(iter_documents(path)) == [
+        doc for docs in documents.values() for doc in docs
+    ]
+    assert list(iter_documents(path, ["file-3.md"])) == documents["file-3.md"]
+    assert chunk_ids(path)["file-1.md"] == [
+        chunk_id(doc) for doc in documents["file-1.md"]
+    ]
+
+    copied = tmp_path / "copy.parquet"
+    with ChunkWriter(copied, "settings") as writer:
+        writer.copy(path, ["file-0.md", "file-4.md"])
+    assert set(stored_files(copied, "settings")) == {"file-0.md", "file-4.md"}
+
+
+def test_builds_reuse_the_chunk_store(tmp_path, caplog):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 6)
+    settings = IngestSettings(chunk_size=500, chunk_overlap=0)
+    embedding = CountingEmbeddings(fake_embeddings(32))
+    store = tmp_path / "cache" / "chunks.parquet"
+    for output in ["one", "two"]:
+        (tmp_path / output).mkdir()
+        with caplog.at_level(logging.INFO, logger="docsassist.ingest"):
+            report = build_vector_database(
+                docs_zip,
+                tmp_path / output,
+                settings,
+                embedding_function=embedding,
+                loaders={".txt": load_text},
+                chunk_store=store,
+            )
+        assert report.rebuilt and report.added == 18
+    assert "Reusing the chunks of 6 files" in caplog.text
+    assert len(list(iter_documents(store))) == 18
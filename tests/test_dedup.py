@@ -0,0 +1,86 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import zipfile
+
+from langchain_core.documents import Document
+
+from docsassist.dedup import deduplicate
+from docsassist.ingest import IngestSettings, build_vector_database
+from docsassist.vectordb import load_vectorstore
+
+from .benchmarks.synthetic import fake_embeddings, synthetic_documents
+from .test_ingest import load_text
+
+DISCLAIMER = (
+    "This documentation is provided as is. Features described here may change "
+    "without notice, and availability depends on your subscription plan and "
+    "the region of your deployment. Contact your account team for details "
+    "about pricing, limits and the support policy of preview features."
+)
+
+
+def test_near_duplicates_merge_and_keep_their_sources():
+    documents = synthetic_documents(40, words_per_chunk=40)
+    boilerplate = [
+        Document(
+            page_content=DISCLAIMER + ("" if i == 0 else f" Page {i}."),
+            metadata={"source": f"page-{i}"},
+        )
+        for i in range(5)
+    ]
+    corpus = documents[:20] + boilerplate + documents[20:]
+    iterations = []
+
+    def chunks():
+        iterations.append(1)
+        return iter(corpus)
+
+    merged, report = deduplicate(chunks, threshold=0.8)
+    merged = list(merged)
+
+    assert (report.chunks, report.unique, report.removed) == (45, 41, 4)
+    assert len(iterations) == 2
+    assert [doc.page_content for doc in merged] == [
+        doc.page_content for doc in documents[:20] + boilerplate[:1] + documents[20:]
+    ]
+    assert merged[20].metadata["sources"] == [f"page-{i}" for i in range(5)]
+    assert not any("sources" in doc.metadata for doc in merged[:20] + merged[21:])
+
+
+def test_build_merges_near_duplicates(tmp_path):
+    docs_zip = tmp_path / "docs.zip"
+    with zipfile.ZipFile(docs_zip, "w") as zf:
+        for i in range(4):
+            zf.writestr(
+                f"datarobot_docs/en/page-{i}.txt",
+                f"Page {i} is about topic {i} " * 30 + "\n\n" + DISCLAIMER,
+            )
+    embedding = fake_embeddings(32)
+    report = build_vector_database(
+        docs_zip,
+        tmp_path,
+        IngestSettings(chunk_size=500, chunk_overlap=0, near_duplicate_threshold=0.8),
+        embedding_function=embedding,
+        loaders={".txt": load_text},
+    )
+
+    assert report.added == 5
+    db = load_vectorstore(str(tmp_path), embedding)
+    (disclaimer,) = [
+        doc for doc in db.docstore._dict.values() if doc.page_content == DISCLAIMER
+    ]
+    assert len(disclaimer.metadata["sources"]) == 4
@@ -263,3 +263,158 @@ def test_diy_rag_custom_model(
         content3 = f.read()
 
     assert "DataRobot" in content3
+
+
+def test_diy_rag_score_offline(tmp_path: Path) -> None:
+    from docsassist.schema import DEGRADED_COLUMN_NAME, TARGET_COLUMN_NAME
+
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import (
+        fake_embeddings,
+        import_custom_model,
+        synthetic_documents,
+        write_model_dir,
+    )
+
+    custom = import_custom_model()
+    embedding_function = fake_embeddings()
+    write_model_dir(tmp_path, synthetic_documents(50), embedding_function)
+    model = custom.load_model(
+        str(tmp_path),
+        llm=FakeChatModel(output_tokens=8),
+        embedding_function=embedding_function,
+    )
+    data = pd.DataFrame(
+        {
+            "promptText": ["Tell me about DataRobot?", "Which fruit?"],
+            "association_id": ["id1", "id2"],
+            "messages": ["[]", json.dumps([{"role": "user", "content": "Banana"}])],
+        }
+    )
+
+    first = custom.score(data, model)
+    second = custom.score(data, model)
+
+    pd.testing.assert_frame_equal(first, second)
+    assert len(first) == 2
+    assert first[TARGET_COLUMN_NAME].str.split().str.len().tolist() == [8, 8]
+    assert not first[DEGRADED_COLUMN_NAME].any()
+    assert first["CITATION_SOURCE_0"].str.startswith("https://").all()
+
+
+@pytest.mark.parametrize(
+    "mode, suffix", [("cprofile", ".prof"), ("sampling", ".folded")]
+)
+def test_diy_rag_score_profiling(tmp_path: Path, monkeypatch, mode, suffix) -> None:
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import (
+        fake_embeddings,
+        import_custom_model,
+        synthetic_documents,
+        write_model_dir,
+    )
+
+    profile_dir = tmp_path / "profiles"
+    monkeypatch.setenv("RAG_PROFILING_MODE", mode)
+    monkeypatch.setenv("RAG_PROFILING_SAMPLE_RATE", "1")
+    monkeypatch.setenv("RAG_PROFILING_OUTPUT_DIR", str(profile_dir))
+    monkeypatch.setenv("RAG_PROFILING_MAX_PROFILES", "2")
+
+    custom = import_custom_model()
+    embedding_function = fake_embeddings()
+    write_model_dir(tmp_path / "model", synthetic_documents(20), embedding_function)
+    model = custom.load_model(
+        str(tmp_path / "model"),
+        llm=FakeChatModel(latency=0.02),
+        embedding_function=embedding_function,
+    )
+    data = pd.DataFrame(
+        {
+            "promptText": ["Tell me about DataRobot?"] * 3,
+            "association_id": ["id/1", "id/2", "id/3"],
+            "messages": ["[]"] * 3,
+        }
+    )
+    custom.score(data, model)
+
+    profiles = sorted(p.name for p in profile_dir.iterdir())
+    assert len(profiles) == 2
+    assert profiles[0].endswith("_id_2" + suffix)
+    assert profiles[1].endswith("_id_3" + suffix)
+
+
+def test_diy_rag_profiling_disabled_by_default(tmp_path: Path, monkeypatch) -> None:
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import (
+        fake_embeddings,
+        import_custom_model,
+        synthetic_documents,
+        write_model_dir,
+    )
+
+    monkeypatch.delenv("RAG_PROFILING_MODE", raising=False)
+    custom = import_custom_model()
+    embedding_function = fake_embeddings()
+    write_model_dir(tmp_path, synthetic_documents(5), embedding_function)
+    model = custom.load_model(
+        str(tmp_path), llm=FakeChatModel(), embedding_function=embedding_function
+    )
+    assert model[-1] is None
+
+
+def test_diy_rag_late_answer_degrades_to_extractive(tmp_path: Path) -> None:
+    import time
+
+    import yaml
+    from langchain_core.documents import Document
+
+    from docsassist.extractive import split_sentences
+    from docsassist.schema import (
+        DEGRADED_COLUMN_NAME,
+        TARGET_COLUMN_NAME,
+        RAGModelSettings,
+    )
+
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import (
+        fake_embeddings,
+        import_custom_model,
+        synthetic_documents,
+        write_model_dir,
+    )
+
+    custom = import_custom_model()
+    embedding_function = fake_embeddings()
+    write_model_dir(tmp_path, synthetic_documents(20), embedding_function)
+    settings_path = tmp_path / RAGModelSettings.filename()
+    settings = yaml.safe_load(settings_path.read_text())
+    settings_path.write_text(yaml.safe_dump({**settings, "generation_deadline": 0.2}))
+    model = custom.load_model(
+        str(tmp_path),
+        llm=FakeChatModel(latency=2.0),
+        embedding_function=embedding_function,
+    )
+    data = pd.DataFrame(
+        {
+            "promptText": ["Tell me about DataRobot?"],
+            "association_id": ["id1"],
+            "messages": ["[]"],
+        }
+    )
+
+    started_at = time.monotonic()
+    result = custom.score(data, model)
+    elapsed = time.monotonic() - started_at
+
+    # the answer doesn't wait for the LLM, which is still running
+    assert elapsed < 1.0
+    assert result[DEGRADED_COLUMN_NAME].tolist() == [True]
+    pool = model[0].generation_pool
+    # room for a row per 0.2s deadline while late answers run for 30s
+    assert (pool.workers, pool.abandoned) == (151, 1)
+    # made of sentences of the retrieved chunks
+    corpus = " ".join(doc.page_content for doc in synthetic_documents(20))
+    sentences = split_sentences(
+        [Document(page_content=result[TARGET_COLUMN_NAME].iloc[0])]
+    )
+    assert sentences and all(sentence in corpus for sentence in sentences)
@@ -0,0 +1,63 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import functools
+
+import numpy as np
+
+from docsassist.embedding_pool import EmbeddingPool
+from docsassist.ingest import IngestSettings, build_vector_database
+from docsassist.vectordb import load_vectorstore
+
+from .benchmarks.synthetic import fake_embeddings
+from .test_ingest import load_text, write_docs_zip
+
+
+def test_pool_embeds_like_a_single_process():
+    texts = [f"chunk {i}" for i in range(37)]
+
+    with EmbeddingPool(
+        functools.partial(fake_embeddings, 32), workers=2, threads=1, batch_size=8
+    ) as pool:
+        vectors = pool.embed_documents(texts)
+        query = pool.embed_query("chunk 3")
+
+    expected = fake_embeddings(32)
+    np.testing.assert_allclose(vectors, expected.embed_documents(texts), rtol=1e-6)
+    np.testing.assert_allclose(query, expected.embed_documents(["chunk 3"])[0])
+    assert pool.embedded == 38
+    assert "with 2 processes of 1 threads, batch size 8" in pool.format()
+
+
+def test_build_with_embedding_pool(tmp_path, caplog):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 6)
+
+    with (
+        caplog.at_level("INFO", logger="docsassist.ingest"),
+        EmbeddingPool(functools.partial(fake_embeddings, 32), workers=2) as pool,
+    ):
+        report = build_vector_database(
+            docs_zip,
+            tmp_path,
+            IngestSettings(chunk_size=500, chunk_overlap=0),
+            embedding_function=pool,
+            loaders={".txt": load_text},
+        )
+
+    assert report.added == 18
+    assert "Embedded 18 chunks with 2 processes" in caplog.text
+    db = load_vectorstore(str(tmp_path), fake_embeddings(32))
+    assert db.index.ntotal == 18
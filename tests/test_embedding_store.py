@@ -0,0 +1,86 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import numpy as np
+import pytest
+
+from docsassist.embedding_store import (
+    KEYS,
+    VECTORS,
+    EmbeddingStore,
+    StoredEmbeddings,
+)
+from docsassist.ingest import IngestSettings, build_vector_database
+
+from .benchmarks.synthetic import fake_embeddings
+from .test_incremental import CountingEmbeddings
+from .test_ingest import load_text, write_docs_zip
+
+
+def test_stored_embeddings_are_reused(tmp_path):
+    model = CountingEmbeddings(fake_embeddings(16))
+    texts = ["alpha", "beta", "alpha", "gamma"]
+    first = StoredEmbeddings(model, EmbeddingStore(tmp_path, "org/model"))
+    vectors = first.embed_documents(texts)
+    assert model.embedded == 3
+    assert np.allclose(vectors, model.embedding.embed_documents(texts))
+
+    # a new process reads the vectors back from disk
+    second = StoredEmbeddings(model, EmbeddingStore(tmp_path, "org/model"))
+    again = second.embed_documents(["gamma", "delta", "alpha"])
+    assert again[0] == vectors[3] and again[2] == vectors[0]
+    assert np.allclose(again[1], model.embedding.embed_documents(["delta"])[0])
+    assert (model.embedded, second.hits, second.misses) == (4, 2, 1)
+    assert len(EmbeddingStore(tmp_path, "org/model")) == 4
+    assert len(EmbeddingStore(tmp_path, "other-model")) == 0
+
+
+def test_interrupted_append_is_dropped(tmp_path):
+    model = fake_embeddings(16)
+    StoredEmbeddings(model, EmbeddingStore(tmp_path, "m")).embed_documents(["a", "b"])
+    folder = EmbeddingStore(tmp_path, "m").folder
+    with open(folder / VECTORS, "ab") as f:
+        f.write(np.ones(16, dtype=np.float32).tobytes())
+    store = EmbeddingStore(tmp_path, "m")
+    assert len(store) == 2
+    assert (folder / VECTORS).stat().st_size == 2 * 16 * 4
+    assert (folder / KEYS).stat().st_size == 2 * 32
+
+
+def test_model_name_must_match(tmp_path):
+    StoredEmbeddings(
+        fake_embeddings(8), EmbeddingStore(tmp_path, "a/b")
+    ).embed_documents(["x"])
+    with pytest.raises(ValueError):
+        EmbeddingStore(tmp_path, "a_b")
+
+
+def test_builds_share_embeddings(tmp_path):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 6)
+    embedding = CountingEmbeddings(fake_embeddings(32))
+    store = tmp_path / "embeddings"
+    for chunk_size, output in [(500, "one"), (100000, "two"), (500, "three")]:
+        (tmp_path / output).mkdir()
+        build_vector_database(
+            docs_zip,
+            tmp_path / output,
+            IngestSettings(chunk_size=chunk_size, chunk_overlap=0),
+            embedding_function=embedding,
+            loaders={".txt": load_text},
+            embedding_store=store,
+        )
+    # 18 paragraph chunks, then 6 whole pages, then nothing new
+    assert embedding.embedded == 24
@@ -0,0 +1,64 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docsassist.extractive import extractive_answer, split_sentences
+
+
+class BagOfWordsEmbeddings(Embeddings):
+    vocabulary = ["deploy", "model", "banana", "fruit", "weather"]
+
+    def _embed(self, text):
+        words = text.lower().split()
+        return [float(sum(w.startswith(v) for w in words)) for v in self.vocabulary]
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def test_split_sentences_deduplicates_in_order():
+    docs = [
+        Document(
+            page_content="You can deploy a model. Short. Bananas are a tasty fruit."
+        ),
+        Document(page_content="You can deploy a model.\n\nThe weather is nice today."),
+    ]
+    assert split_sentences(docs) == [
+        "You can deploy a model.",
+        "Bananas are a tasty fruit.",
+        "The weather is nice today.",
+    ]
+
+
+def test_extractive_answer_picks_closest_sentences_in_original_order():
+    docs = [
+        Document(
+            page_content="The weather is nice today. Deploy the model from the "
+            "registry. Banana bread needs ripe fruit. Every model deploy is logged."
+        )
+    ]
+    answer = extractive_answer(
+        "How do I deploy a model?", docs, BagOfWordsEmbeddings(), max_sentences=2
+    )
+    assert answer == (
+        "Deploy the model from the registry. Every model deploy is logged."
+    )
+    assert extractive_answer("anything", [], BagOfWordsEmbeddings(), 2) == ""
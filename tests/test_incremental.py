@@ -0,0 +1,157 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from docsassist.incremental import ingest, patch_vectorstore
+from docsassist.metadata_filter import FilteredSearch, RetrievalFilter
+from docsassist.prefork import flatten_docstore
+from docsassist.vectordb import (
+    IndexSettings,
+    IndexType,
+    chunk_id,
+    embed_documents,
+    load_faiss,
+    shards_of,
+    tombstones_of,
+)
+
+from .benchmarks.synthetic import fake_embeddings, synthetic_documents
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, embedding):
+        self.embedding = embedding
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embedding.embed_query(text)
+
+
+def edited_corpus(documents):
+    """Drop the first 20 chunks, change the next 10 and add 15 new ones."""
+    changed = [
+        Document(page_content=doc.page_content + " (updated)", metadata=doc.metadata)
+        for doc in documents[20:30]
+    ]
+    added = [
+        Document(page_content=f"new chunk {i}", metadata={"source": "new"})
+        for i in range(15)
+    ]
+    return changed + documents[30:] + added
+
+
+def contents(vectorstore, query, k=10):
+    return [
+        doc.page_content for doc in vectorstore.similarity_search_by_vector(query, k=k)
+    ]
+
+
+@pytest.mark.parametrize("shards", [1, 3])
+@pytest.mark.parametrize("index_type", list(IndexType))
+def test_ingest_embeds_only_new_chunks(tmp_path, index_type, shards):
+    embedding = CountingEmbeddings(fake_embeddings(32))
+    settings = IndexSettings(index_type=index_type, pq_m=8, shards=shards)
+    documents = synthetic_documents(400, words_per_chunk=20)
+    folder = str(tmp_path / "faiss_db")
+
+    first = ingest(folder, documents, embedding, settings)
+    assert first.rebuilt and embedding.embedded == 400
+
+    corpus = edited_corpus(documents)
+    second = ingest(folder, corpus, embedding, settings, compact_threshold=1.0)
+    assert (second.added, second.deleted, second.unchanged) == (25, 30, 370)
+    assert embedding.embedded == 425
+
+    db = load_faiss(folder, embedding)
+    assert sum(len(tombstones_of(shard)) for shard in shards_of(db)) == 30
+    removed = {doc.page_content for doc in documents[:30]}
+    query = embedding.embed_query(documents[5].page_content)
+    found = contents(db, query, k=50)
+    assert len(found) == 50 and not removed & set(found)
+    if index_type in (IndexType.FLAT, IndexType.HNSW):
+        assert contents(db, embedding.embed_query("new chunk 3"), k=1) == [
+            "new chunk 3"
+        ]
+
+    third = ingest(folder, corpus, embedding, settings, compact_threshold=0.0)
+    assert (third.added, third.deleted, third.compacted_shards) == (0, 0, shards)
+    assert embedding.embedded == 425
+    db = load_faiss(folder, embedding)
+    assert sum(shard.index.ntotal for shard in shards_of(db)) == len(corpus)
+    compacted = contents(db, query, k=50)
+    if index_type == IndexType.IVF_PQ:
+        # compaction re-encodes the vectors decoded from their PQ codes
+        assert len(set(compacted) & set(found)) >= 45
+    else:
+        assert compacted == found
+
+
+def test_patch_streams_documents_in_batches(tmp_path):
+    embedding = CountingEmbeddings(fake_embeddings(32))
+    documents = synthetic_documents(100, words_per_chunk=20)
+    db = embed_documents(documents, embedding, IndexSettings(shards=2))
+    embedding.embedded = 0
+
+    corpus = edited_corpus(documents)
+    deleted = {chunk_id(doc) for doc in documents[:30]}
+    report = patch_vectorstore(
+        db, iter(corpus), deleted, embedding, compact_threshold=1.0, batch_size=7
+    )
+    assert (report.added, report.deleted, report.unchanged) == (25, 30, 70)
+    assert embedding.embedded == 25
+
+
+def test_ingest_rebuilds_on_new_settings(tmp_path):
+    embedding = CountingEmbeddings(fake_embeddings(32))
+    documents = synthetic_documents(50, words_per_chunk=20)
+    folder = str(tmp_path / "faiss_db")
+    ingest(folder, documents, embedding, IndexSettings(shards=2))
+
+    report = ingest(folder, documents, embedding, IndexSettings())
+    assert report.rebuilt and embedding.embedded == 100
+    assert not (tmp_path / "faiss_db" / "shards.json").exists()
+
+
+def test_ingest_without_chunks_raises(tmp_path):
+    folder = tmp_path / "faiss_db"
+
+    with pytest.raises(ValueError, match="No chunks"):
+        ingest(str(folder), [], fake_embeddings(32), IndexSettings(), rebuild=True)
+    assert not folder.exists()
+
+
+def test_tombstones_are_skipped_by_filters_and_flat_docstores(tmp_path):
+    embedding = fake_embeddings(32)
+    documents = synthetic_documents(60, words_per_chunk=20)
+    folder = str(tmp_path / "faiss_db")
+    ingest(folder, documents, embedding, IndexSettings())
+    ingest(folder, documents[10:], embedding, IndexSettings(), compact_threshold=1.0)
+
+    db = flatten_docstore(load_faiss(folder, embedding))
+    query = embedding.embed_query(documents[3].page_content)
+    assert documents[3].page_content not in contents(db, query, k=50)
+    retrieval_filter = RetrievalFilter(source_prefix="https://")
+    bitmap_hits = FilteredSearch(db).similarity_search_with_score_by_vector(
+        query, retrieval_filter, k=60
+    )
+    assert len(bitmap_hits) == 50
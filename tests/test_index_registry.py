@@ -0,0 +1,142 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import os
+
+import pandas as pd
+import pytest
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+
+from docsassist.index_registry import IndexRegistry, UnknownIndexError, estimated_bytes
+from docsassist.schema import INDEX_NAME_COLUMN_NAME, PROMPT_COLUMN_NAME
+
+from .benchmarks.synthetic import fake_embeddings, synthetic_documents, write_model_dir
+
+
+def write_named_index(model_dir, name, documents, embedding):
+    folder = model_dir / "indexes" / name
+    FAISS.from_documents(documents, embedding).save_local(str(folder))
+    return folder
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    embedding = fake_embeddings(32)
+    write_model_dir(tmp_path, synthetic_documents(20), embedding)
+    for name in ["a", "b", "c"]:
+        write_named_index(tmp_path, name, synthetic_documents(200), embedding)
+    return tmp_path
+
+
+def test_registry_loads_lazily_and_evicts_lru(model_dir):
+    embedding = fake_embeddings(32)
+    one_index = estimated_bytes(
+        FAISS.load_local(
+            str(model_dir / "indexes" / "a"),
+            embedding,
+            allow_dangerous_deserialization=True,
+        ),
+        str(model_dir / "indexes" / "a"),
+    )
+    registry = IndexRegistry(
+        str(model_dir), embedding, memory_budget_bytes=int(2.5 * one_index)
+    )
+
+    assert registry.names() == ["default", "a", "b", "c"]
+    assert registry.loaded() == []
+    a = registry.get("a")
+    registry.get("b")
+    assert registry.get("a") is a
+    registry.get("c")
+
+    assert registry.loaded() == ["a", "c"]
+    assert registry.loaded_bytes <= registry.memory_budget_bytes
+
+
+def test_loading_an_index_does_not_block_the_others(model_dir, monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from docsassist import index_registry
+
+    registry = IndexRegistry(str(model_dir), fake_embeddings(32))
+    registry.get("b")
+    loading_a, release_a = threading.Event(), threading.Event()
+    loads = []
+    load_faiss = index_registry.load_faiss
+
+    def slow_load_faiss(folder, embeddings):
+        loads.append(folder)
+        if folder.endswith("a"):
+            loading_a.set()
+            assert release_a.wait(10)
+        return load_faiss(folder, embeddings)
+
+    monkeypatch.setattr(index_registry, "load_faiss", slow_load_faiss)
+    with ThreadPoolExecutor(3) as executor:
+        first_a = executor.submit(registry.get, "a")
+        assert loading_a.wait(10)
+        second_a = executor.submit(registry.get, "a")
+        # a loaded index and the loading of another one are served meanwhile
+        registry.get("b")
+        registry.get("c")
+        release_a.set()
+
+        assert first_a.result() is second_a.result()
+    assert sorted(os.path.basename(folder) for folder in loads) == ["a", "c"]
+
+
+@pytest.mark.parametrize("name", ["missing", "../faiss_db", "a/../b"])
+def test_registry_rejects_unknown_names(model_dir, name):
+    registry = IndexRegistry(str(model_dir), fake_embeddings(32))
+    with pytest.raises(UnknownIndexError, match="available: default, a, b, c"):
+        registry.get(name)
+
+
+def test_score_selects_index_per_row(tmp_path, monkeypatch):
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import import_custom_model
+
+    monkeypatch.setenv("RAG_INDEX_MEMORY_BUDGET_MB", "100")
+    embedding = fake_embeddings()
+    write_model_dir(tmp_path, synthetic_documents(10), embedding)
+    write_named_index(
+        tmp_path,
+        "fruit",
+        [Document(page_content="Bananas are yellow.", metadata={"source": "fruit"})],
+        embedding,
+    )
+    custom = import_custom_model()
+    model = custom.load_model(
+        str(tmp_path), llm=FakeChatModel(), embedding_function=embedding
+    )
+    assert model[0].indexes.loaded() == ["default"]
+
+    result = custom.score(
+        pd.DataFrame(
+            {
+                PROMPT_COLUMN_NAME: ["Which fruit?"] * 3,
+                INDEX_NAME_COLUMN_NAME: [None, "fruit", "vegetables"],
+            }
+        ),
+        model,
+    )
+
+    assert result["CITATION_SOURCE_0"][0].startswith("https://docs.datarobot.com")
+    assert result["CITATION_SOURCE_0"][1] == "fruit"
+    assert "Unknown index 'vegetables'" in result["resultText"][2]
+    assert model[0].indexes.loaded() == ["default", "fruit"]
@@ -0,0 +1,81 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+from argparse import Namespace
+
+from .benchmarks.sweep_index import frontier, recommend, run, settings_code
+
+
+def result(index, recall, p50_ms, index_bytes):
+    return {
+        "index": index,
+        "recall@4": recall,
+        "p50_ms": p50_ms,
+        "index_bytes": index_bytes,
+    }
+
+
+def test_frontier_and_recommendation():
+    results = [
+        result("flat", 1.0, 1.0, 100),
+        result("hnsw", 0.97, 0.2, 150),
+        result("ivf", 0.90, 0.1, 100),
+        result("slow ivf", 0.90, 0.3, 100),
+        result("pq", 0.60, 0.1, 10),
+    ]
+    assert [r["index"] for r in frontier(results, 4)] == ["flat", "hnsw", "ivf", "pq"]
+    # the smallest index that is good enough, however slow
+    assert recommend(results, 4, 0.95)["index"] == "flat"
+    # ties in memory go to the fastest
+    assert recommend(results, 4, 0.85)["index"] == "ivf"
+    assert recommend(results, 4, 0.5)["index"] == "pq"
+    assert recommend(results, 4, 1.01) is None
+
+
+def test_sweep_of_synthetic_embeddings():
+    args = Namespace(
+        chunk_store=None,
+        chunks=3000,
+        dim=32,
+        queries=50,
+        k=4,
+        target_recall=0.9,
+        nlist=[32],
+        nprobe=[1, 32],
+        pq_m=[8, 7],
+        hnsw_m=[16],
+        ef_search=[64],
+    )
+    results = run(args)
+
+    labels = [r["index"] for r in results["runs"]]
+    assert labels == [
+        "flat",
+        "ivf_flat(nlist=32,nprobe=1)",
+        "ivf_flat(nlist=32,nprobe=32)",
+        "ivf_pq(nlist=32,nprobe=1,m=8)",
+        "ivf_pq(nlist=32,nprobe=32,m=8)",
+        "hnsw(M=16,efSearch=64)",
+    ]
+    by_label = dict(zip(labels, results["runs"]))
+    # probing every list of an IVF flat index is exact search
+    assert by_label["ivf_flat(nlist=32,nprobe=32)"]["recall@4"] == 1.0
+    assert by_label["flat"]["recall@4"] == 1.0
+    assert set(results["frontier"]) <= set(labels)
+    assert results["recommended"]["recall@4"] >= 0.9
+    assert settings_code(by_label["hnsw(M=16,efSearch=64)"]["settings"]) == (
+        "IndexSettings(index_type=IndexType.HNSW, hnsw_m=16)"
+    )
@@ -0,0 +1,157 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import gc
+import weakref
+
+import pandas as pd
+import pytest
+from langchain_community.vectorstores.faiss import FAISS
+from langchain_core.documents import Document
+
+from docsassist.index_registry import BASE_VERSION, IndexRegistry
+from docsassist.index_versions import IndexWatcher, latest_version, publish, verify
+from docsassist.schema import INDEX_VERSION_COLUMN_NAME, PROMPT_COLUMN_NAME
+from docsassist.vectordb import load_faiss
+
+from .benchmarks.synthetic import fake_embeddings, synthetic_documents, write_model_dir
+
+
+def save_index(folder, text, embedding):
+    FAISS.from_documents(
+        [Document(page_content=text, metadata={"source": text})], embedding
+    ).save_local(str(folder))
+    return folder
+
+
+def test_watcher_swaps_in_new_versions(tmp_path):
+    embedding = fake_embeddings(32)
+    write_model_dir(tmp_path / "model", synthetic_documents(20), embedding)
+    registry = IndexRegistry(str(tmp_path / "model"), embedding)
+    watcher = IndexWatcher(registry, tmp_path / "versions", embedding)
+    in_flight = registry.get()
+    released = weakref.ref(in_flight)
+
+    assert not watcher.poll()
+    publish(save_index(tmp_path / "v1", "one", embedding), tmp_path / "versions", "v1")
+    assert watcher.poll()
+    assert not watcher.poll()
+
+    assert registry.version() == "v1"
+    assert registry.get().similarity_search("x", k=1)[0].page_content == "one"
+    # a request holding the old version finishes with it, then it is freed
+    assert in_flight.similarity_search("x", k=1)[0].page_content != "one"
+    del in_flight
+    gc.collect()
+    assert released() is None
+    assert watcher.last_reload_seconds is not None
+
+
+def test_swap_releases_the_preloaded_index(tmp_path):
+    from docsassist.prefork import preload, preloaded
+
+    embedding = fake_embeddings(32)
+    model_dir = tmp_path / "model"
+    write_model_dir(model_dir, synthetic_documents(20), embedding)
+    try:
+        vectorstore, _ = preload(str(model_dir), "synthetic", embedding)
+    finally:
+        gc.unfreeze()
+    registry = IndexRegistry(str(model_dir), embedding)
+    registry.pin("default", vectorstore)
+    released = weakref.ref(vectorstore)
+    del vectorstore
+
+    publish(save_index(tmp_path / "v1", "one", embedding), tmp_path / "versions", "v1")
+    assert IndexWatcher(registry, tmp_path / "versions", embedding).poll()
+    gc.collect()
+
+    assert preloaded(str(model_dir)) is None
+    assert released() is None
+
+
+def test_swapped_version_survives_eviction(tmp_path):
+    embedding = fake_embeddings(32)
+    registry = IndexRegistry(str(tmp_path), embedding, memory_budget_bytes=0)
+    folder = publish(save_index(tmp_path / "src", "two", embedding), tmp_path, "v2")
+    registry.swap("default", load_faiss(str(folder), embedding), str(folder), "v2")
+    registry.swap("other", load_faiss(str(folder), embedding), str(folder), "v2")
+
+    assert registry.loaded() == ["other"]
+    assert registry.version("default") == "v2"
+    assert registry.get().similarity_search("x", k=1)[0].page_content == "two"
+
+
+def test_corrupt_version_is_rejected_once(tmp_path):
+    embedding = fake_embeddings(32)
+    watch_dir = tmp_path / "versions"
+    folder = publish(save_index(tmp_path / "src", "three", embedding), watch_dir)
+    verify(folder)
+    with open(folder / "index.faiss", "ab") as f:
+        f.write(b"\0")
+    registry = IndexRegistry(str(tmp_path), embedding)
+    watcher = IndexWatcher(registry, watch_dir, embedding)
+
+    with pytest.raises(ValueError, match="index.faiss"):
+        watcher.poll()
+    assert not watcher.poll()
+    assert registry.version() == BASE_VERSION
+
+
+def test_publish_hides_staging_directories(tmp_path):
+    (tmp_path / ".v9.tmp").mkdir()
+    assert latest_version(tmp_path) is None
+    publish(save_index(tmp_path / "src", "four", fake_embeddings(32)), tmp_path, "v1")
+    assert latest_version(tmp_path) == tmp_path / "v1"
+    with pytest.raises(FileExistsError):
+        publish(tmp_path / "src", tmp_path, "v1")
+
+
+def test_latest_version_is_the_last_published(tmp_path):
+    source = save_index(tmp_path / "src", "five", fake_embeddings(32))
+    for version in ["v9", "v10"]:
+        publish(source, tmp_path / "versions", version)
+
+    assert latest_version(tmp_path / "versions") == tmp_path / "versions" / "v10"
+
+
+def test_score_reports_index_version(tmp_path, monkeypatch):
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import import_custom_model
+
+    embedding = fake_embeddings()
+    write_model_dir(tmp_path / "model", synthetic_documents(10), embedding)
+    monkeypatch.setenv("RAG_INDEX_WATCH_DIR", str(tmp_path / "versions"))
+    monkeypatch.setenv("RAG_INDEX_RELOAD_INTERVAL", "3600")
+    custom = import_custom_model()
+    model = custom.load_model(
+        str(tmp_path / "model"), llm=FakeChatModel(), embedding_function=embedding
+    )
+    data = pd.DataFrame({PROMPT_COLUMN_NAME: ["Which fruit?"]})
+    watcher = model[0].index_watcher
+    try:
+        assert custom.score(data, model)[INDEX_VERSION_COLUMN_NAME][0] == BASE_VERSION
+        publish(
+            save_index(tmp_path / "src", "Bananas", embedding),
+            tmp_path / "versions",
+            "v1",
+        )
+        watcher.poll()
+        result = custom.score(data, model)
+    finally:
+        watcher.stop()
+    assert result[INDEX_VERSION_COLUMN_NAME][0] == "v1"
+    assert result["CITATION_SOURCE_0"][0] == "Bananas"
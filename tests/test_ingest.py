@@ -0,0 +1,274 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import os
+import zipfile
+
+import yaml
+from langchain_core.documents import Document
+
+from docsassist import ingest
+from docsassist.artifact import content_hash, inference_files
+from docsassist.ingest import (
+    FileManifest,
+    IngestSettings,
+    build_vector_database,
+    iter_zip_chunks,
+)
+from docsassist.schema import RAGModelSettings
+from docsassist.token_window import TokenWindow, truncation_report
+from docsassist.vectordb import load_vectorstore
+
+from .benchmarks.synthetic import fake_embeddings
+from .test_incremental import CountingEmbeddings
+
+
+def load_text(name, data):
+    return [Document(page_content=data.decode("utf-8"))]
+
+
+def load_logged_text(name, data):
+    # runs in the chunking processes, which share only the file system
+    with open(os.environ["LOADED_FILES_LOG"], "a") as f:
+        f.write(f"{name}\n")
+    return load_text(name, data)
+
+
+def loaded_files(log):
+    names = log.read_text().splitlines() if log.exists() else []
+    log.unlink(missing_ok=True)
+    return sorted(name.rsplit("/", 1)[1] for name in names)
+
+
+def write_docs_zip(path, n_files):
+    with zipfile.ZipFile(path, "w") as zf:
+        for i in range(n_files):
+            paragraphs = [f"Topic {i} paragraph {j}. " * 20 for j in range(3)]
+            zf.writestr(
+                f"datarobot_docs/en/section-{i % 3}/page-{i}.txt",
+                "\n\n".join(paragraphs),
+            )
+        zf.writestr("datarobot_docs/.hidden/notes.txt", "not a document")
+        zf.writestr("__MACOSX/datarobot_docs/._page-0.txt", "not a document")
+    return path
+
+
+def test_build_vector_database(tmp_path):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 12)
+    settings = IngestSettings(chunk_size=500, chunk_overlap=0)
+    embedding = fake_embeddings(32)
+
+    report = build_vector_database(
+        docs_zip,
+        tmp_path,
+        settings,
+        workers=2,
+        embedding_function=embedding,
+        loaders={".txt": load_text},
+    )
+
+    assert report.rebuilt and report.added == 36
+    db = load_vectorstore(str(tmp_path), embedding)
+    sources = {doc.metadata["source"] for doc in db.docstore._dict.values()}
+    assert "https://docs.datarobot.com/en/docs/section-1/page-4.html" in sources
+    assert len(sources) == 12
+    with open(tmp_path / RAGModelSettings.filename()) as f:
+        model_settings = RAGModelSettings.model_validate(yaml.safe_load(f))
+    assert (
+        model_settings.embedding_model_name == settings.sentence_transformer_model_name
+    )
+
+    again = build_vector_database(
+        docs_zip,
+        tmp_path,
+        settings,
+        workers=2,
+        embedding_function=embedding,
+        loaders={".txt": load_text},
+    )
+    assert (again.added, again.unchanged) == (0, 36)
+
+
+def test_rebuild_only_chunks_changed_files(tmp_path, monkeypatch):
+    log = tmp_path / "loaded.txt"
+    monkeypatch.setenv("LOADED_FILES_LOG", str(log))
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 6)
+    settings = IngestSettings(chunk_size=500, chunk_overlap=0)
+    embedding = CountingEmbeddings(fake_embeddings(32))
+    loaders = {".txt": load_logged_text}
+    build_vector_database(
+        docs_zip, tmp_path, settings, embedding_function=embedding, loaders=loaders
+    )
+    assert embedding.embedded == 18
+    assert len(loaded_files(log)) == 6
+
+    report = build_vector_database(
+        docs_zip, tmp_path, settings, embedding_function=embedding, loaders=loaders
+    )
+    assert (report.added, report.deleted) == (0, 0)
+    assert loaded_files(log) == []
+
+    with (
+        zipfile.ZipFile(docs_zip) as old,
+        zipfile.ZipFile(tmp_path / "edited.zip", "w") as new,
+    ):
+        for name in old.namelist():
+            if name.endswith("page-1.txt"):
+                continue
+            data = old.read(name)
+            if name.endswith("page-2.txt"):
+                data = data.replace(b"paragraph 0", b"paragraph zero")
+            new.writestr(name, data)
+        new.writestr("datarobot_docs/en/section-0/page-9.txt", "A new page.")
+
+    report = build_vector_database(
+        tmp_path / "edited.zip",
+        tmp_path,
+        settings,
+        embedding_function=embedding,
+        loaders=loaders,
+    )
+    # one changed chunk of page 2 and the new page, three chunks of page 1 gone
+    assert (report.added, report.deleted, report.unchanged) == (2, 4, 14)
+    assert embedding.embedded == 20
+    assert loaded_files(log) == ["page-2.txt", "page-9.txt"]
+    files = FileManifest.load(tmp_path / "faiss_db").files
+    assert len(files) == 6 and not any(name.endswith("page-1.txt") for name in files)
+    db = load_vectorstore(str(tmp_path), embedding)
+    sources = {doc.metadata["source"] for doc in db.docstore._dict.values()}
+    assert len(db.docstore._dict) == 16 and len(sources) == 6
+
+    report = build_vector_database(
+        tmp_path / "edited.zip",
+        tmp_path,
+        IngestSettings(chunk_size=400, chunk_overlap=0),
+        embedding_function=embedding,
+        loaders=loaders,
+    )
+    assert report.rebuilt
+
+
+def test_unchanged_rebuild_keeps_the_artifact_hash(tmp_path):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 6)
+    model_dir = tmp_path / "model"
+    settings = IngestSettings(chunk_size=500, chunk_overlap=0)
+    embedding = fake_embeddings(32)
+    loaders = {".txt": load_text}
+    build_vector_database(
+        docs_zip, model_dir, settings, embedding_function=embedding, loaders=loaders
+    )
+    digest = content_hash(inference_files(model_dir))
+
+    report = build_vector_database(
+        docs_zip, model_dir, settings, embedding_function=embedding, loaders=loaders
+    )
+
+    assert not report.changed
+    assert content_hash(inference_files(model_dir)) == digest
+
+
+class WordTokenizer:
+    def tokenize(self, text):
+        return text.split()
+
+
+def test_chunks_sized_in_tokens_fit_the_embedding_window(tmp_path, caplog):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 3)
+    window = TokenWindow(WordTokenizer(), max_tokens=30)
+    embedding = fake_embeddings(32)
+    loaders = {".txt": load_text}
+
+    with caplog.at_level("INFO", logger="docsassist.ingest"):
+        build_vector_database(
+            docs_zip,
+            tmp_path / "characters",
+            IngestSettings(chunk_size=500, chunk_overlap=0),
+            embedding_function=embedding,
+            loaders=loaders,
+            token_window=window,
+        )
+    # each 80-word paragraph is a chunk of its own
+    assert "9 of 9 chunks (100.0%) are longer than the 30-token window" in caplog.text
+
+    caplog.clear()
+    with caplog.at_level("INFO", logger="docsassist.ingest"):
+        build_vector_database(
+            docs_zip,
+            tmp_path / "characters",
+            IngestSettings(chunk_size=500, chunk_overlap=0),
+            embedding_function=embedding,
+            loaders=loaders,
+            token_window=window,
+        )
+    # nothing was split again, so nothing is tokenized again
+    assert "token window" not in caplog.text
+
+    build_vector_database(
+        docs_zip,
+        tmp_path / "tokens",
+        IngestSettings(chunk_size=500, chunk_overlap=0, chunk_length="tokens"),
+        embedding_function=embedding,
+        loaders=loaders,
+        token_window=window,
+    )
+    db = load_vectorstore(str(tmp_path / "tokens"), embedding)
+    lengths = [window.length(doc.page_content) for doc in db.docstore._dict.values()]
+    assert max(lengths) <= 30 and sum(lengths) == 3 * 3 * 80
+
+
+def test_truncation_report():
+    window = TokenWindow(WordTokenizer(), max_tokens=4)
+
+    report = truncation_report(["a b c", "a b c d e f", "a b c d"], window)
+
+    assert (report.chunks, report.truncated) == (3, 1)
+    assert (report.tokens, report.dropped_tokens) == (13, 2)
+
+
+def test_text_and_markdown_load_without_unstructured(tmp_path, monkeypatch):
+    def unavailable(*args):
+        raise AssertionError("unstructured must not be used")
+
+    monkeypatch.setattr(ingest, "load_unstructured", unavailable)
+    monkeypatch.setattr(ingest, "_prepare_unstructured", unavailable)
+    docs_zip = tmp_path / "docs.zip"
+    with zipfile.ZipFile(docs_zip, "w") as zf:
+        zf.writestr("docs/notes.TXT", "\ufeffPlain notes.".encode("utf-8"))
+        zf.writestr(
+            "docs/guide.md",
+            "---\ntitle: Guide\n---\n# Install\n\nRun the installer.",
+        )
+
+    chunks = list(iter_zip_chunks(docs_zip, 500, 0, workers=1))
+
+    assert [(doc.page_content, doc.metadata["source"]) for doc in chunks] == [
+        ("Plain notes.", "docs/notes.TXT"),
+        ("# Install\n\nRun the installer.", "docs/guide.md"),
+    ]
+
+
+def test_zip_chunks_stream_in_archive_order(tmp_path):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 30)
+    chunks = iter_zip_chunks(docs_zip, 500, 0, workers=3, loaders={".txt": load_text})
+
+    first = next(chunks)
+    assert first.metadata["source"].endswith("/section-0/page-0.html")
+    pages = [first.metadata["source"]] + [doc.metadata["source"] for doc in chunks]
+    assert pages == [
+        f"https://docs.datarobot.com/en/docs/section-{i % 3}/page-{i}.html"
+        for i in range(30)
+        for _ in range(3)
+    ]
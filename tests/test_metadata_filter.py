@@ -0,0 +1,138 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from docsassist.metadata_filter import FilteredSearch, RetrievalFilter
+from docsassist.prefork import flatten_docstore
+from docsassist.schema import PROMPT_COLUMN_NAME, RETRIEVAL_FILTER_COLUMN_NAME
+from docsassist.vectordb import IndexSettings, IndexType, vectorstore_from_embeddings
+
+from .benchmarks.synthetic import SECTIONS, fake_embeddings, synthetic_vectors
+
+MLOPS_PREFIX = "https://docs.datarobot.com/en/docs/mlops/"
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return synthetic_vectors(2000, dim=64)
+
+
+def make_store(vectors, index_type, shards=1):
+    return vectorstore_from_embeddings(
+        [f"chunk {i}" for i in range(len(vectors))],
+        vectors,
+        fake_embeddings(64),
+        metadatas=[
+            {
+                "source": f"https://docs.datarobot.com/en/docs/{SECTIONS[i % 6]}/p.html",
+                "page": i % 3,
+            }
+            for i in range(len(vectors))
+        ],
+        settings=IndexSettings(index_type=index_type, pq_m=8, shards=shards),
+    )
+
+
+@pytest.mark.parametrize("shards", [1, 3])
+@pytest.mark.parametrize("index_type", list(IndexType))
+def test_filter_is_applied_during_search(vectors, index_type, shards):
+    search = FilteredSearch(make_store(vectors, index_type, shards))
+    mlops = RetrievalFilter(source_prefix=MLOPS_PREFIX)
+
+    results = search.similarity_search_with_score_by_vector(vectors[0], mlops, k=10)
+
+    assert len(results) == 10
+    assert all(doc.metadata["source"].startswith(MLOPS_PREFIX) for doc, _ in results)
+    if index_type == IndexType.FLAT:
+        # same neighbors as an exact search over the matching chunks only
+        matching = np.flatnonzero(
+            np.arange(len(vectors)) % 6 == SECTIONS.index("mlops")
+        )
+        distances = ((vectors[matching] - vectors[0]) ** 2).sum(axis=1)
+        expected = matching[np.argsort(distances)[:10]]
+        assert [doc.page_content for doc, _ in results] == [
+            f"chunk {i}" for i in expected
+        ]
+
+
+def test_bitmaps_are_cached_per_filter(vectors):
+    search = FilteredSearch(make_store(vectors, IndexType.FLAT), max_cached_filters=2)
+    page = RetrievalFilter(metadata={"page": 1})
+
+    bitmap = search.bitmap(page)
+    assert search.bitmap(RetrievalFilter.parse('{"metadata": {"page": 1}}')) is bitmap
+    assert np.unpackbits(bitmap, bitorder="little").sum() == 667
+    search.bitmap(RetrievalFilter(metadata={"page": 2}))
+    search.bitmap(RetrievalFilter(metadata={"page": 0}))
+    assert search.bitmap(page) is not bitmap
+
+
+def test_filter_works_with_flat_docstore(vectors):
+    store = flatten_docstore(make_store(vectors, IndexType.HNSW))
+    docs = FilteredSearch(store).similarity_search(
+        "anything", RetrievalFilter(source_prefix=MLOPS_PREFIX, metadata={"page": 2})
+    )
+    assert len(docs) == 4
+    assert all(doc.metadata["page"] == 2 for doc in docs)
+
+
+@pytest.mark.parametrize("value", [None, float("nan"), "", "{}"])
+def test_empty_filters_are_none(value):
+    assert RetrievalFilter.parse(value) is None
+
+
+def test_score_applies_filter_column(tmp_path):
+    from .benchmarks.fake_llm import FakeChatModel
+    from .benchmarks.synthetic import (
+        import_custom_model,
+        synthetic_documents,
+        write_model_dir,
+    )
+
+    embedding = fake_embeddings()
+    write_model_dir(tmp_path, synthetic_documents(60), embedding)
+    custom = import_custom_model()
+    model = custom.load_model(
+        str(tmp_path), llm=FakeChatModel(), embedding_function=embedding
+    )
+    result = custom.score(
+        pd.DataFrame(
+            {
+                PROMPT_COLUMN_NAME: ["How do I deploy?"] * 3,
+                RETRIEVAL_FILTER_COLUMN_NAME: [
+                    json.dumps({"source_prefix": MLOPS_PREFIX}),
+                    None,
+                    json.dumps({"section": "mlops"}),
+                ],
+            }
+        ),
+        model,
+    )
+
+    filtered = result.iloc[0]
+    assert all(
+        filtered[f"CITATION_SOURCE_{i}"].startswith(MLOPS_PREFIX) for i in range(4)
+    )
+    assert not all(
+        result.iloc[1][f"CITATION_SOURCE_{i}"].startswith(MLOPS_PREFIX)
+        for i in range(4)
+    )
+    assert "Extra inputs are not permitted" in result.iloc[2]["resultText"]
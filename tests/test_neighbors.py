@@ -0,0 +1,90 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import pytest
+import yaml
+from langchain_core.documents import Document
+
+from docsassist.index_registry import IndexRegistry, RegistryRetriever
+from docsassist.ingest import IngestSettings, build_vector_database
+from docsassist.neighbors import Neighbors, number_chunks
+from docsassist.schema import RAGModelSettings
+from docsassist.vectordb import embed_documents
+
+from .benchmarks.synthetic import fake_embeddings
+from .test_ingest import load_text, write_docs_zip
+
+
+def pages(n_pages, n_chunks):
+    documents = []
+    for page in range(n_pages):
+        chunks = [
+            Document(
+                page_content=f"page {page} chunk {i}", metadata={"source": f"p{page}"}
+            )
+            for i in range(n_chunks)
+        ]
+        number_chunks(chunks)
+        documents.extend(chunks)
+    return documents
+
+
+def test_hits_expand_to_their_neighbors():
+    documents = pages(2, 6)
+    neighbors = Neighbors(embed_documents(documents, fake_embeddings(16)))
+    hits = [documents[3], documents[6], documents[4], documents[11]]
+
+    expanded = neighbors.expand(hits, window=1)
+
+    # chunks 3 and 4 of page 0 overlap and become one document at rank 0
+    assert [doc.page_content for doc in expanded] == [
+        "page 0 chunk 2\n\npage 0 chunk 3\n\npage 0 chunk 4\n\npage 0 chunk 5",
+        "page 1 chunk 0\n\npage 1 chunk 1",
+        "page 1 chunk 4\n\npage 1 chunk 5",
+    ]
+    assert expanded[0].metadata == documents[3].metadata
+    assert neighbors.expand(hits, window=0) == hits
+
+
+def test_retriever_expands_hits_of_a_built_index(tmp_path):
+    docs_zip = write_docs_zip(tmp_path / "docs.zip", 4)
+    embedding = fake_embeddings(32)
+    settings = IngestSettings(chunk_size=500, chunk_overlap=0, neighbor_window=1)
+    build_vector_database(
+        docs_zip,
+        tmp_path,
+        settings,
+        embedding_function=embedding,
+        loaders={".txt": load_text},
+    )
+    with open(tmp_path / RAGModelSettings.filename()) as f:
+        assert RAGModelSettings.model_validate(yaml.safe_load(f)).neighbor_window == 1
+
+    retriever = RegistryRetriever(
+        registry=IndexRegistry(str(tmp_path), embedding),
+        search_kwargs={"k": 1},
+        neighbor_window=1,
+    )
+    (hit,) = retriever.invoke(("Topic 2 paragraph 0. " * 20).strip())
+    assert hit.page_content.split("\n\n") == [
+        ("Topic 2 paragraph 0. " * 20).strip(),
+        ("Topic 2 paragraph 1. " * 20).strip(),
+    ]
+
+
+def test_neighbors_need_non_overlapping_chunks():
+    with pytest.raises(ValueError, match="chunk_overlap"):
+        IngestSettings(chunk_overlap=100, neighbor_window=1)
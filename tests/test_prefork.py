@@ -0,0 +1,76 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from docsassist.prefork import flatten_docstore
+
+from .benchmarks.synthetic import PROJECT_ROOT, fake_embeddings, synthetic_documents
+
+
+def test_flat_docstore_matches_in_memory(tmp_path):
+    from langchain_community.vectorstores.faiss import FAISS
+
+    embedding = fake_embeddings(32)
+    documents = synthetic_documents(50, words_per_chunk=20)
+    documents[3].metadata["page"] = 7
+    db = FAISS.from_documents(documents, embedding)
+    query = embedding.embed_query(documents[3].page_content)
+    expected = db.similarity_search_with_score_by_vector(query, k=4)
+
+    flat = flatten_docstore(db)
+
+    assert flat.similarity_search_with_score_by_vector(query, k=4) == expected
+    assert expected[0][0].metadata == {
+        "source": documents[3].metadata["source"],
+        "page": 7,
+    }
+    assert len(flat.docstore) == len(flat.index_to_docstore_id) == 50
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/smaps_rollup"), reason="needs Linux smaps_rollup"
+)
+def test_prefork_workers_share_assets(tmp_path: Path) -> None:
+    output = tmp_path / "bench_prefork.json"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "tests.benchmarks.bench_prefork",
+            "--chunks",
+            "3000",
+            "--workers",
+            "2",
+            "--output",
+            str(output),
+        ],
+        cwd=PROJECT_ROOT,
+        check=True,
+        timeout=300,
+    )
+    workers = json.loads(output.read_text())["results"]["workers"]
+
+    for baseline, preloaded in zip(workers["no_preload"], workers["preload"]):
+        # the docstore and index are shared instead of copied into every worker
+        assert preloaded["private_bytes"] < 0.5 * baseline["private_bytes"]
+        assert preloaded["shared_bytes"] > baseline["shared_bytes"]
@@ -0,0 +1,169 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import httpx
+import openai
+import pytest
+
+from docsassist.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CircuitState,
+    DeadlinePool,
+    LLMGuard,
+    is_retryable,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _status_error(status_code):
+    request = httpx.Request("POST", "https://example.com")
+    response = httpx.Response(status_code, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_guard(clock, max_retries=3, failure_threshold=5, reset_timeout=30.0):
+    return LLMGuard(
+        max_retries=max_retries,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        breaker=CircuitBreaker(
+            failure_threshold=failure_threshold,
+            reset_timeout=reset_timeout,
+            clock=clock,
+        ),
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+
+def flaky(errors, result="ok"):
+    errors = list(errors)
+
+    def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return fn
+
+
+@pytest.mark.parametrize(
+    "exc, expected",
+    [
+        (_status_error(429), True),
+        (_status_error(503), True),
+        (_status_error(400), False),
+        (_status_error(401), False),
+        (TimeoutError(), True),
+        (ValueError(), False),
+        (CircuitOpenError(), False),
+    ],
+)
+def test_is_retryable(exc, expected):
+    assert is_retryable(exc) is expected
+
+
+def test_retries_transient_errors(clock):
+    guard = make_guard(clock)
+    with guard.track() as stats:
+        assert guard.call(flaky([_status_error(429), TimeoutError()])) == "ok"
+    assert stats.attempts == 3
+    assert stats.retries == 2
+    assert guard.breaker.state == CircuitState.CLOSED
+
+
+def test_permanent_errors_are_not_retried(clock):
+    guard = make_guard(clock)
+    with guard.track() as stats:
+        with pytest.raises(openai.APIStatusError):
+            guard.call(flaky([_status_error(400)]))
+    assert stats.attempts == 1
+
+
+def test_no_retry_past_deadline(clock):
+    guard = make_guard(clock)
+    with guard.track(timeout=0.0) as stats:
+        with pytest.raises(TimeoutError):
+            guard.call(flaky([TimeoutError()]))
+    assert stats.retries == 0
+
+
+def test_backoff_is_capped():
+    guard = make_guard(FakeClock())
+    assert all(0 <= guard.backoff(retry) <= 8.0 for retry in range(20))
+
+
+def test_circuit_opens_and_recovers(clock):
+    guard = make_guard(clock, max_retries=0, failure_threshold=2, reset_timeout=10)
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            guard.call(flaky([TimeoutError()]))
+    assert guard.breaker.state == CircuitState.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        guard.call(flaky([]))
+
+    clock.now += 10
+    assert guard.breaker.state == CircuitState.HALF_OPEN
+    assert guard.call(flaky([])) == "ok"
+    assert guard.breaker.state == CircuitState.CLOSED
+
+
+def test_failed_trial_reopens_circuit(clock):
+    guard = make_guard(clock, max_retries=0, failure_threshold=1, reset_timeout=10)
+    with pytest.raises(TimeoutError):
+        guard.call(flaky([TimeoutError()]))
+    clock.now += 10
+    with pytest.raises(TimeoutError):
+        guard.call(flaky([TimeoutError()]))
+    assert guard.breaker.state == CircuitState.OPEN
+
+
+def test_deadline_pool_rejects_calls_while_abandoned_ones_run():
+    pool = DeadlinePool(workers=1)
+    release = threading.Event()
+    late = pool.submit(release.wait)
+    with pytest.raises(FutureTimeoutError):
+        late.result(timeout=0.01)
+    pool.abandon(late)
+
+    # not queued behind the abandoned call
+    assert pool.submit(lambda: "answer") is None
+    assert (pool.abandoned, pool.rejected) == (1, 1)
+
+    release.set()
+    late.result()
+    assert pool.submit(lambda: "answer").result() == "answer"
+    pool.shutdown()
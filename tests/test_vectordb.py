@@ -0,0 +1,197 @@
+# Copyright 2024 DataRobot, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# mypy: ignore-errors
+
+import pytest
+from langchain_community.vectorstores.faiss import FAISS
+
+from docsassist.vectordb import IndexSettings, IndexType, vectorstore_from_embeddings
+
+from .benchmarks.synthetic import fake_embeddings, synthetic_vectors
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return synthetic_vectors(2000, dim=64)
+
+
+@pytest.mark.parametrize("index_type", list(IndexType))
+def test_index_types_round_trip(tmp_path, vectors, index_type):
+    embedding = fake_embeddings(64)
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+    settings = IndexSettings(index_type=index_type, pq_m=8)
+    db = vectorstore_from_embeddings(
+        texts,
+        vectors,
+        embedding,
+        metadatas=[{"source": str(i)} for i in range(len(texts))],
+        settings=settings,
+    )
+    db.save_local(str(tmp_path))
+    loaded = FAISS.load_local(
+        str(tmp_path), embedding, allow_dangerous_deserialization=True
+    )
+
+    assert loaded.index.ntotal == len(vectors)
+    docs = loaded.similarity_search_by_vector(vectors[7], k=4)
+    assert len(docs) == 4
+    if index_type != IndexType.IVF_PQ:
+        # every index but PQ stores exact vectors, so a chunk finds itself
+        assert docs[0].page_content == "chunk 7"
+        assert docs[0].metadata == {"source": "7"}
+
+
+@pytest.mark.parametrize("index_type", list(IndexType))
+def test_memory_report_index_bytes(vectors, index_type):
+    import faiss
+
+    from docsassist.memory_report import faiss_index_bytes, memory_report
+
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+    db = vectorstore_from_embeddings(
+        texts,
+        vectors,
+        fake_embeddings(64),
+        settings=IndexSettings(index_type=index_type, pq_m=8),
+    )
+    report = memory_report(db, db.embedding_function, chain={"retriever": db})
+
+    serialized = faiss.serialize_index(db.index).nbytes
+    assert report.faiss_index_bytes == faiss_index_bytes(db.index)
+    assert 0.8 * serialized <= report.faiss_index_bytes <= serialized
+    assert report.docstore_chunks == len(texts)
+    assert report.docstore_text_bytes == sum(len(t) for t in texts)
+    assert report.docstore_pickle_bytes > report.docstore_text_bytes
+    assert report.embedding_weights_bytes == 0
+    # the docstore is reported on its own, not as part of the chain
+    assert report.langchain_graph_bytes < report.docstore_object_bytes
+
+
+def test_sharded_search_matches_single_index(tmp_path, vectors):
+    from docsassist.vectordb import ShardedFAISS, load_faiss
+
+    embedding = fake_embeddings(64)
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+    single = vectorstore_from_embeddings(texts, vectors, embedding)
+    sharded = vectorstore_from_embeddings(
+        texts, vectors, embedding, settings=IndexSettings(shards=3)
+    )
+    sharded.save_local(str(tmp_path))
+    loaded = load_faiss(str(tmp_path), embedding)
+
+    assert isinstance(loaded, ShardedFAISS)
+    assert [shard.index.ntotal for shard in loaded.shards] == [667, 667, 666]
+    for query in vectors[:20]:
+        expected = single.similarity_search_with_score_by_vector(query, k=5)
+        found = loaded.similarity_search_with_score_by_vector(query, k=5)
+        assert [doc.page_content for doc, _ in found] == [
+            doc.page_content for doc, _ in expected
+        ]
+        assert [score for _, score in found] == pytest.approx(
+            [score for _, score in expected], rel=1e-5
+        )
+
+
+def test_sharded_from_texts(vectors):
+    from docsassist.vectordb import ShardedFAISS
+
+    embedding = fake_embeddings(64)
+    texts = [f"chunk {i}" for i in range(100)]
+    metadatas = [{"source": str(i)} for i in range(len(texts))]
+
+    sharded = ShardedFAISS.from_texts(
+        texts, embedding, metadatas=metadatas, settings=IndexSettings(shards=3)
+    )
+    single = ShardedFAISS.from_texts(texts, embedding, metadatas=metadatas)
+
+    assert [shard.index.ntotal for shard in sharded.shards] == [34, 33, 33]
+    assert len(single.shards) == 1
+    for db in (sharded, single):
+        (doc,) = db.similarity_search("chunk 7", k=1)
+        assert (doc.page_content, doc.metadata) == ("chunk 7", {"source": "7"})
+
+
+def test_binary_index_reranks_from_disk(tmp_path, vectors):
+    import numpy as np
+
+    from docsassist.memory_report import faiss_index_bytes
+    from docsassist.vectordb import load_faiss
+
+    embedding = fake_embeddings(64)
+    texts = [f"chunk {i}" for i in range(len(vectors))]
+    flat = vectorstore_from_embeddings(texts, vectors, embedding)
+    binary = vectorstore_from_embeddings(
+        texts,
+        vectors,
+        embedding,
+        settings=IndexSettings(index_type=IndexType.BINARY, binary_candidates=100),
+    )
+    binary.save_local(str(tmp_path))
+    loaded = load_faiss(str(tmp_path), embedding)
+
+    # one bit per dimension
+    assert faiss_index_bytes(loaded.index) == len(vectors) * 64 // 8
+    assert isinstance(loaded.rerank_vectors, np.memmap)
+    assert loaded.rerank_candidates == 100
+    hits = 0
+    for query in vectors[:50] + 0.01:
+        expected = flat.similarity_search_with_score_by_vector(query, k=4)
+        found = loaded.similarity_search_with_score_by_vector(query, k=4)
+        hits += len(
+            {doc.page_content for doc, _ in found}
+            & {doc.page_content for doc, _ in expected}
+        )
+        # re-ranked scores are exact L2 distances
+        assert [score for _, score in found] == pytest.approx(
+            sorted(
+                float(((vectors[int(doc.page_content.split()[1])] - query) ** 2).sum())
+                for doc, _ in found
+            ),
+            rel=1e-4,
+        )
+    assert hits / (50 * 4) >= 0.9
+
+
+def test_binary_index_tombstones_and_compacts(tmp_path, vectors):
+    from docsassist.vectordb import load_faiss
+
+    embedding = fake_embeddings(64)
+    ids = [f"id-{i}" for i in range(len(vectors))]
+    db = vectorstore_from_embeddings(
+        [f"chunk {i}" for i in range(len(vectors))],
+        vectors,
+        embedding,
+        settings=IndexSettings(index_type=IndexType.BINARY),
+        ids=ids,
+    )
+    db.save_local(str(tmp_path))
+    loaded = load_faiss(str(tmp_path), embedding)
+    loaded.tombstone(["id-7"])
+    loaded.add_embeddings([("new chunk", vectors[7].tolist())], ids=["new"])
+
+    assert loaded.similarity_search_by_vector(vectors[7], k=1)[0].page_content == (
+        "new chunk"
+    )
+    loaded.compact()
+    loaded.save_local(str(tmp_path))
+    reloaded = load_faiss(str(tmp_path), embedding)
+
+    assert reloaded.index.ntotal == len(vectors)
+    assert len(reloaded.rerank_vectors) == len(vectors)
+    docs = reloaded.similarity_search_by_vector(vectors[8], k=2)
+    assert docs[0].page_content == "chunk 8"
+    assert "chunk 7" not in [
+        doc.page_content for doc in reloaded.similarity_search_by_vector(vectors[7])
+    ]